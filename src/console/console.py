@@ -154,4 +154,14 @@ def clear_logs() -> None:
     mzk.call(f'rm -rf {core.LOG_DIR}/*', shell=True)
 
 
+@console.command('convert-markov-data')
+def convert_markov_data(backup: bool = True) -> None:
+    """Convert the markov dictionaries of all bots to the memory-mappable binary format."""
+    for filename in core.STORAGE_DIR.glob('*/markov.data'):
+        if mzk.convert_markov_data(filename, backup):
+            mzk.tsecho(f'Converted {filename}', fg=mzk.tcolors.GREEN)
+        else:
+            mzk.tsecho(f'Skipped {filename}, already converted.')
+
+
 # -------------------------------------------------------------------------- Console --
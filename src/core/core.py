@@ -62,5 +62,17 @@ ADD_BOT_QUERY = mzk.get_str_from_file(Path(__file__).parent.joinpath('add_bot.sq
 GET_BOTS_QUERY = mzk.get_str_from_file(Path(__file__).parent.joinpath('get_bots.sql')).replace(
     '[el]#moca_prefix#', DB_CONFIG['mysql']['prefix']
 )
+INSERT_CHAT_LOGS_QUERY = mzk.get_str_from_file(Path(__file__).parent.joinpath('insert_chat_logs.sql')).replace(
+    '[el]#moca_prefix#', DB_CONFIG['mysql']['prefix']
+)
 
 # -------------------------------------------------------------------------- Variables --
+
+# -- Functions --------------------------------------------------------------------------
+
+
+def insert_chat_logs_query(count: int) -> str:
+    """Return a query that inserts count chat logs with one statement."""
+    return INSERT_CHAT_LOGS_QUERY.replace('[el]#moca_rows#', ', '.join(('(%s, %s, %s, %s, now(), %s, %s)',) * count))
+
+# -------------------------------------------------------------------------- Functions --
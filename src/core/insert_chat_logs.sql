@@ -0,0 +1,3 @@
+insert into `[el]#moca_prefix#chat_logs`(
+  ip, bot_id, user_msg, bot_msg, time, res_type, client_id
+) values [el]#moca_rows#;
\ No newline at end of file
@@ -631,7 +631,7 @@ tweepy
 
 if __config.__LOAD_MOCA_BOT__:
     from .moca_bot import (
-        tokenizer, analyze, MocaBot
+        tokenizer, analyze, set_analyze_cache_size, analyze_cache_info, MocaBot, convert_markov_data, StudyQueue
     )
 
 """
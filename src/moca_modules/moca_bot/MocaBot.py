@@ -1,17 +1,21 @@
 # -- Imports --------------------------------------------------------------------------
 
 from typing import (
-    Union, Iterable, Tuple, List
+    Union, Iterable, Tuple, List, Dict, Optional
 )
 from random import randrange
 from pathlib import Path
+from threading import RLock, Lock
+from multiprocessing import Pool, cpu_count
 from .morph import analyze
 from .responder import (
     RandomResponder, PatternResponder, TemplateResponder, MarkovResponder,
     KeywordResponder, SpecialResponder, UserRandomResponder,
 )
 from .dictionary import Dictionary
-from ..moca_core import ENCODING
+from .keyword_index import KeywordIndex
+from .block_filter import BlockFilter
+from .ingest import read_chunks, analyze_chunk, Checkpoint
 
 # -------------------------------------------------------------------------- Imports --
 
@@ -25,10 +29,17 @@ class MocaBot(object):
     プロパティ:
     name -- 人工無脳コアの名前
     responder_name -- 現在の応答クラスの名前
+    rejected -- ブロックリストによって除外した返事の候補の数
+
+    dialogueは複数のスレッドから同時に呼び出すことができる。
+    辞書への学習と保存は_lockで1スレッドずつ行い、学習が終わるたびに辞書の読み込み用のビューを更新する。
+    返答は更新前のビューから作成するので、学習の完了を待たない。
     """
 
-    def __init__(self, name: str, data_dir: Union[Path, str]):
-        self._dictionary = Dictionary(name, data_dir)
+    def __init__(self, name: str, data_dir: Union[Path, str], random_index: bool = False):
+        """random_indexがTrueの場合、ランダム辞書はrandom.txtの行の位置だけをメモリに保持する。"""
+        self._data_dir = Path(data_dir)
+        self._dictionary = Dictionary(name, data_dir, random_index)
 
         self._responders = {
             'random': RandomResponder('random', self._dictionary),
@@ -42,96 +53,167 @@ class MocaBot(object):
 
         self._name = name
         self._responder = self._responders['random']
+        self._lock = RLock()
+        self._block_list: Optional[Tuple[Tuple[str, ...], KeywordIndex]] = None
+        self._rejected = 0
+        self._rejected_lock = Lock()
 
-    def dialogue(self, message: str, study: bool = False, config: dict = {}, responder: str = '') -> Tuple[str, str]:
+    def dialogue(
+            self,
+            message: str,
+            study: bool = False,
+            config: dict = {},
+            responder: str = '',
+            parts: Optional[List[Tuple[str, str]]] = None,
+    ) -> Tuple[str, str]:
         """
         ユーザーからの入力を受け取り、Responderに処理させた結果を返す。
         呼び出されるたびにランダムでResponderを切り替える。
         studyパラメータまたはauto_study設定がオンになっている場合のみ学習する。
+        partsにmessageの形態素解析結果を渡した場合は解析を省略する。
         設定パラメータ
             user_random_level: user_randomをレスポンダーとして使用する確率
             auto_study: studyパラメータ関係なく学習する。
             word_block_list: 返事に含ませないキーワードリスト。
+                             各Responderは候補を選ぶときにブロックされた候補を除外する。
+            block_retry_limit: ブロックされた候補を選び直す最大回数。デフォルトは8。
         """
-        parts = analyze(message)
+        parts = analyze(message) if parts is None else parts
+        block = self._block_filter(config)
         if responder == '':
-            self._responder = self._responders['special']
-            response = self._responder.response(message, parts)
+            current = self._responders['special']
+            response = current.response(message, parts, block=block)
             if response is None:
-                self._responder = self._responders['keyword']
-                response = self._responder.response(message, parts)
+                current = self._responders['keyword']
+                response = current.response(message, parts, block=block)
             if (response is None) and (config.get('user_random_level', 0) > randrange(0, 100)):
-                self._responder = self._responders['user_random']
-                response = self._responder.response(message, parts)
+                current = self._responders['user_random']
+                response = current.response(message, parts, block=block)
             if response is None:
                 limit = 3
                 while True:
                     chance = randrange(0, 100)
                     if limit <= 0:
-                        self._responder = self._responders['random']
+                        current = self._responders['random']
                     elif 0 <= chance <= 2:
-                        self._responder = self._responders['random']
+                        current = self._responders['random']
                     elif 3 <= chance <= 30:
-                        self._responder = self._responders['template']
+                        current = self._responders['template']
                     elif 31 <= chance <= 60:
-                        self._responder = self._responders['pattern']
+                        current = self._responders['pattern']
                     else:
-                        self._responder = self._responders['markov']
-                    response = self._responder.response(message, parts)
+                        current = self._responders['markov']
+                    response = current.response(message, parts, block=block)
                     if response:
                         break
                     else:
                         limit -= 1
         else:
-            self._responder = self._responders[responder]
-            response = self._responder.response(message, parts)
+            current = self._responders[responder]
+            response = current.response(message, parts, block=block)
+        self._responder = current
         if study or config.get('auto_study', False):
-            self._dictionary.study(message, parts)
-        for word in config.get('word_block_list', []):
-            if word in response:
-                return self.dialogue(message, study)
-        return self._responder.name, response
+            with self._lock:
+                if self._dictionary.study(message, parts):
+                    self._dictionary.publish()
+        if block is not None and block.rejected > 0:
+            with self._rejected_lock:
+                self._rejected += block.rejected
+        return current.name, response
+
+    def _block_filter(self, config: dict) -> Optional[BlockFilter]:
+        """
+        設定のword_block_listからBlockFilterを作成する。ブロックリストが空であればNoneを返す。
+        ブロックリストのKeywordIndexは、同じブロックリストが続く限り作り直さない。
+        """
+        words = tuple(word for word in config.get('word_block_list', ()) if word)
+        if not words:
+            return None
+        block_list = self._block_list
+        if block_list is None or block_list[0] != words:
+            block_list = (words, KeywordIndex(words))
+            self._block_list = block_list
+        return BlockFilter(block_list[1], config.get('block_retry_limit', 8))
 
     def save(self):
         """Dictionaryへの保存を行う。"""
-        self._dictionary.save()
+        with self._lock:
+            self._dictionary.save()
+
+    def compact(self) -> bool:
+        """Dictionaryのジャーナルを辞書ファイルに反映する。"""
+        return self._dictionary.compact()
 
     def study(self, message: Union[str, Iterable[str]]):
         """メッセージを学習する。"""
-        if isinstance(message, str):
-            self._dictionary.study(message, analyze(message))
-        else:
-            for item in message:
-                self._dictionary.study(item, analyze(item))
+        self.study_messages([message] if isinstance(message, str) else message)
+
+    def study_messages(self, messages: Iterable[str]) -> Tuple[int, int]:
+        """
+        メッセージをまとめて学習し、(辞書が変更されたメッセージの数, 変更されなかったメッセージの数)を返す。
+        返答の生成は行わない。保存は行わないので、呼び出し元でsaveを呼ぶこと。
+        """
+        analyzed = [(message, analyze(message)) for message in messages]
+        accepted = 0
+        with self._lock:
+            for message, parts in analyzed:
+                if self._dictionary.study(message, parts):
+                    accepted += 1
+            self._dictionary.publish()
+        return accepted, len(analyzed) - accepted
 
     def study_from_file(
             self,
             filename: Union[Path, str],
-            print_log: bool = False
+            print_log: bool = False,
+            processes: int = 0,
+            chunk_size: int = 1000,
+            checkpoint_interval: int = 100,
+            resume: bool = True,
     ) -> List[str]:
+        """
+        ファイルfilenameのメッセージを空白で分割して学習し、学習したメッセージのリストを返す。
+        形態素解析はprocesses個のプロセスで並列に行い、辞書への学習はこのスレッドでファイルの順に行う。
+        chunk_size件のメッセージをまとめて解析し、checkpoint_interval回ごとに辞書ファイルへ反映(compact)して
+        読み込み位置を記録するので、ジャーナルは一定の大きさに保たれる。resumeがTrueの場合、中断した位置から学習を再開する。
+        :param filename: 学習ファイル
+        :param print_log: 学習したメッセージと進捗を表示する
+        :param processes: 形態素解析を行うプロセス数、0以下であればCPUの数、1であればプロセスを使用しない
+        :param chunk_size: まとめて解析するメッセージの数
+        :param checkpoint_interval: 保存を行う間隔(チャンク数)
+        :param resume: チェックポイントから再開する
+        """
         res = []
-        with open(str(filename), mode='r', encoding=ENCODING) as file:
-            count = 0
-            for line in file:
-                for message in line.split():
-                    if len(message) < 3:
-                        pass
-                    elif message.startswith('#'):
-                        pass
-                    elif message.startswith('@'):
-                        pass
-                    elif message.startswith('http'):
-                        pass
-                    elif message.isdigit():
-                        pass
-                    else:
-                        parts = analyze(message)
+        total = Path(filename).stat().st_size
+        checkpoint = Checkpoint(self._data_dir.joinpath('study_checkpoint.json'), filename)
+        offset, count = checkpoint.load() if resume else (0, 0)
+        chunks = read_chunks(filename, offset, chunk_size)
+        processes = processes if processes > 0 else (cpu_count() or 1)
+        pool = Pool(processes) if processes > 1 else None
+        try:
+            results = pool.imap(analyze_chunk, chunks) if pool else map(analyze_chunk, chunks)
+            for index, (offset, analyzed) in enumerate(results, 1):
+                with self._lock:
+                    for message, parts in analyzed:
                         self._dictionary.study(message, parts)
-                        count += 1
-                        if print_log:
-                            print(message)
-                        res.append(message)
+                    self._dictionary.publish()
+                count += len(analyzed)
+                for message, _ in analyzed:
+                    if print_log:
+                        print(message)
+                    res.append(message)
+                if index % checkpoint_interval == 0:
+                    self.save()
+                    self.compact()
+                    checkpoint.save(offset, count)
+                    if print_log:
+                        print(f'{count}件のテキストを学習しました。({offset * 100 // max(total, 1)}%)')
+        finally:
+            if pool:
+                pool.terminate()
         self.save()
+        self.compact()
+        checkpoint.remove()
         if print_log:
             print(f'{count}件のテキストを学習しました。')
         return res
@@ -141,6 +223,36 @@ class MocaBot(object):
         """人工無脳インスタンスの名前"""
         return self._name
 
+    def memory_usage(self) -> int:
+        """辞書のおおよそのメモリ使用量(バイト)を返す。辞書全体をたどるので、学習中は待たされる。"""
+        with self._lock:
+            return sum(self._dictionary.memory_usage().values())
+
+    def string_report(self) -> Dict[str, int]:
+        """辞書の文字列プールによって節約したメモリ使用量のレポートを返す。"""
+        with self._lock:
+            return self._dictionary.string_report()
+
+    @property
+    def dirty(self) -> List[str]:
+        """前回のsave以降に変更された辞書の名前"""
+        return self._dictionary.dirty
+
+    @property
+    def generations(self) -> Dict[str, int]:
+        """辞書ごとの変更回数"""
+        return self._dictionary.generations
+
+    @property
+    def journal_size(self) -> int:
+        """まだ辞書ファイルに反映されていないジャーナルのサイズ"""
+        return self._dictionary.journal_size
+
+    @property
+    def rejected(self) -> int:
+        """ブロックリストによって除外した返事の候補の数"""
+        return self._rejected
+
     @property
     def responder_name(self) -> str:
         """保持しているResponderの名前"""
@@ -1,7 +1,9 @@
 # -- Imports --------------------------------------------------------------------------
 
-from .morph import tokenizer, analyze
+from .morph import tokenizer, analyze, set_analyze_cache_size, analyze_cache_info
 from .MocaBot import MocaBot
+from .markov import convert_markov_data
+from .study_queue import StudyQueue
 
 # -------------------------------------------------------------------------- Imports --
 
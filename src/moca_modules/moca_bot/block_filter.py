@@ -0,0 +1,67 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Any, Callable, Optional, Sequence, Tuple
+)
+from random import choice
+from .keyword_index import KeywordIndex
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- BlockFilter --------------------------------------------------------------------------
+
+
+class BlockFilter(object):
+    """
+    返事に含ませない単語(ブロックリスト)で返事の候補を除外するフィルター。
+    dialogueの呼び出しごとに作成し、すべてのResponderで共有する。
+    ブロックリストのKeywordIndexはMocaBotがキャッシュし、呼び出し間で共有する。
+
+    プロパティ:
+    retry -- 除外された候補を選び直す最大回数
+    rejected -- 除外した候補の数
+    _index -- ブロックリストのKeywordIndex
+    """
+
+    __slots__ = ('_index', 'retry', 'rejected')
+
+    def __init__(self, index: KeywordIndex, retry: int):
+        self._index = index
+        self.retry = retry
+        self.rejected = 0
+
+    def blocked(self, text: str) -> bool:
+        """textがブロックリストの単語を含んでいればTrueを返す。"""
+        if self._index.search(text) is None:
+            return False
+        self.rejected += 1
+        return True
+
+    def feed(self, state: int, text: str) -> Tuple[int, bool]:
+        """
+        組み立て中の文字列に続けてtextを検索し、(次のノード, ブロックリストの単語を含むか)を返す。
+        含む場合は除外した候補として数える。最初のノードは0。
+        """
+        following, found = self._index.feed(state, text)
+        if found:
+            self.rejected += 1
+        return following, found
+
+    def choose(
+            self,
+            candidates: Sequence[Any],
+            transform: Optional[Callable[[Any], str]] = None,
+    ) -> Optional[str]:
+        """
+        candidatesからランダムに選び、transformで変換した結果を返す。
+        結果がブロックリストの単語を含む場合はretry回まで選び直し、それでも見つからなければNoneを返す。
+        """
+        for _ in range(self.retry + 1):
+            candidate = choice(candidates)
+            if transform is not None:
+                candidate = transform(candidate)
+            if not self.blocked(candidate):
+                return candidate
+        return None
+
+# -------------------------------------------------------------------------- BlockFilter --
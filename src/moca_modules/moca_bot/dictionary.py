@@ -1,13 +1,27 @@
 # -- Imports --------------------------------------------------------------------------
 
 from typing import (
-    List, Tuple, Union
+    List, Tuple, Union, Optional, Dict, Set, Iterator, TextIO
 )
 from collections import defaultdict
 from pathlib import Path
 from functools import partial
+from contextlib import contextmanager
+from os import fsync, remove
 from .markov import Markov
+from .random_lines import RandomLines, RandomLineIndex, RandomLineSet
+from .journal import Journal
 from .morph import is_keyword
+from .pattern import PatternRecord
+from .template import build_template, split_template, join_template
+from .pattern_index import PatternIndex
+from .keyword_index import KeywordIndex
+from .view import FrozenPrefix, DictionaryView
+from .memory import deep_getsizeof, string_references, StringPool
+from .snapshot import (
+    DictionarySnapshot, OverlayList, OverlaySet, OverlayDict, OverlayPatterns, OverlayPatternIndex,
+    OverlayPatternLookup, OverlayPhraseSets, OverlayTemplates,
+)
 from ..moca_core import ENCODING
 try:
     from ujson import dump, load
@@ -26,22 +40,57 @@ except (ImportError, ModuleNotFoundError):
 class Dictionary(object):
     """思考エンジンの辞書クラス。
 
+    辞書ファイルのスナップショット(dictionary.snapshot)があれば、辞書ファイルを読み込まずにmmapで開く。
+    ランダム辞書、パターン辞書、テンプレート辞書、固定返事、キーワード辞書、ユーザー定義ランダム辞書は
+    スナップショットを参照し、それ以降に学習した内容だけをメモリ上に保持する。
+    スナップショットはcompactで作成し直すので、同じファイルを開いたプロセスの間で共有される。
+
+    Responderはpublishで作成した読み込み用のビュー(view)を参照する。
+    学習は1スレッドずつ行い、まとめて学習した後にpublishを呼び出すと新しいビューに置き換わる。
+
     プロパティ:
     _data_dir -- データ保存用ディレクトリ
     _name -- 辞書の名前
     _random -- ランダム辞書
-    _pattern -- パターン辞書
-    _template -- テンプレート辞書
+    _pattern -- パターン辞書、PatternRecordのリスト
+    _template -- テンプレート辞書、単語数 -> 名詞の位置で分割したセグメントのタプルのリスト
     _markov -- マルコフ辞書
     _special -- 固定返事
     _keyword -- キーワード辞書
     _user_random -- ユーザー定義ランダム辞書
+    _pattern_index -- パターン辞書の検索用インデックス、スナップショットを読み込んだ場合はOverlayPatternIndex
+    _random_set -- ランダム辞書の重複チェック用集合
+    _pattern_lookup -- 名詞 -> 最初に登録されたパターン
+    _pattern_phrases -- 名詞 -> _pattern_lookupのパターンが持つフレーズの集合
+    _template_set -- 単語数 -> テンプレート(セグメントのタプル)の集合
+    _strings -- 辞書ファイルから読み込んだ文字列と学習した文字列のプール。
+                ランダム辞書、パターン辞書、テンプレート辞書、マルコフ辞書で同じ内容の文字列を共有する
+    _snapshot -- 辞書ファイルのスナップショット。辞書ファイルから読み込んだ場合はNone
+    _random_index -- ランダム辞書をrandom.txtの行の位置のインデックス(RandomLines)で保持するかどうか
+    _journal -- 学習内容を追記するジャーナル
+    _journal_offset -- 読み込み済みのジャーナルの位置
+    _journal_records -- 読み込み時にジャーナルから反映したレコードの数
+    _generations -- 辞書の名前 -> 変更された回数
+    _flushed -- 最後にジャーナルへ書き込んだ時点の_generations
+    _written -- 最後に辞書ファイルを読み書きした時点の_generations
+    _view -- 読み込み用のビュー
+    _published -- 最後にビューを作成した時点の_generations
+
+    クラス定数:
+    NAMES -- 辞書の名前の一覧
     """
 
-    def __init__(self, name: str, data_dir: Union[str, Path]):
-        """ファイルから辞書の読み込みを行う。"""
+    NAMES: Tuple[str, ...] = ('random', 'pattern', 'template', 'markov', 'special', 'keyword', 'user_random')
+
+    def __init__(self, name: str, data_dir: Union[str, Path], random_index: bool = False):
+        """
+        ファイルから辞書の読み込みを行う。
+        random_indexがTrueの場合、ランダム辞書はrandom.txtをmmapで開いて行の位置だけをメモリに保持し、
+        学習した行はcompactでrandom.txtに追記する。スナップショットにはランダム辞書を含めない。
+        """
         self._name = name
         self._data_dir = Path(data_dir)
+        self._random_index = random_index
         self._random = None
         self._pattern = None
         self._template = None
@@ -49,168 +98,537 @@ class Dictionary(object):
         self._special = None
         self._keyword = None
         self._user_random = None
+        self._pattern_index = PatternIndex()
+        self._random_set: Set[str] = set()
+        self._pattern_lookup: Dict[str, PatternRecord] = {}
+        self._pattern_phrases: Dict[str, Set[str]] = {}
+        self._template_set: Dict[int, Set[Tuple[str, ...]]] = {}
+        self._strings = StringPool()
+        self._snapshot: Optional[DictionarySnapshot] = None
+        self._journal = Journal(self._data_dir)
+        self._journal_offset = 0
+        self._journal_records = 0
+        self._generations: Dict[str, int] = dict.fromkeys(self.NAMES, 0)
+        self._flushed: Dict[str, int] = dict(self._generations)
+        self._written: Dict[str, int] = dict(self._generations)
+        self._view: Optional[DictionaryView] = None
+        self._published: Dict[str, int] = dict(self._generations)
         self.reload()
         
     def reload(self) -> None:
-        self._random = self._load_random()
-        self._pattern = self._load_pattern()
-        self._template = self._load_template()
-        self._markov = self._load_markov()
-        self._special = self._load_special()
-        self._keyword = self._load_keyword()
-        self._user_random = self._load_user_random()
-
-    def study(self, message: str, parts: List[Tuple[str, str]]) -> None:
-        """ランダム辞書、パターン辞書、テンプレート辞書、マルコフ辞書の学習データをメモリに保存する。"""
-        self.study_random(message)
-        self.study_pattern(message, parts)
-        self.study_template(parts)
-        self.study_markov(parts)
-
-    def study_markov(self, parts: List[Tuple[str, str]]) -> None:
+        """
+        辞書ファイルまたはスナップショットを読み込み、まだ反映されていないジャーナルのレコードを適用する。
+        スナップショットが無い場合、または古い場合は辞書ファイルから読み込み、スナップショットを作成する。
+        """
+        self._journal.discard()
+        self._strings = StringPool()
+        self._journal.recover()
+        with self._journal.lock(shared=True):
+            self._snapshot = DictionarySnapshot.open(self._data_dir, not self._random_index)
+            if self._snapshot is None:
+                # 読み込み中に辞書ファイルが変更された場合はスナップショットが古いと判定されるように、先に取得する
+                stamps = DictionarySnapshot.stamps(self._data_dir, not self._random_index)
+                self._random = self._load_random()
+                self._pattern = self._load_pattern()
+                self._template = self._load_template()
+                self._special = self._load_special()
+                self._keyword = self._load_keyword()
+                self._user_random = self._load_user_random()
+                self._pattern_index = PatternIndex()
+                self._pattern_index.build(self._pattern)
+            else:
+                self._attach_snapshot()
+            self._markov = self._load_markov()
+            replay = self._journal.replay()
+        self._generations = dict.fromkeys(self.NAMES, 0)
+        self._written = dict(self._generations)
+        self._build_duplicate_indexes()
+        if self._snapshot is None:
+            with self._journal.compact_lock() as locked:
+                if locked:
+                    self._write_snapshot(stamps)
+        for record in replay:
+            self._apply(record)
+        self._flushed = dict(self._generations)
+        self._journal_offset = replay.end
+        self._journal_records = replay.count
+        self._view = None
+        self.publish()
+
+    def publish(self) -> DictionaryView:
+        """
+        学習した内容を反映した読み込み用のビューを作成し、これ以降のviewをそのビューに置き換える。
+        前回のビューから変更されていない辞書は前回のものを使う。
+        """
+        old = self._view
+        changed = [name for name in self.NAMES if old is None or self._generations[name] != self._published[name]]
+        if old is not None and not changed:
+            return old
+        keyword = self._keyword.copy() if 'keyword' in changed else old.keyword
+        self._view = DictionaryView(
+            0 if old is None else old.version + 1,
+            FrozenPrefix(self._random) if 'random' in changed else old.random,
+            FrozenPrefix(self._pattern) if 'pattern' in changed else old.pattern,
+            {
+                count: FrozenPrefix(self._template[count]) for count in list(self._template.keys())
+            } if 'template' in changed else old.template,
+            self._special.copy() if 'special' in changed else old.special,
+            keyword,
+            FrozenPrefix(self._user_random) if 'user_random' in changed else old.user_random,
+            self._markov.view() if 'markov' in changed else old.markov,
+            self._pattern_index,
+            KeywordIndex(keyword) if 'keyword' in changed else old._keyword_index,
+        )
+        self._published = dict(self._generations)
+        return self._view
+
+    @property
+    def view(self) -> DictionaryView:
+        """読み込み用のビュー。Responderはこのビューだけを参照する。"""
+        return self._view
+
+    def study(self, message: str, parts: List[Tuple[str, str]]) -> bool:
+        """
+        ランダム辞書、パターン辞書、テンプレート辞書、マルコフ辞書の学習データをメモリに保存する。
+        いずれかの辞書が変更された場合はTrueを返す。
+        """
+        if self._study(message, parts):
+            self._journal.append('study', message, parts)
+            return True
+        return False
+
+    def study_markov(self, parts: List[Tuple[str, str]]) -> bool:
         """形態素のリストpartsを受け取り、マルコフ辞書に学習させる。"""
-        self._markov.add_sentence(parts)
+        if self._study_markov(parts):
+            self._journal.append('markov', parts)
+            return True
+        return False
 
-    def study_template(self, parts: List[Tuple[str, str]]) -> None:
+    def study_template(self, parts: List[Tuple[str, str]]) -> bool:
         """
         形態素のリストpartsを受け取り、
-        名詞のみ'%noun%'に変更した文字列templateをself._templateに追加する。
+        名詞の位置で分割したセグメントのタプルtemplateをself._templateに追加する。
         名詞が存在しなかった場合、または同じtemplateが存在する場合は何もしない。
         """
-        template = ''
-        count = 0
-        for word, part in parts:
-            if is_keyword(part):
-                word = '%noun%'
-                count += 1
-            template += word
+        if self._study_template(parts):
+            self._journal.append('template', parts)
+            return True
+        return False
 
-        if count > 0 and template not in self._template[count]:
-            self._template[count].append(template)
-
-    def study_random(self, message: str) -> None:
+    def study_random(self, message: str) -> bool:
         """
         ユーザーの発言をランダム辞書に保存する。
         すでに同じ発言があった場合は何もしない。
         """
-        if message not in self._random:
-            self._random.append(message)
+        if self._study_random(message):
+            self._journal.append('random', message)
+            return True
+        return False
 
-    def study_pattern(self, message: str, parts: List[Tuple[str, str]]) -> None:
+    def study_pattern(self, message: str, parts: List[Tuple[str, str]]) -> bool:
         """ユーザーの発言を形態素partsに基づいてパターン辞書に保存する。"""
+        if self._study_pattern(message, parts):
+            self._journal.append('pattern', message, parts)
+            return True
+        return False
+
+    def _study(self, message: str, parts: List[Tuple[str, str]]) -> bool:
+        # すべての辞書に学習させるため、短絡評価しない | を使う
+        return (
+            self._study_random(message)
+            | self._study_pattern(message, parts)
+            | self._study_template(parts)
+            | self._study_markov(parts)
+        )
+
+    def _study_markov(self, parts: List[Tuple[str, str]]) -> bool:
+        if self._markov.add_sentence(parts, self._strings.intern):
+            self._touch('markov')
+            return True
+        return False
+
+    def _study_template(self, parts: List[Tuple[str, str]]) -> bool:
+        template = build_template(parts)
+        count = len(template) - 1
+        if count > 0:
+            templates = self._template_set[count]
+            if template not in templates:
+                template = tuple(map(self._strings.intern, template))
+                templates.add(template)
+                self._template[count].append(template)
+                self._touch('template')
+                return True
+        return False
+
+    def _study_random(self, message: str) -> bool:
+        if message not in self._random_set:
+            message = self._strings.intern(message)
+            self._random_set.add(message)
+            self._random.append(message)
+            self._touch('random')
+            return True
+        return False
+
+    def _study_pattern(self, message: str, parts: List[Tuple[str, str]]) -> bool:
+        changed = False
         for word, part in parts:
             if is_keyword(part):  # 品詞が名詞でなければ学習しない
                 # 単語の重複チェック
                 # 同じ単語で登録されていれば、パターンを追加する
                 # 無ければ新しいパターンを作成する
                 duplicated = self._find_duplicated_pattern(word)
-                if duplicated and message not in duplicated['phrases']:
-                    duplicated['phrases'].append(message)
+                if duplicated:
+                    phrases = self._pattern_phrases[word]
+                    if message not in phrases:
+                        message = self._strings.intern(message)
+                        phrases.add(message)
+                        if self._view is not None:
+                            self._view.freeze_phrases(duplicated)
+                        duplicated.phrases.append(message)
+                        changed = True
                 else:
-                    self._pattern.append({'pattern': word, 'phrases': [message]})
+                    word, message = self._strings.intern(word), self._strings.intern(message)
+                    pattern = PatternRecord(word, [message])
+                    self._pattern.append(pattern)
+                    self._pattern_index.add(len(self._pattern) - 1, word)
+                    self._pattern_lookup[word] = pattern
+                    self._pattern_phrases[word] = {message}
+                    changed = True
+        if changed:
+            self._touch('pattern')
+        return changed
+
+    def search_pattern(self, message: str) -> Optional[Tuple[PatternRecord, str]]:
+        """
+        messageにマッチする最初のパターンと、マッチした文字列を返す。
+        マッチするパターンが無ければNoneを返す。
+        """
+        found = self._pattern_index.search(message)
+        if found is None:
+            return None
+        index, matched = found
+        return self._pattern[index], matched
 
     def add_special(self, keyword: str, text: str) -> None:
-        """固定返事を追加する。"""
-        self._special[keyword] = text
+        """固定返事を追加し、ビューに反映する。"""
+        self._journal.append('special', keyword, text)
+        self._add_special(keyword, text)
+        self.publish()
 
     def add_keyword(self, keyword: str, text: str) -> None:
-        """キーワード返事を追加する。"""
-        self._keyword[keyword] = text
+        """キーワード返事を追加し、ビューに反映する。"""
+        self._journal.append('keyword', keyword, text)
+        self._add_keyword(keyword, text)
+        self.publish()
         
     def add_user_random(self, text: str) -> None:
-        """ユーザー定義ランダム返事を追加する。"""
+        """ユーザー定義ランダム返事を追加し、ビューに反映する。"""
+        self._journal.append('user_random', text)
+        self._add_user_random(text)
+        self.publish()
+
+    def _add_special(self, keyword: str, text: str) -> None:
+        self._special[keyword] = text
+        self._touch('special')
+
+    def _add_keyword(self, keyword: str, text: str) -> None:
+        self._keyword[keyword] = text
+        self._touch('keyword')
+
+    def _add_user_random(self, text: str) -> None:
         self._user_random.append(text)
+        self._touch('user_random')
+
+    def _touch(self, name: str) -> None:
+        """辞書nameが変更されたことを記録する。"""
+        self._generations[name] += 1
+
+    def _apply(self, record: list) -> None:
+        """ジャーナルのレコードを辞書に適用する。"""
+        operation, *args = record
+        if operation == 'study':
+            self._study(*args)
+        elif operation == 'random':
+            self._study_random(*args)
+        elif operation == 'pattern':
+            self._study_pattern(*args)
+        elif operation == 'template':
+            self._study_template(*args)
+        elif operation == 'markov':
+            self._study_markov(*args)
+        elif operation == 'special':
+            self._add_special(*args)
+        elif operation == 'keyword':
+            self._add_keyword(*args)
+        elif operation == 'user_random':
+            self._add_user_random(*args)
 
     def save(self) -> None:
-        """メモリ上の辞書をファイルに保存する。"""
-        self._save_random()
-        self._save_pattern()
-        self._save_template()
-        self._markov.save(self._data_dir.joinpath('markov.data'))
-        self._save_special()
-        self._save_keyword()
-        self._save_user_random()
+        """
+        メモリ上の学習内容をジャーナルファイルに追記する。
+        書き込み量は前回のsave以降に学習した内容に比例する。辞書ファイルへの反映はcompactで行う。
+        """
+        self._journal.flush()
+        self._flushed = dict(self._generations)
+
+    def compact(self) -> bool:
+        """
+        ジャーナルのレコードを辞書ファイルに反映し、ジャーナルから取り除く。
+        ディスク上の辞書を別のインスタンスに読み込んで書き出すので、このインスタンスの辞書は変更しない。
+        反映するレコードが無い場合、または他のプロセスがcompaction中の場合はFalseを返す。
+        """
+        with self._journal.compact_lock() as locked:
+            if not locked:
+                return False
+            dictionary = Dictionary(self._name, self._data_dir, self._random_index)
+            if dictionary._journal_records == 0:
+                return False
+            with self._journal.lock():
+                staged = dictionary._save_files()
+                self._journal.publish(dictionary._journal_offset, staged)
+                dictionary._write_snapshot(DictionarySnapshot.stamps(self._data_dir, not self._random_index))
+            if self._random_index and 'random.txt' in staged:
+                # 追記した行をインデックスに登録し、読み込み時に登録しなくて済むようにする
+                lines = RandomLines(self._data_dir.joinpath('random.txt'))
+                RandomLineIndex.update(lines, self._data_dir.joinpath('random.index'))
+                lines.close()
+            return True
+
+    @property
+    def journal_size(self) -> int:
+        """ジャーナルファイルのサイズ"""
+        return self._journal.size()
+
+    @property
+    def dirty(self) -> List[str]:
+        """前回のsave以降に変更された辞書の名前"""
+        return [name for name in self.NAMES if self._generations[name] != self._flushed[name]]
+
+    @property
+    def generations(self) -> Dict[str, int]:
+        """辞書ごとの変更回数。reloadで0に戻る。"""
+        return dict(self._generations)
+
+    def memory_usage(self) -> Dict[str, int]:
+        """
+        辞書ごとのおおよそのメモリ使用量(バイト)を返す。重複チェック用のインデックスも含む。
+        マルコフ辞書はmmapで開いているファイルを含まず、メモリ上の学習データのみ数える。
+        """
+        seen: Set[int] = set()
+        return {
+            'random': deep_getsizeof(self._random, seen) + deep_getsizeof(self._random_set, seen),
+            'pattern': (
+                deep_getsizeof(self._pattern, seen)
+                + deep_getsizeof(self._pattern_lookup, seen)
+                + deep_getsizeof(self._pattern_phrases, seen)
+                + deep_getsizeof(self._pattern_index.__dict__, seen)
+            ),
+            'template': deep_getsizeof(self._template, seen) + deep_getsizeof(self._template_set, seen),
+            'markov': self._markov.memory_usage(seen),
+            'special': deep_getsizeof(self._special, seen),
+            'keyword': deep_getsizeof(self._keyword, seen),
+            'user_random': deep_getsizeof(self._user_random, seen),
+            'string_pool': deep_getsizeof(self._strings, seen),
+        }
+
+    def string_report(self) -> Dict[str, int]:
+        """
+        文字列プールによって節約したメモリ使用量のレポートを返す。
+        strings -- プール内の文字列の数
+        pool_size -- プールの表のメモリ使用量(バイト)
+        referenced -- 辞書が保持する箇所ごとに別の文字列を持った場合の、文字列のメモリ使用量(バイト)
+        unique -- 実際の文字列のメモリ使用量(バイト)
+        saved -- referenced - unique - pool_size、文字列を共有したことで節約したメモリ使用量(バイト)
+        重複チェック用のインデックスとマルコフ辞書の単語 -> IDの辞書は、保持している文字列を参照するだけなので含まない。
+        """
+        referenced, unique = string_references([self._random, self._pattern, self._template, self._markov.words])
+        pool_size = deep_getsizeof(self._strings)
+        return {
+            'strings': len(self._strings),
+            'pool_size': pool_size,
+            'referenced': referenced,
+            'unique': unique,
+            'saved': referenced - unique - pool_size,
+        }
+
+    def _save_files(self) -> Dict[str, Optional[int]]:
+        """
+        辞書ファイルを読み込んだ後に変更された辞書だけを'<name>.compact'に書き出す。
+        書き出したファイルname -> 追記する位置(置き換える場合はNone)を返す。辞書ファイルへの反映はJournal.publishで行う。
+        """
+        savers = {
+            'random': self._save_random,
+            'pattern': self._save_pattern,
+            'template': self._save_template,
+            'markov': self._save_markov,
+            'special': self._save_special,
+            'keyword': self._save_keyword,
+            'user_random': self._save_user_random,
+        }
+        staged = {}
+        for name in self.NAMES:
+            if self._generations[name] != self._written[name]:
+                staged.update(savers[name]())
+        self._written = dict(self._generations)
+        return staged
+
+    def _write_snapshot(self, stamps: Dict[str, Optional[List[int]]]) -> None:
+        """辞書をスナップショットに書き込む。stampsは辞書ファイルを読み込んだ時点のもの。"""
+        try:
+            DictionarySnapshot.write(
+                self._data_dir, () if self._random_index else self._random, self._pattern,
+                ((count, map(join_template, templates)) for count, templates in self._template.items()),
+                self._special.items(), self._keyword.items(), self._user_random, stamps,
+            )
+        except OSError:
+            pass  # スナップショットが無くても辞書ファイルから読み込める
+
+    def _attach_snapshot(self) -> None:
+        """スナップショットを参照する辞書を作成する。"""
+        snapshot = self._snapshot
+        self._random = self._load_random() if self._random_index else OverlayList(snapshot.table('random'))
+        self._pattern = OverlayPatterns(snapshot)
+        self._template = OverlayTemplates(snapshot)
+        self._special = OverlayDict(snapshot.table('special_keys'), snapshot.table('special_values'))
+        self._keyword = OverlayDict(snapshot.table('keyword_keys'), snapshot.table('keyword_values'))
+        self._user_random = OverlayList(snapshot.table('user_random'))
+        self._pattern_index = OverlayPatternIndex(snapshot)
+
+    def _save_markov(self):
+        """マルコフ辞書を保存する。"""
+        self._markov.write(self._data_dir.joinpath('markov.data.compact'))
+        return {'markov.data': None}
+
+    @contextmanager
+    def _open_for_save(self, name: str) -> Iterator[TextIO]:
+        """ファイルnameを置き換える内容を'<name>.compact'に書き込む。"""
+        with open(str(self._data_dir.joinpath(name + '.compact')), mode='w', encoding=ENCODING) as file:
+            yield file
+            file.flush()
+            fsync(file.fileno())
 
     def _save_template(self):
         """テンプレート辞書を保存する。"""
-        filename = str(self._data_dir.joinpath('template.txt'))
-        with open(filename, mode='w', encoding=ENCODING) as file:
+        with self._open_for_save('template.txt') as file:
             for count, templates in self._template.items():
                 for template in templates:
-                    file.write('{}\t{}\n'.format(count, template))
+                    file.write('{}\t{}\n'.format(count, join_template(template)))
+        return {'template.txt': None}
 
     def _save_pattern(self):
         """パターン辞書を保存する。"""
-        filename = str(self._data_dir.joinpath('pattern.txt'))
-        with open(filename, mode='w', encoding=ENCODING) as file:
+        with self._open_for_save('pattern.txt') as file:
             for pattern in self._pattern:
                 file.write(Dictionary.pattern2line(pattern))
                 file.write('\n')
+        return {'pattern.txt': None}
 
     def _save_random(self):
-        """ランダム辞書を保存する。"""
-        filename = str(self._data_dir.joinpath('random.txt'))
-        with open(filename, mode='w', encoding=ENCODING) as file:
+        """ランダム辞書を保存する。random_indexがTrueの場合は、学習した行だけを追記する。"""
+        if self._random_index:
+            position = self._random.stage(self._data_dir.joinpath('random.txt.compact'))
+            return {} if position is None else {'random.txt': position}
+        with self._open_for_save('random.txt') as file:
             file.write('\n'.join(self.random))
+        # 行の番号が変わるので、random_indexで読み込むときにインデックスを作り直す
+        try:
+            remove(str(self._data_dir.joinpath('random.index')))
+        except FileNotFoundError:
+            pass
+        return {'random.txt': None}
 
     def _save_special(self):
         """固定返事を保存する。"""
-        filename = str(self._data_dir.joinpath('special.json'))
-        with open(filename, mode='w', encoding=ENCODING) as file:
-            dump(self._special,
+        with self._open_for_save('special.json') as file:
+            dump(dict(self._special.items()),
                  file,
                  ensure_ascii=False,
                  indent=4,
                  sort_keys=False)
+        return {'special.json': None}
 
     def _save_keyword(self):
         """キーワードを保存する。"""
-        filename = str(self._data_dir.joinpath('keyword.json'))
-        with open(filename, mode='w', encoding=ENCODING) as file:
-            dump(self._keyword,
+        with self._open_for_save('keyword.json') as file:
+            dump(dict(self._keyword.items()),
                  file,
                  ensure_ascii=False,
                  indent=4,
                  sort_keys=False)
+        return {'keyword.json': None}
 
     def _save_user_random(self):
         """ユーザー定義ランダム辞書を保存する。"""
-        filename = str(self._data_dir.joinpath('user_random.json'))
-        with open(filename, mode='w', encoding=ENCODING) as file:
-            dump(self._user_random,
+        with self._open_for_save('user_random.json') as file:
+            dump(list(self._user_random),
                  file,
                  ensure_ascii=False,
                  indent=4,
                  sort_keys=False)
+        return {'user_random.json': None}
 
     def _find_duplicated_pattern(self, word: str):
-        """パターン辞書に名詞wordがあればパターンハッシュを、無ければNoneを返す。"""
-        return next((pattern for pattern in self._pattern if pattern['pattern'] == word), None)
+        """パターン辞書に名詞wordがあればパターンを、無ければNoneを返す。"""
+        return self._pattern_lookup.get(word, None)
+
+    def _build_duplicate_indexes(self) -> None:
+        """読み込んだ辞書から重複チェック用のインデックスを作り直す。スナップショットは検索して重複をチェックする。"""
+        if self._random_index:
+            filename = self._data_dir.joinpath('random.index')
+            RandomLineIndex.update(self._random, filename)
+            self._random_set = RandomLineSet(self._random, RandomLineIndex(filename))
+        elif self._snapshot is not None:
+            self._random_set = OverlaySet(self._snapshot.table('random'))
+        else:
+            self._random_set = set(self._random)
+        if self._snapshot is not None:
+            self._pattern_lookup = OverlayPatternLookup(self._pattern)
+            self._pattern_phrases = OverlayPhraseSets(self._pattern_lookup)
+            self._template_set = self._template.sets()
+            return None
+        self._pattern_lookup = {}
+        self._pattern_phrases = {}
+        for pattern in self._pattern:
+            if pattern is not None and pattern.pattern not in self._pattern_lookup:
+                self._pattern_lookup[pattern.pattern] = pattern
+                self._pattern_phrases[pattern.pattern] = set(pattern.phrases)
+        self._template_set = defaultdict(set, {count: set(templates) for count, templates in self._template.items()})
 
     def _load_random(self):
         """
         ランダム辞書を読み込み、リストを返す。
         空である場合、[el]#moca_null#を追加する。
+        random_indexがTrueの場合は、random.txtを開いたRandomLinesを返す。
         """
         filename = str(self._data_dir.joinpath('random.txt'))
+        if self._random_index:
+            return RandomLines(filename, '[el]#moca_null#')
         try:
             with open(filename, mode='r', encoding=ENCODING) as file:
                 lines = file.read().splitlines()
-                return [message for message in lines if message != ''] if len(lines) > 0 else ['[el]#moca_null#']
+                return [
+                    self._strings.intern(message) for message in lines if message != ''
+                ] if len(lines) > 0 else ['[el]#moca_null#']
         except FileNotFoundError:
             return ['[el]#moca_null#']
 
     def _load_pattern(self):
-        """パターン辞書を読み込み、パターンハッシュのリストを返す。"""
+        """パターン辞書を読み込み、PatternRecordのリストを返す。"""
         filename = str(self._data_dir.joinpath('pattern.txt'))
         try:
             with open(filename, mode='r', encoding=ENCODING) as file:
-                return [Dictionary.line2pattern(line) for line in file.read().splitlines() if line != '']
+                patterns = [Dictionary.line2pattern(line) for line in file.read().splitlines() if line != '']
         except FileNotFoundError:
             return []
+        intern = self._strings.intern
+        for pattern in patterns:
+            if pattern is not None:
+                pattern.pattern = intern(pattern.pattern)
+                pattern.phrases = list(map(intern, pattern.phrases))
+        return patterns
 
     def _load_template(self):
-        """テンプレート辞書を読み込み、ハッシュを返す。"""
+        """テンプレート辞書を読み込み、単語数 -> セグメントのタプルのリストを返す。"""
         filename = str(self._data_dir.joinpath('template.txt'))
         templates = defaultdict(lambda: [])
         try:
@@ -219,7 +637,7 @@ class Dictionary(object):
                     count, template = line.split('\t')
                     if count and template:
                         count = int(count)
-                        templates[count].append(template)
+                        templates[count].append(tuple(map(self._strings.intern, split_template(template))))
                 return templates
         except FileNotFoundError:
             return templates
@@ -260,27 +678,27 @@ class Dictionary(object):
         return markov
 
     @staticmethod
-    def pattern2line(pattern: dict):
+    def pattern2line(pattern: PatternRecord):
         """
-        パターンのハッシュを文字列に変換する。
-        >>> pattern = {'pattern': 'Pattern', 'phrases': ['phrases', 'list']}
+        パターンを文字列に変換する。
+        >>> pattern = PatternRecord('Pattern', ['phrases', 'list'])
         >>> Dictionary.pattern2line(pattern)
         'Pattern\\tphrases|list'
         """
-        return '{}\t{}'.format(pattern['pattern'], '|'.join(pattern['phrases']))
+        return '{}\t{}'.format(pattern.pattern, '|'.join(pattern.phrases))
 
     @staticmethod
     def line2pattern(line: str):
         """
-        文字列lineを\tで分割し、{'pattern': [0], 'phrases': [1]}の形式で返す。
+        文字列lineを\tで分割し、PatternRecord([0], [1])を返す。
         [1]はさらに`|`で分割し、文字列のリストとする。
         >>> line = 'Pattern\\tphrases|list'
         >>> Dictionary.line2pattern(line)
-        {'pattern': 'Pattern', 'phrases': ['phrases', 'list']}
+        PatternRecord(pattern='Pattern', phrases=['phrases', 'list'])
         """
         pattern, phrases = line.split('\t')
         if pattern and phrases:
-            return {'pattern': pattern, 'phrases': phrases.split('|')}
+            return PatternRecord(pattern, phrases.split('|'))
 
     @property
     def random(self):
@@ -289,12 +707,12 @@ class Dictionary(object):
 
     @property
     def pattern(self):
-        """パターン辞書"""
+        """パターン辞書。要素のPatternRecordはpattern['phrases']の形式でも参照できる。"""
         return self._pattern
 
     @property
     def template(self):
-        """テンプレート辞書"""
+        """テンプレート辞書、単語数 -> セグメントのタプルのリスト"""
         return self._template
 
     @property
@@ -0,0 +1,106 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    List, Tuple, Union, Iterator
+)
+from pathlib import Path
+from os import replace
+from .morph import analyze
+from ..moca_core import ENCODING
+try:
+    from ujson import dumps, loads
+except (ImportError, ModuleNotFoundError):
+    from json import dumps, loads
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- Public Functions --------------------------------------------------------------------------
+
+
+def is_study_target(message: str) -> bool:
+    """学習ファイル内のメッセージmessageが学習対象であればTrueを返す。"""
+    if len(message) < 3:
+        return False
+    elif message.startswith('#'):
+        return False
+    elif message.startswith('@'):
+        return False
+    elif message.startswith('http'):
+        return False
+    elif message.isdigit():
+        return False
+    else:
+        return True
+
+
+def read_chunks(filename: Union[Path, str], offset: int = 0, chunk_size: int = 1000) -> Iterator[Tuple[int, List[str]]]:
+    """
+    ファイルfilenameのoffsetバイト目から学習対象のメッセージを読み込み、
+    chunk_size件ごとに(読み込んだ位置, [メッセージ])を返す。
+    読み込んだ位置は行の境界なので、そのままoffsetとして再開に使える。
+    """
+    messages = []
+    with open(str(filename), mode='rb') as file:
+        file.seek(offset)
+        for line in file:
+            offset += len(line)
+            messages.extend(
+                message for message in line.decode(ENCODING, errors='replace').split() if is_study_target(message)
+            )
+            if len(messages) >= chunk_size:
+                yield offset, messages
+                messages = []
+    if messages:
+        yield offset, messages
+
+
+def analyze_chunk(chunk: Tuple[int, List[str]]) -> Tuple[int, List[Tuple[str, Tuple[Tuple[str, str], ...]]]]:
+    """read_chunksの結果を形態素解析する。プロセスプールから呼び出される。"""
+    offset, messages = chunk
+    return offset, [(message, analyze(message)) for message in messages]
+
+# -------------------------------------------------------------------------- Public Functions --
+
+# -- Checkpoint --------------------------------------------------------------------------
+
+
+class Checkpoint(object):
+    """
+    学習ファイルの読み込み位置を保存し、中断した学習を再開できるようにする。
+    学習ファイルのパス、サイズ、更新日時が変わった場合は最初から学習する。
+
+    プロパティ:
+    _filename -- チェックポイントファイル
+    _source -- 学習ファイルのパス、サイズ、更新日時
+    """
+
+    def __init__(self, filename: Union[Path, str], source: Union[Path, str]):
+        stat = Path(source).stat()
+        self._filename = str(filename)
+        self._source = [str(Path(source).resolve()), stat.st_size, stat.st_mtime_ns]
+
+    def load(self) -> Tuple[int, int]:
+        """保存されている(読み込み位置, 学習した件数)を返す。無ければ(0, 0)を返す。"""
+        try:
+            with open(self._filename, mode='r', encoding=ENCODING) as file:
+                data = loads(file.read())
+            if data['source'] == self._source:
+                return data['offset'], data['count']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        return 0, 0
+
+    def save(self, offset: int, count: int) -> None:
+        """読み込み位置offsetと学習した件数countを保存する。"""
+        with open(self._filename + '.tmp', mode='w', encoding=ENCODING) as file:
+            file.write(dumps({'source': self._source, 'offset': offset, 'count': count}))
+        replace(self._filename + '.tmp', self._filename)
+
+    def remove(self) -> None:
+        """チェックポイントファイルを削除する。"""
+        try:
+            Path(self._filename).unlink()
+        except FileNotFoundError:
+            pass
+
+# -------------------------------------------------------------------------- Checkpoint --
@@ -0,0 +1,277 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    List, Tuple, Union, Iterator, Any, Dict, Optional, BinaryIO
+)
+from pathlib import Path
+from os import replace, fsync, remove
+from uuid import uuid4
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_NB, LOCK_UN
+from ..moca_core import ENCODING
+try:
+    from ujson import dumps, loads
+except (ImportError, ModuleNotFoundError):
+    from json import dumps as __dumps, loads
+    from functools import partial
+
+    # This is done in order to ensure that the JSON response is
+    # kept consistent across both ujson and inbuilt json usage.
+    dumps = partial(__dumps, separators=(",", ":"))
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- Journal --------------------------------------------------------------------------
+
+
+class Journal(object):
+    """
+    辞書への変更を追記するジャーナルファイル。
+    学習内容は1行1レコードのJSONとしてjournal.logへ追記し、
+    compactionで辞書ファイルへ反映した位置をsnapshot.jsonに記録する。
+    compactionは辞書ファイルを'<name>.compact'に書き出し、反映した位置と置き換えるファイルを
+    snapshot.jsonに1回で記録してから置き換える。置き換えの途中で終了した場合は、次のrecoverで完了する。
+
+    ファイル:
+    journal.log -- 1行目はジャーナルのID、2行目以降がレコード
+    snapshot.json -- 辞書ファイルに反映済みのジャーナルのIDとオフセット、置き換え中の辞書ファイル
+    journal.lock -- 追記、読み込み、compactionの反映に使うロック
+    compact.lock -- 同時に1つのプロセスだけがcompactionを行うためのロック
+
+    プロパティ:
+    _data_dir -- データ保存用ディレクトリ
+    _pending -- まだファイルに書き込んでいないレコード
+    """
+
+    def __init__(self, data_dir: Union[str, Path]):
+        self._data_dir = Path(data_dir)
+        self._pending: List[str] = []
+
+    @property
+    def filename(self) -> Path:
+        """ジャーナルファイル"""
+        return self._data_dir.joinpath('journal.log')
+
+    @property
+    def pending(self) -> int:
+        """まだファイルに書き込んでいないレコードの数"""
+        return len(self._pending)
+
+    def size(self) -> int:
+        """ジャーナルファイルのサイズ"""
+        try:
+            return self.filename.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, operation: str, *args: Any) -> None:
+        """レコードをメモリに追加する。ファイルへはflushで書き込む。"""
+        self._pending.append(dumps([operation, *args], ensure_ascii=False))
+
+    def flush(self, sync: bool = True) -> None:
+        """メモリ上のレコードをジャーナルファイルに追記する。"""
+        if not self._pending:
+            return None
+        data = ('\n'.join(self._pending) + '\n').encode(ENCODING)
+        with self.lock():
+            with open(str(self.filename), mode='a+b') as file:
+                size = file.seek(0, 2)
+                if size == 0:
+                    file.write(self._header(self._read_snapshot()[0]))
+                else:
+                    file.seek(size - 1)
+                    if file.read(1) != b'\n':
+                        file.write(b'\n')  # 書き込み途中で終了したレコードを区切る
+                file.write(data)
+                file.flush()
+                if sync:
+                    fsync(file.fileno())
+        self._pending.clear()
+
+    def discard(self) -> None:
+        """まだファイルに書き込んでいないレコードを破棄する。"""
+        self._pending.clear()
+
+    def replay(self) -> 'JournalReplay':
+        """
+        辞書ファイルに反映されていないレコードを、ファイルから読み込みながら返すJournalReplayを返す。
+        ファイルは呼び出した時点で開くので、呼び出し元はlockの中で辞書ファイルを読み込んでからreplayを呼ぶこと。
+        """
+        journal_id, offset = self._read_snapshot()
+        try:
+            file = open(str(self.filename), mode='rb')
+        except FileNotFoundError:
+            return JournalReplay(None, 0)
+        header = file.readline()
+        if not header.endswith(b'\n'):
+            file.close()
+            return JournalReplay(None, 0)
+        if header[:-1].decode(ENCODING) != journal_id:
+            # compactionの途中でジャーナルが入れ替わった場合は、先頭から読み込む
+            offset = len(header)
+        offset = max(offset, len(header))
+        file.seek(offset)
+        return JournalReplay(file, offset)
+
+    def publish(self, end: int, staged: Optional[Dict[str, Optional[int]]] = None) -> None:
+        """
+        offset endまでのレコードを辞書ファイルに反映したことを記録し、
+        反映済みのレコードをジャーナルファイルから取り除く。
+        stagedには'<name>.compact'に書き出した辞書ファイルname -> 追記する位置(置き換える場合はNone)を渡す。
+        辞書ファイルの書き込みと合わせてlockの中で呼ぶこと。
+        """
+        journal_id, _ = self._read_snapshot()
+        if staged:
+            # 反映した位置と置き換えるファイルを同時に記録するので、レコードが2回適用されることは無い
+            self._write_snapshot(journal_id, end, staged)
+            self._install(staged)
+        self._write_snapshot(journal_id, end)
+        new_id = uuid4().hex
+        try:
+            with open(str(self.filename), mode='rb') as file:
+                file.seek(end)
+                rest = file.read()
+        except FileNotFoundError:
+            rest = b''
+        temporary = str(self.filename) + '.tmp'
+        with open(temporary, mode='wb') as file:
+            file.write(self._header(new_id))
+            file.write(rest)
+            file.flush()
+            fsync(file.fileno())
+        replace(temporary, str(self.filename))
+        self._write_snapshot(new_id, len(self._header(new_id)))
+
+    def recover(self) -> None:
+        """compactionが辞書ファイルの置き換えの途中で終了していれば、置き換えを完了する。"""
+        if not self._read_staged():
+            return None
+        with self.lock():
+            staged = self._read_staged()
+            if staged:
+                self._install(staged)
+                self._write_snapshot(*self._read_snapshot())
+
+    @contextmanager
+    def lock(self, shared: bool = False) -> Iterator[None]:
+        """ジャーナルのロックを取得する。"""
+        with open(str(self._data_dir.joinpath('journal.lock')), mode='a') as file:
+            flock(file.fileno(), LOCK_SH if shared else LOCK_EX)
+            try:
+                yield None
+            finally:
+                flock(file.fileno(), LOCK_UN)
+
+    @contextmanager
+    def compact_lock(self) -> Iterator[bool]:
+        """compactionのロックを取得する。他のプロセスがcompaction中であればFalseを返す。"""
+        with open(str(self._data_dir.joinpath('compact.lock')), mode='a') as file:
+            try:
+                flock(file.fileno(), LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                yield False
+            else:
+                try:
+                    yield True
+                finally:
+                    flock(file.fileno(), LOCK_UN)
+
+    @staticmethod
+    def _header(journal_id: str) -> bytes:
+        return (journal_id + '\n').encode(ENCODING)
+
+    def _install(self, staged: Dict[str, Optional[int]]) -> None:
+        """
+        '<name>.compact'を辞書ファイルnameに反映する。位置が記録されたファイルはその位置に追記する。
+        反映済みの'<name>.compact'は削除するので、何度呼び出しても結果は同じになる。
+        """
+        for name, position in staged.items():
+            target = str(self._data_dir.joinpath(name))
+            source = target + '.compact'
+            if not Path(source).exists():
+                continue  # 反映済み
+            if position is None:
+                replace(source, target)
+                continue
+            with open(source, mode='rb') as file:
+                data = file.read()
+            with open(target, mode='a+b') as file:
+                # 途中まで追記した内容は取り除いてから追記し直す
+                file.truncate(position)
+                file.write(data)
+                file.flush()
+                fsync(file.fileno())
+            remove(source)
+
+    def _read_snapshot_file(self) -> dict:
+        try:
+            with open(str(self._data_dir.joinpath('snapshot.json')), mode='r', encoding=ENCODING) as file:
+                snapshot = loads(file.read())
+        except (FileNotFoundError, ValueError):
+            return {}
+        return snapshot if isinstance(snapshot, dict) else {}
+
+    def _read_snapshot(self) -> Tuple[str, int]:
+        snapshot = self._read_snapshot_file()
+        try:
+            return snapshot['journal'], snapshot['offset']
+        except KeyError:
+            return '', 0
+
+    def _read_staged(self) -> Dict[str, Optional[int]]:
+        return self._read_snapshot_file().get('staged') or {}
+
+    def _write_snapshot(
+            self,
+            journal_id: str,
+            offset: int,
+            staged: Optional[Dict[str, Optional[int]]] = None,
+    ) -> None:
+        filename = str(self._data_dir.joinpath('snapshot.json'))
+        snapshot = {'journal': journal_id, 'offset': offset}
+        if staged:
+            snapshot['staged'] = staged
+        with open(filename + '.tmp', mode='w', encoding=ENCODING) as file:
+            file.write(dumps(snapshot))
+            file.flush()
+            fsync(file.fileno())
+        replace(filename + '.tmp', filename)
+
+# -------------------------------------------------------------------------- Journal --
+
+# -- JournalReplay --------------------------------------------------------------------------
+
+
+class JournalReplay(object):
+    """
+    Journal.replayが開いたジャーナルファイルのレコードを1件ずつ読み込んで返すイテレータ。
+    ジャーナル全体をメモリに読み込まない。compactionでファイルが置き換えられても、開いたファイルを読み続ける。
+
+    プロパティ:
+    end -- 読み込んだレコードの次の位置
+    count -- 読み込んだレコードの数
+    _file -- 開いたジャーナルファイル、ファイルが無ければNone
+    """
+
+    def __init__(self, file: Optional[BinaryIO], offset: int):
+        self._file = file
+        self.end = offset
+        self.count = 0
+
+    def __iter__(self) -> Iterator[list]:
+        if self._file is None:
+            return None
+        with self._file as file:
+            for line in file:
+                if not line.endswith(b'\n'):
+                    break  # 書き込み途中のレコードは無視する
+                self.end += len(line)
+                try:
+                    record = loads(line.decode(ENCODING))
+                except ValueError:
+                    continue
+                self.count += 1
+                yield record
+        self._file = None
+
+# -------------------------------------------------------------------------- JournalReplay --
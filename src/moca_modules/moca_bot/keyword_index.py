@@ -0,0 +1,100 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Dict, Iterable, List, Optional, Tuple
+)
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- KeywordIndex --------------------------------------------------------------------------
+
+
+class KeywordIndex(object):
+    """
+    複数のキーワードを1回の走査で検索するAho-Corasickオートマトン。
+    キーワードには登録した順番に優先順位を付け、文字列に含まれるキーワードのうち最も先に登録したものを返す。
+    結果はキーワードを登録順に`keyword in message`で調べた場合と同じになる。
+    検索はメッセージの長さに比例し、キーワードの数に依存しない。
+
+    プロパティ:
+    _keywords -- 登録したキーワード、インデックスが優先順位
+    _goto -- ノードごとの遷移表、文字 -> ノード
+    _fail -- ノードごとの失敗時の遷移先
+    _output -- ノードとその接尾辞で終わるキーワードのうち、最も優先順位の高いもののインデックス。無ければ-1
+    """
+
+    def __init__(self, keywords: Iterable[str] = ()):
+        self._keywords: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[int] = [-1]
+        self.build(keywords)
+
+    def build(self, keywords: Iterable[str]) -> None:
+        """キーワードを登録順に受け取り、オートマトンを作り直す。"""
+        self._keywords = list(keywords)
+        goto: List[Dict[str, int]] = [{}]
+        output = [-1]
+        for priority, keyword in enumerate(self._keywords):
+            node = 0
+            for char in keyword:
+                following = goto[node].get(char)
+                if following is None:
+                    following = len(goto)
+                    goto[node][char] = following
+                    goto.append({})
+                    output.append(-1)
+                node = following
+            if output[node] == -1:
+                output[node] = priority
+        # 幅優先で失敗時の遷移先を求め、接尾辞で終わるキーワードの優先順位をまとめる
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for char, following in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                fail[following] = goto[state].get(char, 0)
+                suffix = output[fail[following]]
+                if suffix != -1 and (output[following] == -1 or suffix < output[following]):
+                    output[following] = suffix
+                queue.append(following)
+        self._goto, self._fail, self._output = goto, fail, output
+
+    def search(self, message: str) -> Optional[str]:
+        """messageに含まれるキーワードのうち、最も先に登録したものを返す。無ければNoneを返す。"""
+        goto, fail, output = self._goto, self._fail, self._output
+        best = output[0]  # 空文字列のキーワード
+        node = 0
+        for char in message:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            priority = output[node]
+            if priority != -1 and (best == -1 or priority < best):
+                best = priority
+                if best == 0:
+                    break
+        return None if best == -1 else self._keywords[best]
+
+    def feed(self, state: int, text: str) -> Tuple[int, bool]:
+        """
+        ノードstateから続けてtextを走査し、(走査後のノード, キーワードが見つかったか)を返す。
+        文字列を少しずつ組み立てながら、追加した部分だけを検索するために使う。最初のノードは0。
+        空文字列のキーワードはsearchでのみ扱う。
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        node = state
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node] != -1:
+                return node, True
+        return node, False
+
+    def __len__(self) -> int:
+        return len(self._keywords)
+
+# -------------------------------------------------------------------------- KeywordIndex --
@@ -1,16 +1,20 @@
 # -- Imports --------------------------------------------------------------------------
 
 from typing import (
-    List, Optional, Union, Tuple
+    List, Optional, Union, Tuple, Dict, Sequence, Iterator, Set, Callable
 )
-from random import choice
-from collections import defaultdict
-from copy import copy
+from random import randrange
+from array import array
+from bisect import bisect_right
+from heapq import merge
+from itertools import groupby
 from pathlib import Path
-try:
-    from cloudpickle import dump, load
-except (ImportError, ModuleNotFoundError):
-    from pickle import dump, load
+from pickle import load
+from shutil import copyfile
+from .markov_file import MarkovFile
+from .memory import deep_getsizeof
+from .block_filter import BlockFilter
+from .view import FrozenPrefix
 
 # -------------------------------------------------------------------------- Imports --
 
@@ -20,76 +24,455 @@ except (ImportError, ModuleNotFoundError):
 class Markov(object):
     """マルコフ連鎖による文章の学習・生成を行う。
 
+    単語はすべてIDに変換して保持し、(prefix1, prefix2)ごとに
+    suffixのIDとその出現回数を配列の列で保持する。
+    保存したデータはMarkovFileとしてmmapで開き、それ以降に学習した内容のみをメモリ上に保持する。
+
     クラス定数:
     END_MARK -- 文章の終わりを表す記号
     CHAIN_MAX -- 連鎖を行う最大値
+    VERSION -- 保存形式のバージョン
+    SLOT_THRESHOLD -- suffixの位置を辞書で引くようにする、行ごとのsuffixの種類数
     """
     END_MARK = '%END%'
     CHAIN_MAX = 30
+    VERSION = MarkovFile.VERSION
+    SLOT_THRESHOLD = 8
 
     def __init__(self):
         """インスタンス変数の初期化。
-        self._dic -- マルコフ辞書。 __dic['prefix1']['prefix2'] == ['suffixes']
-        self._starts -- 文章が始まる単語の数。 __starts['prefix'] == count
+        self._base -- 保存済みの辞書データ。無ければNone
+        self._base_size -- _baseに含まれる単語の数。これ以降のIDは_wordsに保持する
+        self._words -- _base以降に学習した単語のリスト。 _words[id - _base_size] == 'word'、 ID 0 はEND_MARK
+        self._word_ids -- 単語からIDへの辞書。 _word_ids['word'] == id
+        self._rows -- (prefix1, prefix2)からsuffix表の行番号への辞書。 _rows[prefix1 << 32 | prefix2] == row
+        self._seconds -- prefix1に続くprefix2のうち、_baseに無いもの。 _seconds[prefix1] == array([prefix2, ...])
+        self._first_suffixes -- 行ごとに最初に学習したsuffixのID。
+        self._first_counts -- 行ごとに最初に学習したsuffixの出現回数。
+        self._more -- 2種類目以降のsuffixを持つ行のsuffixと出現回数。 _more[row] == array([suffix, count, ...])
+        self._slots -- _moreがSLOT_THRESHOLD種類を超えた行のsuffixから_more[row]の位置への辞書。学習時に作成する。
+        self._starts -- 文章が始まる単語の数。 _starts[prefix] == count
+        self._start_keys -- 文章が始まる単語のうち、_baseに無いもののID。
+        self._cumulative -- 生成時に使用した行の累積出現回数。行が更新されると破棄する。
+        self._updates -- 行を更新した回数。生成中に更新された場合、作成した_cumulativeを破棄するために使う。
+
+        学習は1スレッドずつ行う必要があるが、生成は学習中でもロック無しで行うことができる。
+        学習は配列と辞書への追加、出現回数の加算のみで行い、既存の要素を削除しない。
         """
-        self._dic = defaultdict(lambda: defaultdict(lambda: []))
-        self._starts = defaultdict(lambda: 0)
+        self._base: Optional[MarkovFile] = None
+        self._base_size: int = 0
+        self._words: List[str] = [self.END_MARK]
+        self._word_ids: Dict[str, int] = {self.END_MARK: 0}
+        self._rows: Dict[int, int] = {}
+        self._seconds: Dict[int, array] = {}
+        self._first_suffixes: array = array('I')
+        self._first_counts: array = array('I')
+        self._more: Dict[int, array] = {}
+        self._slots: Dict[int, Dict[int, int]] = {}
+        self._starts: Dict[int, int] = {}
+        self._start_keys: array = array('I')
+        self._cumulative: Dict[int, array] = {}
+        self._updates: int = 0
 
-    def add_sentence(self, parts: List[Tuple[str, str]]) -> None:
-        """形態素解析結果partsを分解し、学習を行う。"""
+    def add_sentence(self, parts: Sequence[Tuple[str, str]], intern: Optional[Callable[[str], str]] = None) -> bool:
+        """
+        形態素解析結果partsを分解し、学習を行う。学習した場合はTrueを返す。
+        internを渡した場合、新しく登録する単語はinternが返す文字列で保持する。
+        """
         # 実装を簡単にするため、3単語以上で構成された文章のみ学習する
         if len(parts) > 3:
-            # 呼び出し元の値を変更しないように`copy`する
-            parts_copy = copy(parts)
+            words = [self._intern(word, intern) for word, _ in parts]
             # prefix1, prefix2 には文章の先頭の2単語が入る
-            prefix1, prefix2 = parts_copy.pop(0)[0], parts_copy.pop(0)[0]
-            # 文章の開始点を記録する
-            # 文章生成時に「どの単語から文章を作るか」の参考にするため
-            self._add_start(prefix1)
-            # `prefix`と`suffix`をスライドさせながら`__add_suffix`で学習させる
+            prefix1, prefix2 = words[0], words[1]
+            # `prefix`と`suffix`をスライドさせながら`_add_suffix`で学習させる
             # すべての単語を登録したら、最後にEND_MARKを追加する
-            for suffix, _ in parts_copy:
+            for suffix in words[2:]:
                 self._add_suffix(prefix1, prefix2, suffix)
                 prefix1, prefix2 = prefix2, suffix
-            self._add_suffix(prefix1, prefix2, self.END_MARK)
+            self._add_suffix(prefix1, prefix2, 0)
+            # 文章の開始点を記録する
+            # 文章生成時に「どの単語から文章を作るか」の参考にするため
+            # 生成中のスレッドが途中までの文章を選ばないように、すべての行を追加した後に記録する
+            self._add_start(words[0])
+            return True
+        return False
 
-    def generate(self, keyword: str) -> Optional[str]:
-        """keywordをprefix1とし、そこから始まる文章を生成して返す。"""
+    def generate(self, keyword: str, block: Optional[BlockFilter] = None) -> Optional[str]:
+        """
+        keywordをprefix1とし、そこから始まる文章を生成して返す。
+        blockを渡した場合は、ブロックリストの単語を作るsuffixを選び直しながら文章を生成する。
+        始めの2単語がブロックリストの単語を含む場合はNoneを返す。
+        """
+        return self._generate(keyword, block, len(self._first_suffixes), FrozenPrefix(self._start_keys))
+
+    def view(self) -> 'MarkovView':
+        """現在までに学習した内容だけを参照する、文章生成用のビューを返す。"""
+        return MarkovView(self)
+
+    def _generate(self, keyword: str, block: Optional[BlockFilter], rows: int, starts: FrozenPrefix) -> Optional[str]:
+        """行番号がrows未満の行と、開始単語startsだけを使ってgenerateを行う。"""
         # 辞書が空である場合はNoneを返す
-        if not self._dic:
+        if rows == 0 and (self._base is None or self._base.row_count == 0):
             return None
         else:
-            # keywordがprefix1として登録されていない場合、__startsからランダムに選択する
-            prefix1 = keyword if self._dic[keyword] else choice(list(self._starts.keys()))
+            # keywordがprefix1として登録されていない場合、開始単語からランダムに選択する
+            prefix1 = self._lookup(keyword)
+            if prefix1 is None or not self._has_prefix(prefix1, rows):
+                prefix1 = self._choose(self._base.start_ids if self._base else (), starts)
             # prefix1をもとにprefix2をランダムに選択する
-            prefix2 = choice(list(self._dic[prefix1].keys()))
+            prefix2 = self._choose(self._base.seconds(prefix1) if self._base else (), self._visible_seconds(prefix1, rows))
             # 文章の始めの単語2つをwordsに設定する
             words = [prefix1, prefix2]
+            state = 0
+            if block is not None:
+                state, found = block.feed(state, self._word(prefix1) + self._word(prefix2))
+                if found:
+                    return None
             # 最大CHAIN_MAX回のループを回し、単語を選択してwordsを拡張していく
-            # ランダムに選択したsuffixがENDMARKであれば終了し、単語であればwordsに追加する
+            # 出現回数に応じて選択したsuffixがEND_MARKであれば終了し、単語であればwordsに追加する
             # その後prefix1, prefix2をスライドさせて始めに戻る
             for _ in range(self.CHAIN_MAX):
-                suffix = choice(self._dic[prefix1][prefix2])
-                if suffix == self.END_MARK:
+                suffix = self._choose_suffix(prefix1, prefix2, rows)
+                if block is not None:
+                    suffix, state = self._prune_suffix(prefix1, prefix2, suffix, state, block, rows)
+                if suffix == 0:
                     break
                 words.append(suffix)
                 prefix1, prefix2 = prefix2, suffix
-            return ''.join(words)
+            return ''.join([self._word(word) for word in words])
 
     def load(self, filename: Union[Path, str]) -> None:
-        """ファイルfilenameから辞書データを読み込む。"""
-        with open(str(filename), 'rb') as file:
-            self._dic, self._starts = load(file)
+        """
+        ファイルfilenameから辞書データを読み込む。
+        バイナリ形式のファイルはmmapで開き、旧形式のデータは読み込み時に変換する。
+        """
+        if MarkovFile.is_markov_file(filename):
+            self._open(filename)
+        else:
+            with open(str(filename), 'rb') as file:
+                data = load(file)
+            if isinstance(data, tuple):
+                self._load_legacy(*data)
+            else:
+                self._load_columns(data)
 
     def save(self, filename: Union[Path, str]) -> None:
-        """ファイルfilenameへ辞書データを書き込む。"""
-        with open(str(filename), 'wb') as file:
-            dump((self._dic, self._starts), file)
+        """ファイルfilenameへ辞書データをバイナリ形式で書き込み、書き込んだファイルを開き直す。"""
+        self.write(filename)
+        self._open(filename)
 
-    def _add_suffix(self, prefix1, prefix2, suffix):
-        self._dic[prefix1][prefix2].append(suffix)
+    def write(self, filename: Union[Path, str]) -> None:
+        """ファイルfilenameへ辞書データをバイナリ形式で書き込む。このインスタンスは書き込んだファイルを開かない。"""
+        MarkovFile.write(filename, self._iter_words(), self._iter_rows(), self._iter_starts())
+
+    def memory_usage(self, seen: Optional[Set[int]] = None) -> int:
+        """メモリ上の学習データのおおよそのメモリ使用量(バイト)を返す。mmapで開いているファイルは含まない。"""
+        return deep_getsizeof([
+            self._words, self._word_ids, self._rows, self._seconds, self._first_suffixes, self._first_counts,
+            self._more, self._slots, self._starts, self._start_keys, self._cumulative,
+        ], seen)
+
+    @property
+    def words(self) -> List[str]:
+        """メモリ上に保持している単語のリスト。mmapで開いているファイルの単語は含まない。"""
+        return self._words
+
+    def _open(self, filename: Union[Path, str]) -> None:
+        """バイナリ形式のファイルを開き、メモリ上の学習データを破棄する。"""
+        base = MarkovFile(filename)
+        if self._base is not None:
+            self._base.close()
+        self.__init__()
+        self._base = base
+        self._base_size = base.word_count
+        self._words = []
+
+    def _word(self, word_id: int) -> str:
+        """IDから単語を返す。"""
+        if word_id < self._base_size:
+            return self._base.word(word_id)
+        return self._words[word_id - self._base_size]
+
+    def _lookup(self, word: str) -> Optional[int]:
+        """単語wordのIDを返す。未登録であればNoneを返す。"""
+        word_id = self._word_ids.get(word)
+        if word_id is None and self._base is not None:
+            word_id = self._base.word_id(word)
+        return word_id
+
+    def _intern(self, word: str, intern: Optional[Callable[[str], str]] = None) -> int:
+        """単語wordのIDを返す。未登録であれば登録する。internを渡した場合、登録する単語はinternが返す文字列にする。"""
+        word_id = self._word_ids.get(word)
+        if word_id is not None:
+            return word_id
+        if intern is not None:
+            word = intern(word)
+        word_id = None if self._base is None else self._base.word_id(word)
+        if word_id is None:
+            word_id = self._base_size + len(self._words)
+            self._words.append(word)
+        self._word_ids[word] = word_id
+        return word_id
+
+    def _has_prefix(self, prefix1: int, rows: int) -> bool:
+        seconds = self._seconds.get(prefix1)
+        if seconds is not None and self._rows.get(prefix1 << 32 | seconds[0], rows) < rows:
+            return True
+        return self._base is not None and self._base.has_prefix(prefix1)
+
+    def _visible(self, prefix1: int, prefix2: int, rows: int) -> bool:
+        """(prefix1, prefix2)の行が_baseにあるか、行番号がrows未満であればTrueを返す。"""
+        if self._rows.get(prefix1 << 32 | prefix2, rows) < rows:
+            return True
+        return self._base is not None and self._base.row(prefix1, prefix2) is not None
+
+    def _visible_seconds(self, prefix1: int, rows: int) -> Sequence[int]:
+        """_seconds[prefix1]のうち、行番号がrows未満の行のprefix2を返す。"""
+        seconds = self._seconds.get(prefix1, ())
+        if not seconds or self._rows.get(prefix1 << 32 | seconds[-1], rows) < rows:
+            return seconds
+        # _secondsには行番号の順に追加するので、rows未満の行は先頭から連続する
+        low, high = 0, len(seconds) - 1
+        while low < high:
+            middle = (low + high) // 2
+            row = self._rows.get(prefix1 << 32 | seconds[middle])
+            if row is not None and row < rows:
+                low = middle + 1
+            else:
+                high = middle
+        return FrozenPrefix(seconds, low)
+
+    def _add_suffix(self, prefix1: int, prefix2: int, suffix: int, count: int = 1) -> None:
+        key = prefix1 << 32 | prefix2
+        row = self._rows.get(key)
+        if row is None:
+            # 生成中のスレッドが参照できるように、行のデータを追加してから_rowsと_secondsに登録する
+            self._first_suffixes.append(suffix)
+            self._first_counts.append(count)
+            self._rows[key] = len(self._first_suffixes) - 1
+            if self._base is None or self._base.row(prefix1, prefix2) is None:
+                seconds = self._seconds.get(prefix1)
+                if seconds is None:
+                    self._seconds[prefix1] = array('I', (prefix2,))
+                else:
+                    seconds.append(prefix2)
+        elif self._first_suffixes[row] == suffix:
+            self._first_counts[row] += count
+            self._updates += 1
+            self._cumulative.pop(row, None)
+        else:
+            more = self._more.get(row)
+            if more is None:
+                self._more[row] = array('I', (suffix, count))
+            else:
+                slots = self._slots.get(row)
+                if slots is None and len(more) > self.SLOT_THRESHOLD * 2:
+                    slots = self._slots[row] = {more[index]: index for index in range(0, len(more), 2)}
+                if slots is not None:
+                    index = slots.get(suffix, -1)
+                else:
+                    index = self._find_slot(more, suffix)
+                if index == -1:
+                    if slots is not None:
+                        slots[suffix] = len(more)
+                    more.extend((suffix, count))
+                else:
+                    more[index + 1] += count
+            # 更新した後に破棄する。生成中のスレッドが更新前の値で作成した場合は、生成側で破棄する
+            self._updates += 1
+            self._cumulative.pop(row, None)
+
+    @staticmethod
+    def _find_slot(more: array, suffix: int) -> int:
+        """_more[row]の中でsuffixの位置を返す。無ければ-1"""
+        for index in range(0, len(more), 2):
+            if more[index] == suffix:
+                return index
+        return -1
+
+    def _add_start(self, prefix1: int, count: int = 1) -> None:
+        if prefix1 in self._starts:
+            self._starts[prefix1] += count
+        else:
+            self._starts[prefix1] = count
+            if self._base is None or not self._base.has_start(prefix1):
+                self._start_keys.append(prefix1)
 
-    def _add_start(self, prefix1):
-        self._starts[prefix1] += 1
+    @staticmethod
+    def _choose(base: Sequence[int], overlay: Sequence[int]) -> int:
+        """baseとoverlayを連結した候補から一様に選択する。"""
+        index = randrange(len(base) + len(overlay))
+        return base[index] if index < len(base) else overlay[index - len(base)]
+
+    def _choose_suffix(self, prefix1: int, prefix2: int, rows: int) -> int:
+        """
+        出現回数で重み付けしてsuffixを選択する。行番号がrows以上の行は参照しない。
+        2種類目以降のsuffixに続く行がまだ参照できない場合は、学習中の文章のsuffixなので選び直す。
+        """
+        base_row = None if self._base is None else self._base.row(prefix1, prefix2)
+        base_total = 0 if base_row is None else self._base.total(base_row)
+        row = self._rows.get(prefix1 << 32 | prefix2, rows)
+        if row >= rows:
+            if base_row is None:
+                return 0
+            return self._base.suffix(base_row, randrange(base_total))
+        more = self._more.get(row)
+        if more is None:
+            if base_total == 0:
+                return self._first_suffixes[row]
+            cumulative = (self._first_counts[row],)
+        else:
+            cumulative = self._cumulative.get(row)
+            if cumulative is None:
+                updates = self._updates
+                cumulative = array('Q', (self._first_counts[row],))
+                for index in range(1, len(more), 2):
+                    cumulative.append(cumulative[-1] + more[index])
+                self._cumulative[row] = cumulative
+                if self._updates != updates:
+                    self._cumulative.pop(row, None)  # 作成中に学習された
+        for _ in range(self.CHAIN_MAX):
+            point = randrange(base_total + cumulative[-1])
+            if point < base_total:
+                return self._base.suffix(base_row, point)
+            index = bisect_right(cumulative, point - base_total)
+            if index == 0:
+                return self._first_suffixes[row]
+            suffix = more[index * 2 - 2]
+            if suffix == 0 or self._visible(prefix2, suffix, rows):
+                return suffix
+        return 0
+
+    def _prune_suffix(
+            self,
+            prefix1: int,
+            prefix2: int,
+            suffix: int,
+            state: int,
+            block: BlockFilter,
+            rows: int,
+    ) -> Tuple[int, int]:
+        """
+        生成中の文章にsuffixを追加するとブロックリストの単語を含む場合、block.retry回までsuffixを選び直す。
+        (suffix, 追加後のblockのノード)を返す。選び直せなかった場合はEND_MARKを返して文章を終える。
+        """
+        for _ in range(block.retry + 1):
+            if suffix == 0:
+                break
+            following, found = block.feed(state, self._word(suffix))
+            if not found:
+                return suffix, following
+            suffix = self._choose_suffix(prefix1, prefix2, rows)
+        return 0, state
+
+    def _iter_words(self) -> Iterator[str]:
+        """すべての単語をIDの順に返す。"""
+        for word_id in range(self._base_size):
+            yield self._base.word(word_id)
+        yield from self._words
+
+    def _iter_rows(self) -> Iterator[Tuple[int, int, List[Tuple[int, int]]]]:
+        """_baseとメモリ上の学習データを合わせた(prefix1, prefix2, [(suffix, 出現回数)])をキーの順に返す。"""
+        base_rows = () if self._base is None else (
+            (prefix1 << 32 | prefix2, 0, row) for prefix1, prefix2, row in self._base.rows()
+        )
+        rows = ((key, 1, row) for key, row in sorted(self._rows.items()))
+        for key, items in groupby(merge(base_rows, rows), key=lambda item: item[0]):
+            entries: Dict[int, int] = {}
+            for _, source, row in items:
+                if source == 0:
+                    entries.update(self._base.entries(row))
+                else:
+                    suffix = self._first_suffixes[row]
+                    entries[suffix] = entries.get(suffix, 0) + self._first_counts[row]
+                    more = self._more.get(row, ())
+                    for index in range(0, len(more), 2):
+                        entries[more[index]] = entries.get(more[index], 0) + more[index + 1]
+            yield key >> 32, key & 0xFFFFFFFF, list(entries.items())
+
+    def _iter_starts(self) -> Iterator[Tuple[int, int]]:
+        """_baseとメモリ上の学習データを合わせた(文章が始まる単語のID, 数)を返す。"""
+        starts = {} if self._base is None else dict(self._base.starts())
+        for word_id, count in self._starts.items():
+            starts[word_id] = starts.get(word_id, 0) + count
+        return iter(starts.items())
+
+    def _load_columns(self, data: dict) -> None:
+        """バージョン2の形式(配列をpickleしたもの)のデータを読み込む。"""
+        self.__init__()
+        self._words = data['words']
+        self._word_ids = {word: word_id for word_id, word in enumerate(self._words)}
+        self._rows = {key: row for row, key in enumerate(data['keys'])}
+        for key in data['keys']:
+            seconds = self._seconds.get(key >> 32)
+            if seconds is None:
+                self._seconds[key >> 32] = array('I', (key & 0xFFFFFFFF,))
+            else:
+                seconds.append(key & 0xFFFFFFFF)
+        self._first_suffixes = data['first_suffixes']
+        self._first_counts = data['first_counts']
+        offsets, more = data['more_offsets'], data['more']
+        for index, row in enumerate(data['more_rows']):
+            self._more[row] = more[offsets[index]:offsets[index + 1]]
+        self._starts = dict(zip(data['starts'], data['start_counts']))
+        self._start_keys = array('I', data['starts'])
+
+    def _load_legacy(self, dic: dict, starts: dict) -> None:
+        """旧形式(__dic['prefix1']['prefix2'] == ['suffixes'])のデータを読み込む。"""
+        self.__init__()
+        for prefix1, seconds in dic.items():
+            for prefix2, suffixes in seconds.items():
+                for suffix in suffixes:
+                    self._add_suffix(self._intern(prefix1), self._intern(prefix2), self._intern(suffix))
+        for prefix1, count in starts.items():
+            self._add_start(self._intern(prefix1), count)
 
 # -------------------------------------------------------------------------- Markov --
+
+# -- MarkovView --------------------------------------------------------------------------
+
+
+class MarkovView(object):
+    """
+    Markovの作成した時点の行と開始単語だけを参照する、文章生成用のビュー。
+    作成後に学習した文章は、途中までしか学習されていない状態でも生成に使われない。
+    既存の行に後から追加されたsuffixは、続く行が参照できるようになるまで選ばない。出現回数の加算はそのまま反映される。
+
+    プロパティ:
+    _markov -- 参照するMarkov
+    _rows -- 作成した時点の行数
+    _starts -- 作成した時点の開始単語
+    """
+
+    __slots__ = ('_markov', '_rows', '_starts')
+
+    def __init__(self, markov: Markov):
+        self._markov = markov
+        self._rows = len(markov._first_suffixes)
+        self._starts = FrozenPrefix(markov._start_keys)
+
+    def generate(self, keyword: str, block: Optional[BlockFilter] = None) -> Optional[str]:
+        """Markov.generateと同じ。"""
+        return self._markov._generate(keyword, block, self._rows, self._starts)
+
+# -------------------------------------------------------------------------- MarkovView --
+
+# -- Public Functions --------------------------------------------------------------------------
+
+
+def convert_markov_data(filename: Union[Path, str], backup: bool = True) -> bool:
+    """
+    旧形式(pickle)のマルコフ辞書ファイルをバイナリ形式に変換する。
+    backupがTrueの場合、元のファイルをfilename.bakとして残す。
+    変換した場合はTrueを、すでにバイナリ形式であった場合はFalseを返す。
+    """
+    if MarkovFile.is_markov_file(filename):
+        return False
+    markov = Markov()
+    markov.load(filename)
+    if backup:
+        copyfile(str(filename), str(filename) + '.bak')
+    markov.save(filename)
+    return True
+
+# -------------------------------------------------------------------------- Public Functions --
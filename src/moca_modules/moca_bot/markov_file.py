@@ -0,0 +1,242 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+)
+from array import array
+from bisect import bisect_left, bisect_right
+from mmap import mmap, ACCESS_READ
+from os import replace, fsync
+from pathlib import Path
+from struct import Struct
+from ..moca_core import ENCODING
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- MarkovFile --------------------------------------------------------------------------
+
+
+class MarkovFile(object):
+    """
+    マルコフ辞書のバイナリファイル。mmapで開き、必要な部分だけを読み込む。
+    複数のプロセスで同じファイルを開いた場合、OSのページキャッシュが共有される。
+
+    ファイル形式:
+    ヘッダー -- MAGIC, バージョン, バイトオーダー確認用の値, 各セクションの要素数と位置
+    words -- 単語のオフセット(uint64)とUTF-8で連結した単語
+    word_order -- バイト列順に並べた単語ID(uint32)、単語からIDを二分探索する
+    prefix_offsets -- prefix1ごとの行の範囲(uint64)、行は(prefix1, prefix2)の順に並んでいる
+    row_seconds -- 行ごとのprefix2(uint32)
+    row_offsets -- 行ごとのsuffixの範囲(uint64)
+    suffixes -- suffixのID(uint32)
+    cumulative -- 行ごとの累積出現回数(uint64)
+    start_ids -- 文章が始まる単語のID(uint32)、ID順
+    start_counts -- 文章が始まる単語の数(uint64)
+
+    クラス定数:
+    MAGIC -- ファイルの先頭に書き込まれるバイト列
+    VERSION -- ファイル形式のバージョン
+    """
+
+    MAGIC: bytes = b'MOCAMKV\x00'
+    VERSION: int = 3
+    _BYTE_ORDER_MARK: int = 0x01020304
+    _SECTIONS: Tuple[Tuple[str, str], ...] = (
+        ('word_offsets', 'Q'),
+        ('word_data', 'B'),
+        ('word_order', 'I'),
+        ('prefix_offsets', 'Q'),
+        ('row_seconds', 'I'),
+        ('row_offsets', 'Q'),
+        ('suffixes', 'I'),
+        ('cumulative', 'Q'),
+        ('start_ids', 'I'),
+        ('start_counts', 'Q'),
+    )
+    _HEADER: Struct = Struct('=8sII' + 'Q' * (len(_SECTIONS) * 2))
+
+    def __init__(self, filename: Union[Path, str]):
+        """ファイルfilenameをmmapで開く。"""
+        self._filename = str(filename)
+        with open(self._filename, 'rb') as file:
+            self._mmap = mmap(file.fileno(), 0, access=ACCESS_READ)
+        magic, version, mark, *sections = self._HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{self._filename} is not a markov file.')
+        if version != self.VERSION or mark != self._BYTE_ORDER_MARK:
+            self._mmap.close()
+            raise ValueError(f'Unsupported markov file. <version: {version}>')
+        self._buffer = memoryview(self._mmap)
+        self._views: List[memoryview] = []
+        for index, (name, typecode) in enumerate(self._SECTIONS):
+            offset, size = sections[index * 2], sections[index * 2 + 1]
+            view = self._buffer[offset:offset + size]
+            if typecode != 'B':
+                view = view.cast(typecode)
+            self._views.append(view)
+            setattr(self, '_' + name, view)
+
+    @classmethod
+    def is_markov_file(cls, filename: Union[Path, str]) -> bool:
+        """filenameがこの形式のファイルであればTrueを返す。"""
+        with open(str(filename), 'rb') as file:
+            return file.read(len(cls.MAGIC)) == cls.MAGIC
+
+    def close(self) -> None:
+        """mmapを閉じる。"""
+        for view in self._views:
+            view.release()
+        self._buffer.release()
+        self._mmap.close()
+
+    @property
+    def word_count(self) -> int:
+        """単語の数"""
+        return len(self._word_order)
+
+    @property
+    def row_count(self) -> int:
+        """(prefix1, prefix2)の組み合わせの数"""
+        return len(self._row_seconds)
+
+    @property
+    def start_ids(self) -> Sequence[int]:
+        """文章が始まる単語のID"""
+        return self._start_ids
+
+    def word(self, word_id: int) -> str:
+        """IDから単語を返す。"""
+        return self._word_bytes(word_id).decode(ENCODING)
+
+    def word_id(self, word: str) -> Optional[int]:
+        """単語のIDを返す。登録されていなければNoneを返す。"""
+        target = word.encode(ENCODING)
+        order = self._word_order
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._word_bytes(order[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and self._word_bytes(order[low]) == target:
+            return order[low]
+        return None
+
+    def has_prefix(self, prefix1: int) -> bool:
+        """prefix1から始まる行があればTrueを返す。"""
+        return prefix1 < self.word_count and self._prefix_offsets[prefix1] < self._prefix_offsets[prefix1 + 1]
+
+    def seconds(self, prefix1: int) -> Sequence[int]:
+        """prefix1に続くprefix2のIDを返す。"""
+        if prefix1 >= self.word_count:
+            return ()
+        return self._row_seconds[self._prefix_offsets[prefix1]:self._prefix_offsets[prefix1 + 1]]
+
+    def row(self, prefix1: int, prefix2: int) -> Optional[int]:
+        """(prefix1, prefix2)の行番号を返す。無ければNoneを返す。"""
+        if prefix1 >= self.word_count:
+            return None
+        start, end = self._prefix_offsets[prefix1], self._prefix_offsets[prefix1 + 1]
+        index = bisect_left(self._row_seconds, prefix2, start, end)
+        if index < end and self._row_seconds[index] == prefix2:
+            return index
+        return None
+
+    def total(self, row: int) -> int:
+        """行の出現回数の合計を返す。"""
+        return self._cumulative[self._row_offsets[row + 1] - 1]
+
+    def suffix(self, row: int, point: int) -> int:
+        """行の累積出現回数がpointを超える位置のsuffixを返す。"""
+        index = bisect_right(self._cumulative, point, self._row_offsets[row], self._row_offsets[row + 1])
+        return self._suffixes[index]
+
+    def entries(self, row: int) -> Iterator[Tuple[int, int]]:
+        """行の(suffix, 出現回数)を返す。"""
+        previous = 0
+        for index in range(self._row_offsets[row], self._row_offsets[row + 1]):
+            yield self._suffixes[index], self._cumulative[index] - previous
+            previous = self._cumulative[index]
+
+    def rows(self) -> Iterator[Tuple[int, int, int]]:
+        """(prefix1, prefix2, 行番号)を行の順番に返す。"""
+        prefix_offsets = self._prefix_offsets
+        for prefix1 in range(self.word_count):
+            for row in range(prefix_offsets[prefix1], prefix_offsets[prefix1 + 1]):
+                yield prefix1, self._row_seconds[row], row
+
+    def has_start(self, word_id: int) -> bool:
+        """word_idが文章の開始単語であればTrueを返す。"""
+        index = bisect_left(self._start_ids, word_id)
+        return index < len(self._start_ids) and self._start_ids[index] == word_id
+
+    def starts(self) -> Iterator[Tuple[int, int]]:
+        """(文章が始まる単語のID, 数)を返す。"""
+        return zip(self._start_ids, self._start_counts)
+
+    def _word_bytes(self, word_id: int) -> bytes:
+        return self._word_data[self._word_offsets[word_id]:self._word_offsets[word_id + 1]].tobytes()
+
+    @classmethod
+    def write(
+            cls,
+            filename: Union[Path, str],
+            words: Iterable[str],
+            rows: Iterable[Tuple[int, int, Iterable[Tuple[int, int]]]],
+            starts: Iterable[Tuple[int, int]],
+    ) -> None:
+        """
+        マルコフ辞書をファイルに書き込む。
+        一時ファイルに書き込んだ後に置き換えるので、読み込み中のプロセスに影響しない。
+        :param filename: 書き込み先のファイル
+        :param words: IDの順に並んだ単語
+        :param rows: (prefix1, prefix2, [(suffix, 出現回数)])、(prefix1, prefix2)の順に並んでいること
+        :param starts: (文章が始まる単語のID, 数)
+        """
+        encoded = [word.encode(ENCODING) for word in words]
+        word_offsets = array('Q', (0,))
+        for word in encoded:
+            word_offsets.append(word_offsets[-1] + len(word))
+        word_order = array('I', sorted(range(len(encoded)), key=encoded.__getitem__))
+        prefix_offsets = array('Q', (0,))
+        row_seconds = array('I')
+        row_offsets = array('Q', (0,))
+        suffixes = array('I')
+        cumulative = array('Q')
+        for prefix1, prefix2, entries in rows:
+            while len(prefix_offsets) <= prefix1:
+                prefix_offsets.append(len(row_seconds))
+            row_seconds.append(prefix2)
+            total = 0
+            for suffix, count in entries:
+                total += count
+                suffixes.append(suffix)
+                cumulative.append(total)
+            row_offsets.append(len(suffixes))
+        while len(prefix_offsets) <= len(encoded):
+            prefix_offsets.append(len(row_seconds))
+        starts = sorted(starts)
+        sections = (
+            word_offsets, b''.join(encoded), word_order, prefix_offsets, row_seconds, row_offsets,
+            suffixes, cumulative, array('I', (word_id for word_id, _ in starts)),
+            array('Q', (count for _, count in starts)),
+        )
+        temporary = str(filename) + '.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(b'\x00' * cls._HEADER.size)
+            positions = []
+            for section in sections:
+                file.write(b'\x00' * (-file.tell() % 8))
+                positions.append(file.tell())
+                data = section.tobytes() if isinstance(section, array) else section
+                positions.append(len(data))
+                file.write(data)
+            file.seek(0)
+            file.write(cls._HEADER.pack(cls.MAGIC, cls.VERSION, cls._BYTE_ORDER_MARK, *positions))
+            file.flush()
+            fsync(file.fileno())
+        replace(temporary, str(filename))
+
+# -------------------------------------------------------------------------- MarkovFile --
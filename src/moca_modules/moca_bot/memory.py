@@ -0,0 +1,109 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Any, Dict, List, Optional, Set, Tuple
+)
+from sys import getsizeof
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- Private Functions --------------------------------------------------------------------------
+
+
+def _slot_values(obj: Any) -> List[Any]:
+    """objの__slots__の属性の値を返す。__slots__が無ければ空のリストを返す。"""
+    slots = getattr(type(obj), '__slots__', ())
+    return [getattr(obj, name) for name in ((slots,) if isinstance(slots, str) else slots) if hasattr(obj, name)]
+
+# -------------------------------------------------------------------------- Private Functions --
+
+# -- Public Functions --------------------------------------------------------------------------
+
+
+def deep_getsizeof(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    objと、objが持つ要素のメモリ使用量の合計(バイト)を返す。
+    dict, list, tuple, set, frozensetの要素と、__slots__を持つオブジェクトの属性をたどり、同じオブジェクトは1回だけ数える。
+    複数の辞書で共有しているオブジェクトを重複して数えないように、seenを共有して呼び出すことができる。
+    """
+    if seen is None:
+        seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        else:
+            stack.extend(_slot_values(item))
+    return size
+
+
+def string_references(obj: Any) -> Tuple[int, int]:
+    """
+    objからたどれる文字列のメモリ使用量(バイト)を、(参照ごとに数えた合計, 同じオブジェクトを1回だけ数えた合計)で返す。
+    dict(値のみ), list, tuple, set, frozenset, 属性を持つオブジェクトをたどり、同じコンテナは1回だけたどる。
+    2つの差が、文字列を共有したことで節約できたメモリ使用量になる。
+    """
+    containers: Set[int] = set()
+    strings: Set[int] = set()
+    stack = [obj]
+    referenced = unique = 0
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            size = getsizeof(item)
+            referenced += size
+            if id(item) not in strings:
+                strings.add(id(item))
+                unique += size
+            continue
+        if id(item) in containers:
+            continue
+        containers.add(id(item))
+        if isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__'):
+            stack.extend(vars(item).values())
+        else:
+            stack.extend(_slot_values(item))
+    return referenced, unique
+
+# -------------------------------------------------------------------------- Public Functions --
+
+# -- StringPool --------------------------------------------------------------------------
+
+
+class StringPool(object):
+    """
+    同じ内容の文字列を1つのオブジェクトにまとめるプール。
+    sys.internと違い、プールを持つ辞書と一緒に破棄される。
+
+    プロパティ:
+    _strings -- 文字列 -> プール内の同じ内容の文字列
+    """
+
+    def __init__(self):
+        self._strings: Dict[str, str] = {}
+
+    def intern(self, text: str) -> str:
+        """textと同じ内容の文字列がプールにあればそれを返し、無ければtextをプールに追加して返す。"""
+        return self._strings.setdefault(text, text)
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __sizeof__(self) -> int:
+        # 文字列は辞書側で数えるので、プールの表だけを数える
+        return object.__sizeof__(self) + getsizeof(self._strings)
+
+# -------------------------------------------------------------------------- StringPool --
@@ -1,25 +1,136 @@
 # -- Imports --------------------------------------------------------------------------
 
 from typing import (
-    Tuple, List
+    Tuple, Callable, NamedTuple, Optional, Dict, Union, Iterator
 )
 from re import match
-from janome.tokenizer import Tokenizer
+from functools import lru_cache
+from threading import Lock
+from time import perf_counter
+from psutil import Process
+from janome.tokenizer import Tokenizer, Token
 
 # -------------------------------------------------------------------------- Imports --
 
+# -- LazyTokenizer --------------------------------------------------------------------------
+
+
+class LazyTokenizer(object):
+    """
+    初めて使用するときにjanomeのTokenizerを生成する。
+    システム辞書をmmapで読み込むと、複数のプロセスで辞書のメモリがOSのページキャッシュとして共有される。
+
+    プロパティ:
+    _tokenizer -- 生成済みのTokenizer、未生成であればNone
+    _mmap -- システム辞書をmmapで読み込むかどうか
+    _lock -- Tokenizerの生成を1回にするためのロック
+    _load_time -- Tokenizerの生成にかかった秒数
+    _memory -- Tokenizerの生成で増えたメモリ使用量(RSS)
+    _private_memory -- Tokenizerの生成で増えた、このプロセス固有のメモリ使用量(USS)
+    """
+
+    def __init__(self, mmap: bool = True):
+        self._tokenizer: Optional[Tokenizer] = None
+        self._mmap: bool = mmap
+        self._lock: Lock = Lock()
+        self._load_time: float = 0.0
+        self._memory: int = 0
+        self._private_memory: int = 0
+
+    def configure(self, mmap: bool = True) -> None:
+        """Tokenizerの生成方法を設定する。生成済みの場合は次のloadで作り直す。"""
+        with self._lock:
+            self._mmap = mmap
+            self._tokenizer = None
+
+    def load(self) -> Tokenizer:
+        """Tokenizerを返す。未生成であれば生成する。"""
+        instance = self._tokenizer
+        if instance is None:
+            with self._lock:
+                if self._tokenizer is None:
+                    process = Process()
+                    before = process.memory_full_info()
+                    start = perf_counter()
+                    try:
+                        self._tokenizer = Tokenizer(mmap=self._mmap)
+                    except TypeError:  # mmapに対応していないjanome
+                        self._tokenizer = Tokenizer()
+                    self._load_time = perf_counter() - start
+                    after = process.memory_full_info()
+                    self._memory = after.rss - before.rss
+                    self._private_memory = after.uss - before.uss
+                instance = self._tokenizer
+        return instance
+
+    def warm_up(self, text: str = 'すもももももももものうち') -> Dict[str, Union[bool, float, int]]:
+        """Tokenizerを生成し、textを解析して辞書を読み込ませる。診断情報を返す。"""
+        for _ in self.load().tokenize(text):
+            pass
+        return self.info
+
+    def tokenize(self, text: str, **kwargs) -> Iterator[Union[Token, str]]:
+        """janome.tokenizer.Tokenizer.tokenizeを呼び出す。"""
+        return self.load().tokenize(text, **kwargs)
+
+    @property
+    def loaded(self) -> bool:
+        """Tokenizerが生成済みであればTrue"""
+        return self._tokenizer is not None
+
+    @property
+    def info(self) -> Dict[str, Union[bool, float, int]]:
+        """Tokenizerの生成に関する診断情報"""
+        return {
+            'loaded': self.loaded,
+            'mmap': self._mmap,
+            'load_time': self._load_time,
+            'memory': self._memory,
+            'private_memory': self._private_memory,
+        }
+
+# -------------------------------------------------------------------------- LazyTokenizer --
+
 # -- Init --------------------------------------------------------------------------
 
-tokenizer: Tokenizer = Tokenizer()
+tokenizer: LazyTokenizer = LazyTokenizer()
 
 # -------------------------------------------------------------------------- Init --
 
+# -- Private --------------------------------------------------------------------------
+
+# analyzeのキャッシュのデフォルトの最大件数
+__DEFAULT_CACHE_SIZE: int = 4096
+
+
+def __analyze(message: str) -> Tuple[Tuple[str, str], ...]:
+    return tuple((token.surface, token.part_of_speech) for token in tokenizer.tokenize(message))
+
+
+__cached_analyze: Callable[[str], Tuple[Tuple[str, str], ...]] = lru_cache(maxsize=__DEFAULT_CACHE_SIZE)(__analyze)
+
+# -------------------------------------------------------------------------- Private --
+
 # -- Public Functions --------------------------------------------------------------------------
 
 
-def analyze(message: str) -> List[Tuple[str, str]]:
-    """メッセージを形態素解析し、[(surface, parts)]の形にして返す。"""
-    return [(token.surface, token.part_of_speech) for token in tokenizer.tokenize(message)]
+def analyze(message: str) -> Tuple[Tuple[str, str], ...]:
+    """
+    メッセージを形態素解析し、((surface, parts), ...)の形にして返す。
+    結果はメッセージごとにキャッシュされるので、変更できないタプルで返す。
+    """
+    return __cached_analyze(message)
+
+
+def set_analyze_cache_size(size: int) -> None:
+    """analyzeのキャッシュの最大件数を変更する。キャッシュされている結果は破棄される。0でキャッシュしない。"""
+    global __cached_analyze
+    __cached_analyze = lru_cache(maxsize=max(size, 0))(__analyze)
+
+
+def analyze_cache_info() -> NamedTuple:
+    """analyzeのキャッシュのヒット数、ミス数、最大件数、現在の件数を返す。"""
+    return __cached_analyze.cache_info()
 
 
 def is_keyword(part: str) -> bool:
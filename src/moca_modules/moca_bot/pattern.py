@@ -0,0 +1,42 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Any, MutableSequence
+)
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- PatternRecord --------------------------------------------------------------------------
+
+
+class PatternRecord(object):
+    """
+    パターン辞書の1件。名詞と、その名詞に反応して返すフレーズのリストを持つ。
+    __slots__で属性を固定し、パターンごとに辞書を持つよりも少ないメモリで保持する。
+    以前のパターンハッシュとの互換性のため、record['pattern']とrecord['phrases']でも参照できる。
+
+    プロパティ:
+    pattern -- 名詞
+    phrases -- フレーズのリスト
+    """
+
+    __slots__ = ('pattern', 'phrases')
+
+    def __init__(self, pattern: str, phrases: MutableSequence[str]):
+        self.pattern = pattern
+        self.phrases = phrases
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in PatternRecord.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in PatternRecord.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __repr__(self) -> str:
+        return 'PatternRecord(pattern={!r}, phrases={!r})'.format(self.pattern, list(self.phrases))
+
+# -------------------------------------------------------------------------- PatternRecord --
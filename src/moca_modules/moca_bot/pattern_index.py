@@ -0,0 +1,90 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Dict, List, Tuple, Optional, Iterable, Pattern
+)
+from re import compile, escape, error as RegexError
+from .pattern import PatternRecord
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- PatternIndex --------------------------------------------------------------------------
+
+
+class PatternIndex(object):
+    """
+    パターン辞書の検索用インデックス。
+    正規表現の特殊文字を含まないパターン（学習した名詞など）はハッシュで引き、
+    それ以外のパターンのみコンパイル済みの正規表現で検索する。
+    検索結果はパターン辞書を先頭から re.search した場合と同じ順序になる。
+
+    プロパティ:
+    _literals -- 文字列パターン -> パターン辞書内の最小インデックス
+    _lengths -- 登録済み文字列パターンの長さの一覧
+    _regexes -- (インデックス, 正規表現) のリスト、インデックス順
+    """
+
+    def __init__(self):
+        self._literals: Dict[str, int] = {}
+        self._lengths: Tuple[int, ...] = ()
+        self._regexes: List[Tuple[int, Pattern]] = []
+
+    def build(self, patterns: Iterable[Optional[PatternRecord]]) -> None:
+        """パターン辞書全体からインデックスを作り直す。"""
+        self._literals = {}
+        self._lengths = ()
+        self._regexes = []
+        for index, pattern in enumerate(patterns):
+            if pattern is not None:
+                self.add(index, pattern.pattern)
+
+    def add(self, index: int, pattern: str) -> None:
+        """パターン辞書のindex番目に追加されたパターンを登録する。"""
+        if not pattern:
+            return None
+        if self.is_literal(pattern):
+            if self._find(pattern) is None:
+                self._literals[pattern] = index
+                if len(pattern) not in self._lengths:
+                    self._lengths = tuple(sorted(self._lengths + (len(pattern),)))
+        else:
+            try:
+                self._regexes.append((index, compile(pattern)))
+            except RegexError:
+                pass  # 不正な正規表現にはマッチしない
+
+    def search(self, message: str, limit: Optional[int] = None) -> Optional[Tuple[int, str]]:
+        """
+        messageにマッチするパターンのうち、最も先頭に近いもののインデックスと、
+        マッチした文字列を返す。マッチしなければNoneを返す。
+        limitを指定した場合、インデックスがlimit未満のパターンだけを検索する。
+        """
+        limit = float('inf') if limit is None else limit
+        find = self._find
+        size = len(message)
+        best = None
+        matched = None
+        for length in self._lengths:
+            for start in range(size - length + 1):
+                word = message[start:start + length]
+                index = find(word)
+                if index is not None and index < limit and (best is None or index < best):
+                    best, matched = index, word
+        for index, regex in self._regexes:
+            if index >= limit or (best is not None and index > best):
+                break
+            matcher = regex.search(message)
+            if matcher:
+                return index, matcher[0]
+        return None if best is None else (best, matched)
+
+    @staticmethod
+    def is_literal(pattern: str) -> bool:
+        """patternが正規表現の特殊文字を含まず、文字列として検索できればTrueを返す。"""
+        return escape(pattern) == pattern
+
+    def _find(self, word: str) -> Optional[int]:
+        """文字列パターンwordの最小インデックスを返す。無ければNoneを返す。"""
+        return self._literals.get(word)
+
+# -------------------------------------------------------------------------- PatternIndex --
@@ -0,0 +1,296 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Iterator, List, Optional, Set, Union
+)
+from array import array
+from itertools import chain
+from mmap import mmap, ACCESS_READ
+from fcntl import flock, LOCK_EX, LOCK_UN
+from os import fsync, replace
+from pathlib import Path
+from struct import Struct
+from sys import getsizeof
+from zlib import crc32
+from .memory import deep_getsizeof
+from ..moca_core import ENCODING
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- RandomLines --------------------------------------------------------------------------
+
+
+class RandomLines(object):
+    """
+    random.txtをmmapで開き、行の開始位置の配列(uint64)だけをメモリに保持するランダム辞書。
+    行は参照されたときにだけデコードするので、メモリ使用量は行数 x 8バイトと、追加した行だけになる。
+    appendした行はメモリ上に保持し、stageで書き出した行をcompactionでファイルの末尾に追記する。
+    ファイルを置き換えないので、同じファイルを開いている他のプロセスは、それまでの行をそのまま参照できる。
+    行は改行(\n)だけで区切り、空行は読み飛ばす。
+
+    プロパティ:
+    _filename -- random.txtのパス
+    _mmap -- ファイルのmmap、ファイルが無いか空であればNone
+    _offsets -- 空でない行の開始位置
+    _items -- appendした行のうち、まだファイルに追記していないもの
+    """
+
+    def __init__(self, filename: Union[Path, str], default: Optional[str] = None):
+        """ファイルfilenameを開く。ファイルに行が無ければ、defaultを最初の行として追加する。"""
+        self._filename = str(filename)
+        self._mmap: Optional[mmap] = None
+        self._offsets: array = array('Q')
+        self._items: List[str] = []
+        self._open(0)
+        if len(self._offsets) == 0 and default is not None:
+            self._items.append(default)
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._items)
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('random lines index out of range')
+        if index < len(self._offsets):
+            return self.line_bytes(index).decode(ENCODING)
+        return self._items[index - len(self._offsets)]
+
+    def __iter__(self) -> Iterator[str]:
+        return chain((self.line_bytes(index).decode(ENCODING) for index in range(len(self._offsets))), self._items)
+
+    def append(self, line: str) -> None:
+        self._items.append(line)
+
+    def line_bytes(self, index: int) -> bytes:
+        """ファイルのindex番目の行をバイト列で返す。"""
+        start = self._offsets[index]
+        end = self._mmap.find(b'\n', start)
+        return self._mmap[start:] if end == -1 else self._mmap[start:end]
+
+    @property
+    def file_line_count(self) -> int:
+        """ファイルから読み込んだ行の数"""
+        return len(self._offsets)
+
+    def stage(self, filename: Union[Path, str]) -> Optional[int]:
+        """
+        appendした行を、ファイルの末尾に追記する内容としてファイルfilenameに書き出し、追記する位置を返す。
+        appendした行が無ければNoneを返す。追記はJournal.publishが行う。
+        """
+        pending = self._items
+        if not pending:
+            return None
+        size = 0 if self._mmap is None else len(self._mmap)
+        with open(str(filename), mode='wb') as file:
+            # 元の形式のファイルは最後の行に改行が無い
+            if size > 0 and self._mmap[size - 1:size] != b'\n':
+                file.write(b'\n')
+            file.write(('\n'.join(pending) + '\n').encode(ENCODING))
+            file.flush()
+            fsync(file.fileno())
+        return size
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _open(self, start: int) -> None:
+        """ファイルを開き直し、位置start以降の行の開始位置を_offsetsに追加する。"""
+        try:
+            with open(self._filename, 'rb') as file:
+                mapped = mmap(file.fileno(), 0, access=ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None  # 空のファイルはmmapで開けない
+        # 他のスレッドが参照中の古いmmapは、参照が無くなったときに閉じられる
+        self._mmap = mapped
+        size = len(mapped)
+        position = start
+        offsets = self._offsets
+        while position < size:
+            end = mapped.find(b'\n', position)
+            if end == -1:
+                end = size
+            if end > position:
+                offsets.append(position)
+            position = end + 1
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + getsizeof(self._offsets) + deep_getsizeof(self._items)
+
+# -------------------------------------------------------------------------- RandomLines --
+
+# -- RandomLineIndex --------------------------------------------------------------------------
+
+
+class RandomLineIndex(object):
+    """
+    random.txtの行のハッシュ表をrandom.indexに保存し、mmapで開く重複チェック用のインデックス。
+    ファイルはヘッダー(MAGIC, 登録済みの行数)とスロット(uint64)の配列で、スロットはcrc32 << 32 | 行の番号 + 1、空きは0。
+    線形探索のオープンアドレス法で、updateで追記された行を登録し、使用率が1/2を超えたら大きい表に作り直す。
+    表はページキャッシュを共有するので、プロセスごとのメモリ使用量は行数に比例しない。
+
+    プロパティ:
+    _mmap -- ファイルのmmap、ファイルが無いか壊れていればNone
+    _slots -- スロットの配列(memoryview)
+    _mask -- スロットの数 - 1
+    count -- 登録済みの行の数
+    """
+
+    MAGIC = b'MOCARIX1'
+    HEADER = Struct('=8sQ')
+    MIN_CAPACITY = 1024
+
+    def __init__(self, filename: Union[Path, str]):
+        """インデックスfilenameを開く。"""
+        self._mmap: Optional[mmap] = None
+        self._slots: Optional[memoryview] = None
+        self._mask = 0
+        self.count = 0
+        try:
+            with open(str(filename), 'rb') as file:
+                mapped = mmap(file.fileno(), 0, access=ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        count = RandomLineIndex._read_header(mapped)
+        if count is None:
+            mapped.close()
+            return None
+        self._mmap = mapped
+        self._slots = memoryview(mapped)[RandomLineIndex.HEADER.size:].cast('Q')
+        self._mask = len(self._slots) - 1
+        self.count = count
+
+    def find(self, lines: RandomLines, target: bytes) -> bool:
+        """linesのファイルの行にtargetがあればTrueを返す。"""
+        if self._slots is None:
+            return False
+        slots, mask = self._slots, self._mask
+        crc = crc32(target)
+        position = crc & mask
+        limit = lines.file_line_count
+        while True:
+            slot = slots[position]
+            if slot == 0:
+                return False
+            if slot >> 32 == crc:
+                index = (slot & 0xFFFFFFFF) - 1
+                if index < limit and lines.line_bytes(index) == target:
+                    return True
+            position = (position + 1) & mask
+
+    @staticmethod
+    def update(lines: RandomLines, filename: Union[Path, str]) -> None:
+        """
+        linesのファイルの行のうち、インデックスfilenameに登録されていない行を登録する。
+        ファイルが無い場合、またはスロットの使用率が1/2を超える場合は、一時ファイルに作り直してから置き換える。
+        行は1行ずつ表に書き込むので、行数に比例するメモリを使わない。
+        """
+        filename = str(filename)
+        count = lines.file_line_count
+        with open(filename + '.lock', mode='a') as lock:
+            flock(lock.fileno(), LOCK_EX)
+            try:
+                try:
+                    with open(filename, 'r+b') as file:
+                        mapped = mmap(file.fileno(), 0)
+                except (FileNotFoundError, ValueError):
+                    mapped = None
+                registered = None if mapped is None else RandomLineIndex._read_header(mapped)
+                if registered is not None and registered >= count:
+                    mapped.close()
+                    return None  # 他のプロセスが登録済み
+                capacity = 0 if mapped is None else (len(mapped) - RandomLineIndex.HEADER.size) // 8
+                if registered is not None and registered < count and count * 2 <= capacity:
+                    RandomLineIndex._register(mapped, lines, registered, count)
+                    return None
+                if mapped is not None:
+                    mapped.close()
+                capacity = RandomLineIndex.MIN_CAPACITY
+                while capacity < count * 4:
+                    capacity *= 2
+                with open(filename + '.tmp', 'w+b') as file:
+                    file.truncate(RandomLineIndex.HEADER.size + capacity * 8)
+                    RandomLineIndex._register(mmap(file.fileno(), 0), lines, 0, count)
+                    fsync(file.fileno())
+                replace(filename + '.tmp', filename)
+            finally:
+                flock(lock.fileno(), LOCK_UN)
+
+    @staticmethod
+    def _read_header(mapped: mmap) -> Optional[int]:
+        """ヘッダーが正しければ登録済みの行の数を、そうでなければNoneを返す。"""
+        size = RandomLineIndex.HEADER.size
+        if len(mapped) < size or (len(mapped) - size) % 8 != 0:
+            return None
+        magic, count = RandomLineIndex.HEADER.unpack_from(mapped, 0)
+        slots = (len(mapped) - size) // 8
+        if magic != RandomLineIndex.MAGIC or slots == 0 or slots & (slots - 1) != 0:
+            return None
+        return count
+
+    @staticmethod
+    def _register(mapped: mmap, lines: RandomLines, start: int, end: int) -> None:
+        """linesのファイルのstart番目からend番目の前までの行を表に書き込み、mappedを閉じる。"""
+        slots = memoryview(mapped)[RandomLineIndex.HEADER.size:].cast('Q')
+        mask = len(slots) - 1
+        try:
+            for index in range(start, end):
+                crc = crc32(lines.line_bytes(index))
+                value = crc << 32 | (index + 1)
+                position = crc & mask
+                while True:
+                    slot = slots[position]
+                    if slot == 0:
+                        slots[position] = value
+                        break
+                    if slot == value:
+                        break  # 中断した登録の続き
+                    position = (position + 1) & mask
+        finally:
+            slots.release()
+        # 行を登録し終えてから、登録済みの行の数を書き込む
+        RandomLineIndex.HEADER.pack_into(mapped, 0, RandomLineIndex.MAGIC, end)
+        mapped.flush()
+        mapped.close()
+
+# -------------------------------------------------------------------------- RandomLineIndex --
+
+# -- RandomLineSet --------------------------------------------------------------------------
+
+
+class RandomLineSet(object):
+    """
+    RandomLinesのファイルの行と、追加した行itemsの集合。重複チェックに使う。
+    ファイルの行はRandomLineIndexで、crc32が同じ行だけを比較する。
+    インデックスに登録されていない行が残っている場合は、その行を順に比較する。
+
+    プロパティ:
+    _lines -- 検索するRandomLines
+    _index -- ファイルの行のRandomLineIndex
+    _items -- 追加した行
+    """
+
+    def __init__(self, lines: RandomLines, index: RandomLineIndex):
+        self._lines = lines
+        self._index = index
+        self._items: Set[str] = set()
+
+    def __contains__(self, item: str) -> bool:
+        if item in self._items:
+            return True
+        target = item.encode(ENCODING)
+        lines = self._lines
+        if self._index.find(lines, target):
+            return True
+        return any(lines.line_bytes(index) == target for index in range(self._index.count, lines.file_line_count))
+
+    def add(self, item: str) -> None:
+        self._items.add(item)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + deep_getsizeof(self._items)
+
+# -------------------------------------------------------------------------- RandomLineSet --
@@ -1,25 +1,51 @@
 # -- Imports --------------------------------------------------------------------------
 
 from typing import (
-    List, Tuple, Optional
+    Any, Callable, List, Tuple, Optional, Sequence
 )
 from abc import ABCMeta, abstractmethod
 from random import choice
-from re import search
 from .dictionary import Dictionary
 from .morph import is_keyword
+from .block_filter import BlockFilter
+from .template import render_template
 
 # -------------------------------------------------------------------------- Imports --
 
+# -- Private Functions --------------------------------------------------------------------------
+
+
+def _choose(
+        candidates: Sequence[Any],
+        block: Optional[BlockFilter],
+        transform: Optional[Callable[[Any], str]] = None,
+) -> Optional[str]:
+    """candidatesからランダムに選び、transformで変換して返す。blockがあれば、ブロックされない候補を選ぶ。"""
+    if block is not None:
+        return block.choose(candidates, transform)
+    candidate = choice(candidates)
+    return candidate if transform is None else transform(candidate)
+
+
+def _allowed(response: Optional[str], block: Optional[BlockFilter]) -> Optional[str]:
+    """responseがブロックされていればNoneを、そうでなければresponseを返す。"""
+    if response is None or block is None or not block.blocked(response):
+        return response
+    return None
+
+# -------------------------------------------------------------------------- Private Functions --
+
 # -- Responder --------------------------------------------------------------------------
 
 
 class Responder(metaclass=ABCMeta):
     """
     AIの応答を制御する思考エンジンの基底クラス。
+    応答は辞書の読み込み用のビュー(Dictionary.view)から作成するので、学習中の辞書の変更は見えない。
 
     メソッド:
     response(str) -- ユーザーの入力strを受け取り、思考結果を返す
+                     blockを渡した場合は、ブロックリストの単語を含まない思考結果を返す
 
     プロパティ:
     name -- Responderオブジェクトの名前
@@ -32,7 +58,7 @@ class Responder(metaclass=ABCMeta):
         self._dictionary = dictionary
 
     @abstractmethod
-    def response(self, *args) -> Optional[str]:
+    def response(self, *args, block: Optional[BlockFilter] = None) -> Optional[str]:
         """文字列を受け取り、思考した結果を返す"""
         pass
 
@@ -52,12 +78,13 @@ class RandomResponder(Responder):
     登録された文字列からランダムなものを返す。
     """
 
-    def response(self, *args) -> Optional[str]:
+    def response(self, *args, block: Optional[BlockFilter] = None) -> Optional[str]:
         """ユーザーからの入力は受け取るが、使用せずにランダムな応答を返す。"""
         count = 0
+        random = self._dictionary.view.random
         while True:
-            response = choice(self._dictionary.random)
-            if response != '[el]#moca_null#':
+            response = choice(random)
+            if response != '[el]#moca_null#' and (block is None or not block.blocked(response)):
                 return response
             else:
                 count += 1
@@ -74,14 +101,13 @@ class PatternResponder(Responder):
     登録されたパターンに反応し、関連する応答を返す。
     """
 
-    def response(self, message: str, _) -> Optional[str]:
+    def response(self, message: str, _, block: Optional[BlockFilter] = None) -> Optional[str]:
         """ユーザーの入力に合致するパターンがあれば、関連するフレーズを返す。"""
         try:
-            for pattern in self._dictionary.pattern:
-                matcher = search(pattern['pattern'], message)
-                if matcher:
-                    chosen_response = choice(pattern['phrases'])
-                    return chosen_response.replace('%match%', matcher[0])
+            found = self._dictionary.view.search_pattern(message)
+            if found:
+                pattern, matched = found
+                return _choose(pattern.phrases, block, lambda phrase: phrase.replace('%match%', matched))
             return None
         except Exception:
             return None
@@ -92,17 +118,15 @@ class PatternResponder(Responder):
 
 
 class TemplateResponder(Responder):
-    def response(self, _, parts: List[Tuple[str, str]]) -> Optional[str]:
+    def response(self, _, parts: List[Tuple[str, str]], block: Optional[BlockFilter] = None) -> Optional[str]:
         """形態素解析結果partsに基づいてテンプレートを選択・生成して返す。"""
         try:
             keywords = [word for word, part in parts if is_keyword(part)]
             count = len(keywords)
             if count > 0:
-                if count in self._dictionary.template:
-                    template = choice(self._dictionary.template[count])
-                    for keyword in keywords:
-                        template = template.replace('%noun%', keyword, 1)
-                    return template
+                templates = self._dictionary.view.template
+                if count in templates:
+                    return _choose(templates[count], block, lambda template: render_template(template, keywords))
             return None
         except Exception:
             return None
@@ -113,14 +137,14 @@ class TemplateResponder(Responder):
 
 
 class MarkovResponder(Responder):
-    def response(self, _, parts: List[Tuple[str, str]]) -> Optional[str]:
+    def response(self, _, parts: List[Tuple[str, str]], block: Optional[BlockFilter] = None) -> Optional[str]:
         """
         形態素のリストpartsからキーワードを選択し、それに基づく文章を生成して返す。
         キーワードに該当するものがなかった場合はランダム辞書から返す。
         """
         try:
             keyword = next((w for w, p in parts if is_keyword(p)), '')
-            response = self._dictionary.markov.generate(keyword)
+            response = self._dictionary.view.markov.generate(keyword, block)
             return response
         except Exception:
             return None
@@ -131,10 +155,10 @@ class MarkovResponder(Responder):
 
 
 class SpecialResponder(Responder):
-    def response(self, message: str, _) -> Optional[str]:
+    def response(self, message: str, _, block: Optional[BlockFilter] = None) -> Optional[str]:
         """固定返事があれば返答する。"""
         try:
-            return self._dictionary.special.get(message, None)
+            return _allowed(self._dictionary.view.special.get(message, None), block)
         except Exception:
             return None
 
@@ -144,13 +168,10 @@ class SpecialResponder(Responder):
 
 
 class KeywordResponder(Responder):
-    def response(self, message: str, _) -> Optional[str]:
-        """キーワードを含んでいれば返答する。"""
+    def response(self, message: str, _, block: Optional[BlockFilter] = None) -> Optional[str]:
+        """キーワードを含んでいれば、最も先に登録したキーワードの返事を返す。"""
         try:
-            for key in self._dictionary.keyword:
-                if key in message:
-                    return self._dictionary.keyword.get(key, None)
-            return None
+            return _allowed(self._dictionary.view.search_keyword(message), block)
         except Exception:
             return None
 
@@ -160,10 +181,10 @@ class KeywordResponder(Responder):
 
 
 class UserRandomResponder(Responder):
-    def response(self, *args) -> Optional[str]:
+    def response(self, *args, block: Optional[BlockFilter] = None) -> Optional[str]:
         """ユーザー定義のランダム返答をする"""
         try:
-            return choice(self._dictionary.user_random)
+            return _choose(self._dictionary.view.user_random, block)
         except Exception:
             return None
 
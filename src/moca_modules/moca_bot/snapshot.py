@@ -0,0 +1,618 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+)
+from array import array
+from itertools import chain
+from mmap import mmap, ACCESS_READ
+from os import replace
+from pathlib import Path
+from re import compile, error as RegexError
+from struct import Struct, error as StructError
+from zlib import crc32
+from .memory import deep_getsizeof
+from .template import split_template, join_template
+from .pattern import PatternRecord
+from .pattern_index import PatternIndex
+from ..moca_core import ENCODING
+try:
+    from ujson import dumps, loads
+except (ImportError, ModuleNotFoundError):
+    from json import dumps, loads
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- StringTable --------------------------------------------------------------------------
+
+
+class StringTable(object):
+    """
+    スナップショット内の文字列の配列。文字列は参照されたときにだけデコードする。
+
+    プロパティ:
+    _offsets -- 文字列のオフセット(uint64)
+    _data -- UTF-8で連結した文字列
+    _order -- バイト列順に並べたインデックス(uint32)、検索しない配列ではNone
+    """
+
+    def __init__(self, offsets: memoryview, data: memoryview, order: Optional[memoryview] = None):
+        self._offsets = offsets
+        self._data = data
+        self._order = order
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('string table index out of range')
+        return self._bytes(index).decode(ENCODING)
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self._bytes(index).decode(ENCODING)
+
+    def find(self, text: str, start: int = 0, end: Optional[int] = None) -> Optional[int]:
+        """start番目からend番目までにある文字列textの最小のインデックスを返す。無ければNoneを返す。"""
+        end = len(self) if end is None else end
+        target = text.encode(ENCODING)
+        order = self._order
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self._bytes(order[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        # 同じ文字列はインデックスの順に並んでいる
+        while low < len(order) and self._bytes(order[low]) == target:
+            if start <= order[low] < end:
+                return order[low]
+            low += 1
+        return None
+
+    def _bytes(self, index: int) -> bytes:
+        return self._data[self._offsets[index]:self._offsets[index + 1]].tobytes()
+
+    @staticmethod
+    def build(strings: Iterable[str], ordered: bool) -> Tuple[array, bytes, Optional[array]]:
+        """文字列の配列をファイルに書き込むセクションに変換する。"""
+        encoded = [text.encode(ENCODING) for text in strings]
+        offsets = array('Q', (0,))
+        for data in encoded:
+            offsets.append(offsets[-1] + len(data))
+        order = array('I', sorted(range(len(encoded)), key=encoded.__getitem__)) if ordered else None
+        return offsets, b''.join(encoded), order
+
+# -------------------------------------------------------------------------- StringTable --
+
+# -- DictionarySnapshot --------------------------------------------------------------------------
+
+
+class DictionarySnapshot(object):
+    """
+    マルコフ辞書以外の辞書を1つのバイナリファイルにまとめた読み込み専用のスナップショット。
+    mmapで開くので、同じファイルを開いたプロセスの間でOSのページキャッシュが共有される。
+    作成時の辞書ファイルのサイズと更新日時を記録し、辞書ファイルが変更されていれば使用しない。
+
+    ファイル形式:
+    ヘッダー -- MAGIC, バージョン, バイトオーダー確認用の値, 各セクションの位置とサイズ
+    random -- ランダム辞書
+    pattern_words, pattern_phrase_offsets, pattern_phrases -- パターンと、パターンごとのフレーズの範囲
+    pattern_literals, pattern_lengths, pattern_regexes -- パターン辞書の検索用インデックス(OverlayPatternIndex)
+    template_counts, template_offsets, templates -- 単語数と、単語数ごとのテンプレートの範囲
+    special_keys, special_values -- 固定返事
+    keyword_keys, keyword_values -- キーワード辞書
+    user_random -- ユーザー定義ランダム辞書
+    stamps -- 作成時の辞書ファイルのサイズと更新日時(JSON)
+
+    クラス定数:
+    MAGIC -- ファイルの先頭に書き込まれるバイト列
+    VERSION -- ファイル形式のバージョン
+    SOURCES -- スナップショットにまとめる辞書ファイル
+    """
+
+    MAGIC: bytes = b'MOCASNP\x00'
+    VERSION: int = 2
+    SOURCES: Tuple[str, ...] = (
+        'random.txt', 'pattern.txt', 'template.txt', 'special.json', 'keyword.json', 'user_random.json'
+    )
+    _BYTE_ORDER_MARK: int = 0x01020304
+    # (名前, 検索を行うか)
+    _TABLES: Tuple[Tuple[str, bool], ...] = (
+        ('random', True),
+        ('pattern_words', True),
+        ('pattern_phrases', False),
+        ('templates', True),
+        ('special_keys', True),
+        ('special_values', False),
+        ('keyword_keys', True),
+        ('keyword_values', False),
+        ('user_random', False),
+    )
+    _ARRAYS: Tuple[Tuple[str, str], ...] = (
+        ('pattern_phrase_offsets', 'Q'),
+        ('pattern_literals', 'Q'),
+        ('pattern_lengths', 'I'),
+        ('pattern_regexes', 'I'),
+        ('template_counts', 'I'),
+        ('template_offsets', 'Q'),
+        ('stamps', 'B'),
+    )
+    _SECTION_COUNT: int = sum(3 if ordered else 2 for _, ordered in _TABLES) + len(_ARRAYS)
+    _HEADER: Struct = Struct('=8sII' + 'Q' * (_SECTION_COUNT * 2))
+
+    def __init__(self, filename: Union[Path, str]):
+        """ファイルfilenameをmmapで開く。"""
+        self._filename = str(filename)
+        with open(self._filename, 'rb') as file:
+            self._mmap = mmap(file.fileno(), 0, access=ACCESS_READ)
+        magic, version, mark, *sections = self._HEADER.unpack_from(self._mmap, 0)
+        if magic != self.MAGIC or version != self.VERSION or mark != self._BYTE_ORDER_MARK:
+            self._mmap.close()
+            raise ValueError(f'Unsupported dictionary snapshot. <{self._filename}>')
+        buffer = memoryview(self._mmap)
+        views = iter(
+            buffer[sections[index]:sections[index] + sections[index + 1]] for index in range(0, len(sections), 2)
+        )
+        self._tables: Dict[str, StringTable] = {}
+        for name, ordered in self._TABLES:
+            offsets, data = next(views).cast('Q'), next(views)
+            self._tables[name] = StringTable(offsets, data, next(views).cast('I') if ordered else None)
+        self._arrays: Dict[str, memoryview] = {}
+        for name, typecode in self._ARRAYS:
+            view = next(views)
+            self._arrays[name] = view.cast(typecode) if typecode != 'B' else view
+        self._stamps = loads(self._arrays['stamps'].tobytes().decode(ENCODING))
+
+    @classmethod
+    def open(cls, data_dir: Union[Path, str], random: bool = True) -> Optional['DictionarySnapshot']:
+        """
+        data_dirのスナップショットを開く。無い場合、または辞書ファイルが変更されている場合はNoneを返す。
+        randomがFalseの場合は、ランダム辞書を含まないスナップショットだけを開く。
+        """
+        filename = Path(data_dir).joinpath('dictionary.snapshot')
+        try:
+            snapshot = cls(filename)
+        except (FileNotFoundError, ValueError, StructError):
+            return None
+        if snapshot._stamps != cls.stamps(data_dir, random):
+            return None
+        return snapshot
+
+    @classmethod
+    def stamps(cls, data_dir: Union[Path, str], random: bool = True) -> Dict[str, Optional[List[int]]]:
+        """
+        辞書ファイルのサイズと更新日時を返す。randomがFalseの場合はrandom.txtを含まない。
+        ランダム辞書を含むかどうかが違うスナップショットは、stampsが一致しないので使用されない。
+        """
+        stamps = {}
+        for name in cls.SOURCES:
+            if name == 'random.txt' and not random:
+                continue
+            try:
+                stat = Path(data_dir).joinpath(name).stat()
+                stamps[name] = [stat.st_size, stat.st_mtime_ns]
+            except FileNotFoundError:
+                stamps[name] = None
+        return stamps
+
+    def table(self, name: str) -> StringTable:
+        """文字列の配列nameを返す。"""
+        return self._tables[name]
+
+    def array(self, name: str) -> memoryview:
+        """数値の配列nameを返す。"""
+        return self._arrays[name]
+
+    @classmethod
+    def write(
+            cls,
+            data_dir: Union[Path, str],
+            random: Iterable[str],
+            patterns: Iterable[Optional[PatternRecord]],
+            templates: Iterable[Tuple[int, Iterable[str]]],
+            special: Iterable[Tuple[str, str]],
+            keyword: Iterable[Tuple[str, str]],
+            user_random: Iterable[str],
+            stamps: Dict[str, Optional[List[int]]],
+    ) -> None:
+        """
+        辞書をスナップショットファイルに書き込む。stampsには読み込んだ辞書ファイルのstampsを渡す。
+        一時ファイルに書き込んだ後に置き換えるので、読み込み中のプロセスに影響しない。
+        """
+        pattern_words, pattern_phrases, phrase_offsets = [], [], array('Q', (0,))
+        for pattern in patterns:
+            if pattern is not None:
+                pattern_words.append(pattern.pattern)
+                pattern_phrases.extend(pattern.phrases)
+                phrase_offsets.append(len(pattern_phrases))
+        pattern_literals, pattern_lengths, pattern_regexes = OverlayPatternIndex.build_table(pattern_words)
+        template_counts, template_list, template_offsets = array('I'), [], array('Q', (0,))
+        for count, items in templates:
+            template_counts.append(count)
+            template_list.extend(items)
+            template_offsets.append(len(template_list))
+        special, keyword = list(special), list(keyword)
+        strings = {
+            'random': random,
+            'pattern_words': pattern_words,
+            'pattern_phrases': pattern_phrases,
+            'templates': template_list,
+            'special_keys': (key for key, _ in special),
+            'special_values': (value for _, value in special),
+            'keyword_keys': (key for key, _ in keyword),
+            'keyword_values': (value for _, value in keyword),
+            'user_random': user_random,
+        }
+        arrays = {
+            'pattern_phrase_offsets': phrase_offsets,
+            'pattern_literals': pattern_literals,
+            'pattern_lengths': pattern_lengths,
+            'pattern_regexes': pattern_regexes,
+            'template_counts': template_counts,
+            'template_offsets': template_offsets,
+            'stamps': dumps(stamps).encode(ENCODING),
+        }
+        sections = []
+        for name, ordered in cls._TABLES:
+            offsets, data, order = StringTable.build(strings[name], ordered)
+            sections.extend((offsets, data, order) if ordered else (offsets, data))
+        sections.extend(arrays[name] for name, _ in cls._ARRAYS)
+        filename = str(Path(data_dir).joinpath('dictionary.snapshot'))
+        with open(filename + '.tmp', 'wb') as file:
+            file.write(b'\x00' * cls._HEADER.size)
+            positions = []
+            for section in sections:
+                file.write(b'\x00' * (-file.tell() % 8))
+                positions.append(file.tell())
+                data = section.tobytes() if isinstance(section, array) else section
+                positions.append(len(data))
+                file.write(data)
+            file.seek(0)
+            file.write(cls._HEADER.pack(cls.MAGIC, cls.VERSION, cls._BYTE_ORDER_MARK, *positions))
+        replace(filename + '.tmp', filename)
+
+# -------------------------------------------------------------------------- DictionarySnapshot --
+
+# -- Overlays --------------------------------------------------------------------------
+
+
+class StringRange(object):
+    """StringTableのstart番目からend番目までの読み込み専用の配列。"""
+
+    def __init__(self, table: StringTable, start: int, end: int):
+        self._table = table
+        self._start = start
+        self._end = end
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('string range index out of range')
+        return self._table[self._start + index]
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._start, self._end):
+            yield self._table[index]
+
+
+class TemplateRange(StringRange):
+    """StringRangeのテンプレートを、参照のたびにセグメントのタプルに分割して返す。"""
+
+    def __getitem__(self, index: int) -> Tuple[str, ...]:
+        return split_template(super().__getitem__(index))
+
+    def __iter__(self) -> Iterator[Tuple[str, ...]]:
+        for template in super().__iter__():
+            yield split_template(template)
+
+
+class OverlayList(object):
+    """
+    スナップショットの配列baseの後に、スナップショット作成後に追加した要素itemsを続けたリスト。
+    appendはitemsに追加する。
+    """
+
+    def __init__(self, base: Sequence[str], items: Optional[List[str]] = None):
+        self._base = base
+        self._items = [] if items is None else items
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._items)
+
+    def __getitem__(self, index: int) -> str:
+        if index < 0:
+            index += len(self)
+        if index < len(self._base):
+            return self._base[index]
+        return self._items[index - len(self._base)]
+
+    def __iter__(self) -> Iterator[str]:
+        return chain(self._base, self._items)
+
+    def append(self, item: str) -> None:
+        self._items.append(item)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + deep_getsizeof(self._items)
+
+
+class OverlaySet(object):
+    """StringTableのstart番目からend番目までの文字列と、追加した文字列itemsの集合。重複チェックに使う。"""
+
+    def __init__(self, table: StringTable, start: int = 0, end: Optional[int] = None):
+        self._table = table
+        self._start = start
+        self._end = end
+        self._items: Set[str] = set()
+
+    def __contains__(self, item: str) -> bool:
+        return item in self._items or self._table.find(item, self._start, self._end) is not None
+
+    def add(self, item: str) -> None:
+        self._items.add(item)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + deep_getsizeof(self._items)
+
+
+class OverlayDict(object):
+    """
+    スナップショットのキーと値の配列に、変更した項目itemsを重ねた辞書。
+    反復の順番はスナップショットのキー、追加したキーの順。
+    """
+
+    def __init__(self, keys: StringTable, values: StringTable):
+        self._keys = keys
+        self._values = values
+        self._items: Dict[str, str] = {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self._items:
+            return self._items[key]
+        index = self._keys.find(key)
+        return default if index is None else self._values[index]
+
+    def __getitem__(self, key: str) -> str:
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self._items[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items or self._keys.find(key) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._keys
+        for key in self._items:
+            if self._keys.find(key) is None:
+                yield key
+
+    def __len__(self) -> int:
+        return len(self._keys) + sum(1 for key in self._items if self._keys.find(key) is None)
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        for key in self:
+            yield key, self[key]
+
+    def copy(self) -> 'OverlayDict':
+        """スナップショットを共有し、変更した項目だけをコピーした辞書を返す。"""
+        mapping = OverlayDict(self._keys, self._values)
+        mapping._items = dict(self._items)
+        return mapping
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + deep_getsizeof(self._items)
+
+
+class OverlayPatterns(object):
+    """
+    スナップショットのパターン辞書に、追加したパターンを続けたリスト。
+    要素はphrasesがOverlayListのPatternRecordで、参照のたびに作成する。
+    変更するパターンはmutableで取得すると、変更内容が保持される。
+    """
+
+    def __init__(self, snapshot: DictionarySnapshot):
+        self._words = snapshot.table('pattern_words')
+        self._phrases = snapshot.table('pattern_phrases')
+        self._offsets = snapshot.array('pattern_phrase_offsets')
+        self._changed: Dict[int, PatternRecord] = {}
+        self._items: List[PatternRecord] = []
+
+    def __len__(self) -> int:
+        return len(self._words) + len(self._items)
+
+    def __getitem__(self, index: int) -> PatternRecord:
+        if index < 0:
+            index += len(self)
+        if index >= len(self._words):
+            return self._items[index - len(self._words)]
+        return self._changed.get(index) or self._pattern(index)
+
+    def __iter__(self) -> Iterator[PatternRecord]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, pattern: PatternRecord) -> None:
+        self._items.append(pattern)
+
+    def mutable(self, word: str) -> Optional[PatternRecord]:
+        """名詞wordの最初のパターンを、変更できる状態で返す。無ければNoneを返す。"""
+        index = self._words.find(word)
+        if index is None:
+            return None
+        if index not in self._changed:
+            self._changed[index] = self._pattern(index)
+        return self._changed[index]
+
+    def _pattern(self, index: int) -> PatternRecord:
+        return PatternRecord(
+            self._words[index],
+            OverlayList(StringRange(self._phrases, self._offsets[index], self._offsets[index + 1])),
+        )
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + deep_getsizeof([self._changed, self._items])
+
+
+class OverlayPatternIndex(PatternIndex):
+    """
+    スナップショットに書き込んだ検索用インデックスに、スナップショット作成後に追加したパターンを続けたPatternIndex。
+    文字列パターンはスナップショットのハッシュ表(pattern_literals)で引くので、プロセスごとに辞書を作らない。
+    ハッシュ表はcrc32で位置を決める線形探索のオープンアドレス法で、要素は crc32 << 32 | パターンのインデックス + 1、空きは0。
+    正規表現のパターンは作成時にコンパイルする。
+    """
+
+    def __init__(self, snapshot: DictionarySnapshot):
+        super().__init__()
+        self._words = snapshot.table('pattern_words')
+        self._slots = snapshot.array('pattern_literals')
+        self._mask = len(self._slots) - 1
+        self._lengths = tuple(snapshot.array('pattern_lengths'))
+        for index in snapshot.array('pattern_regexes'):
+            try:
+                self._regexes.append((index, compile(self._words[index])))
+            except RegexError:
+                pass  # 不正な正規表現にはマッチしない
+
+    def _find(self, word: str) -> Optional[int]:
+        target = word.encode(ENCODING)
+        slots = self._slots
+        code = crc32(target)
+        position = code & self._mask
+        slot = slots[position]
+        while slot:
+            if slot >> 32 == code and self._words._bytes((slot & 0xFFFFFFFF) - 1) == target:
+                return (slot & 0xFFFFFFFF) - 1
+            position = (position + 1) & self._mask
+            slot = slots[position]
+        return self._literals.get(word) if self._literals else None
+
+    @staticmethod
+    def build_table(words: Sequence[str]) -> Tuple[array, array, array]:
+        """パターンの一覧wordsから、スナップショットに書き込むハッシュ表、文字列パターンの長さ、正規表現のインデックスを作る。"""
+        literals = {}
+        regexes = array('I')
+        for index, word in enumerate(words):
+            if not word:
+                continue
+            if PatternIndex.is_literal(word):
+                literals.setdefault(word, index)
+            else:
+                regexes.append(index)
+        slots = array('Q', bytes(8 * (1 << (len(literals) * 2).bit_length())))
+        mask = len(slots) - 1
+        for word, index in literals.items():
+            code = crc32(word.encode(ENCODING))
+            position = code & mask
+            while slots[position]:
+                position = (position + 1) & mask
+            slots[position] = code << 32 | index + 1
+        return slots, array('I', sorted({len(word) for word in literals})), regexes
+
+
+class OverlayPatternLookup(object):
+    """名詞 -> 最初に登録されたパターン。スナップショットのパターンはOverlayPatternsから取得する。"""
+
+    def __init__(self, patterns: OverlayPatterns):
+        self._patterns = patterns
+        self._items: Dict[str, PatternRecord] = {}
+
+    def get(self, word: str, default: Any = None) -> Any:
+        pattern = self._items.get(word) or self._patterns.mutable(word)
+        return default if pattern is None else pattern
+
+    def __setitem__(self, word: str, pattern: PatternRecord) -> None:
+        self._items[word] = pattern
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + deep_getsizeof(self._items)
+
+
+class OverlayPhraseSets(dict):
+    """名詞 -> パターンが持つフレーズの集合。スナップショットのパターンの集合は最初に参照したときに作成する。"""
+
+    def __init__(self, lookup: OverlayPatternLookup):
+        super().__init__()
+        self._lookup = lookup
+
+    def __missing__(self, word: str) -> Set[str]:
+        phrases = set(self._lookup.get(word).phrases)
+        self[word] = phrases
+        return phrases
+
+
+class OverlayTemplates(object):
+    """
+    単語数 -> テンプレート(セグメントのタプル)のOverlayList。反復の順番はスナップショットの単語数、追加した単語数の順。
+    スナップショットのテンプレートは参照のたびに分割し、追加したテンプレートは分割したものを保持する。
+    """
+
+    def __init__(self, snapshot: DictionarySnapshot):
+        self._table = snapshot.table('templates')
+        self._ranges: Dict[int, Tuple[int, int]] = {}
+        offsets = snapshot.array('template_offsets')
+        for index, count in enumerate(snapshot.array('template_counts')):
+            self._ranges[count] = (offsets[index], offsets[index + 1])
+        self._lists: Dict[int, OverlayList] = {}
+
+    def __contains__(self, count: int) -> bool:
+        return count in self._ranges or count in self._lists
+
+    def __getitem__(self, count: int) -> OverlayList:
+        if count not in self._lists:
+            start, end = self._ranges.get(count, (0, 0))
+            self._lists[count] = OverlayList(TemplateRange(self._table, start, end))
+        return self._lists[count]
+
+    def keys(self) -> List[int]:
+        return list(self._ranges) + [count for count in self._lists if count not in self._ranges]
+
+    def items(self) -> Iterator[Tuple[int, OverlayList]]:
+        for count in self.keys():
+            yield count, self[count]
+
+    def sets(self) -> 'OverlayTemplateSets':
+        """重複チェック用の集合を返す。"""
+        return OverlayTemplateSets(self._table, self._ranges)
+
+    def __sizeof__(self) -> int:
+        return object.__sizeof__(self) + deep_getsizeof(self._lists)
+
+
+class OverlayTemplateSet(OverlaySet):
+    """セグメントのタプルで重複をチェックするOverlaySet。スナップショットは連結した文字列で検索する。"""
+
+    def __contains__(self, segments: Tuple[str, ...]) -> bool:
+        return (
+            segments in self._items
+            or self._table.find(join_template(segments), self._start, self._end) is not None
+        )
+
+
+class OverlayTemplateSets(dict):
+    """単語数 -> テンプレートのOverlayTemplateSet。"""
+
+    def __init__(self, table: StringTable, ranges: Dict[int, Tuple[int, int]]):
+        super().__init__()
+        self._table = table
+        self._ranges = ranges
+
+    def __missing__(self, count: int) -> OverlayTemplateSet:
+        start, end = self._ranges.get(count, (0, 0))
+        templates = OverlayTemplateSet(self._table, start, end)
+        self[count] = templates
+        return templates
+
+# -------------------------------------------------------------------------- Overlays --
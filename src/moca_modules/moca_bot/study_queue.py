@@ -0,0 +1,163 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    List, Tuple, Union, Iterator, Optional
+)
+from pathlib import Path
+from os import fsync
+from time import time
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
+from ..moca_core import ENCODING
+try:
+    from ujson import dumps, loads
+except (ImportError, ModuleNotFoundError):
+    from json import dumps, loads
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- StudyQueue --------------------------------------------------------------------------
+
+
+class StudyQueue(object):
+    """
+    学習待ちのメッセージをファイルに保存するキュー。
+    putはfsyncしてから戻るので、戻った時点でメッセージが失われることはない。
+    取り出しはconsumer_lockを取得した1プロセスだけが行い、処理が終わった位置をcommitで記録する。
+
+    ファイル:
+    study_queue.log -- 1行1レコードの[追加した時刻, [メッセージ]]
+    study_queue.offset -- 処理済みの位置
+    study_queue.lock -- 追加とcommitに使うロック
+    study_queue.consumer.lock -- 取り出しを1プロセスで行うためのロック
+
+    プロパティ:
+    _data_dir -- データ保存用ディレクトリ
+    """
+
+    def __init__(self, data_dir: Union[str, Path]):
+        self._data_dir = Path(data_dir)
+
+    @property
+    def filename(self) -> Path:
+        """キューファイル"""
+        return self._data_dir.joinpath('study_queue.log')
+
+    def put(self, messages: List[str]) -> None:
+        """メッセージをキューに追加する。"""
+        if not messages:
+            return None
+        data = (dumps([time(), messages], ensure_ascii=False) + '\n').encode(ENCODING)
+        with self._lock(self._data_dir.joinpath('study_queue.lock')):
+            with open(str(self.filename), mode='a+b') as file:
+                size = file.seek(0, 2)
+                if size > 0:
+                    file.seek(size - 1)
+                    if file.read(1) != b'\n':
+                        file.write(b'\n')  # 書き込み途中で終了したレコードを区切る
+                file.write(data)
+                file.flush()
+                fsync(file.fileno())
+
+    def take(self, max_count: int) -> Tuple[List[str], int, Optional[float]]:
+        """
+        未処理のメッセージを最大max_count件(レコード単位)取り出す。
+        (メッセージ, commitに渡す位置, 最も古いメッセージを追加した時刻)を返す。
+        """
+        messages = []
+        offset = self._read_offset()
+        oldest = None
+        for added, items, end in self._records(offset):
+            if messages and len(messages) + len(items) > max_count:
+                break
+            oldest = added if oldest is None else oldest
+            messages.extend(items)
+            offset = end
+        return messages, offset, oldest
+
+    def commit(self, offset: int) -> None:
+        """offsetまでのメッセージを処理済みにする。すべて処理済みになればキューファイルを空にする。"""
+        with self._lock(self._data_dir.joinpath('study_queue.lock')):
+            if offset >= self._size():
+                # 先に位置を戻しておけば、途中で終了しても処理済みのメッセージが再処理されるだけで失われない
+                self._write_offset(0)
+                with open(str(self.filename), mode='wb'):
+                    pass
+            else:
+                self._write_offset(offset)
+
+    def has_pending(self) -> bool:
+        """未処理のメッセージがあればTrueを返す。"""
+        return self._read_offset() < self._size()
+
+    def stats(self) -> Tuple[int, float]:
+        """(未処理のメッセージの数, 最も古い未処理のメッセージが追加されてからの秒数)を返す。"""
+        depth = 0
+        oldest = None
+        for added, items, _ in self._records(self._read_offset()):
+            oldest = added if oldest is None else oldest
+            depth += len(items)
+        return depth, 0.0 if oldest is None else max(time() - oldest, 0.0)
+
+    @contextmanager
+    def consumer_lock(self) -> Iterator[bool]:
+        """取り出しのロックを取得する。他のプロセスが処理中であればFalseを返す。"""
+        with open(str(self._data_dir.joinpath('study_queue.consumer.lock')), mode='a') as file:
+            try:
+                flock(file.fileno(), LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                yield False
+            else:
+                try:
+                    yield True
+                finally:
+                    flock(file.fileno(), LOCK_UN)
+
+    def _records(self, offset: int) -> Iterator[Tuple[float, List[str], int]]:
+        try:
+            with open(str(self.filename), mode='rb') as file:
+                file.seek(offset)
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break  # 書き込み途中のレコード
+                    offset += len(line)
+                    try:
+                        added, items = loads(line.decode(ENCODING))
+                    except ValueError:
+                        continue
+                    yield added, items, offset
+        except FileNotFoundError:
+            return None
+
+    def _size(self) -> int:
+        try:
+            return self.filename.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _read_offset(self) -> int:
+        try:
+            with open(str(self._data_dir.joinpath('study_queue.offset')), mode='r', encoding=ENCODING) as file:
+                offset = int(file.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+        # キューファイルが空にされた後に古い位置が残っている場合
+        return offset if offset <= self._size() else 0
+
+    def _write_offset(self, offset: int) -> None:
+        with open(str(self._data_dir.joinpath('study_queue.offset')), mode='w', encoding=ENCODING) as file:
+            file.write(str(offset))
+            file.flush()
+            fsync(file.fileno())
+
+    @staticmethod
+    @contextmanager
+    def _lock(filename: Path) -> Iterator[None]:
+        with open(str(filename), mode='a') as file:
+            flock(file.fileno(), LOCK_EX)
+            try:
+                yield None
+            finally:
+                flock(file.fileno(), LOCK_UN)
+
+# -------------------------------------------------------------------------- StudyQueue --
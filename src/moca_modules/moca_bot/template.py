@@ -0,0 +1,57 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    List, Sequence, Tuple
+)
+from .morph import is_keyword
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- Variables --------------------------------------------------------------------------
+
+# テンプレートファイルで名詞を表す記号
+TEMPLATE_SLOT = '%noun%'
+
+# -------------------------------------------------------------------------- Variables --
+
+# -- Public Functions --------------------------------------------------------------------------
+# テンプレートはメモリ上では名詞の位置で分割したセグメントのタプルとして保持する。
+# 名詞がn個のテンプレートはn + 1個のセグメントを持つ。
+# 例: ('', 'は', 'が好き') -> '%noun%は%noun%が好き'
+
+
+def build_template(parts: Sequence[Tuple[str, str]]) -> Tuple[str, ...]:
+    """形態素のリストpartsから、名詞の位置で分割したセグメントのタプルを作成する。名詞が無ければ空のタプルを返す。"""
+    segments: List[str] = []
+    words: List[str] = []
+    for word, part in parts:
+        if is_keyword(part):
+            segments.append(''.join(words))
+            words = []
+        else:
+            words.append(word)
+    if not segments:
+        return ()
+    segments.append(''.join(words))
+    return tuple(segments)
+
+
+def split_template(template: str) -> Tuple[str, ...]:
+    """テンプレートファイルの文字列をセグメントのタプルに変換する。"""
+    return tuple(template.split(TEMPLATE_SLOT))
+
+
+def join_template(segments: Sequence[str]) -> str:
+    """セグメントのタプルをテンプレートファイルの文字列に変換する。"""
+    return TEMPLATE_SLOT.join(segments)
+
+
+def render_template(segments: Sequence[str], keywords: Sequence[str]) -> str:
+    """セグメントの間に名詞keywordsを順番に入れた文字列を返す。足りない名詞の位置は'%noun%'のまま残す。"""
+    pieces = [segments[0]]
+    for index in range(1, len(segments)):
+        pieces.append(keywords[index - 1] if index <= len(keywords) else TEMPLATE_SLOT)
+        pieces.append(segments[index])
+    return ''.join(pieces)
+
+# -------------------------------------------------------------------------- Public Functions --
@@ -0,0 +1,126 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Any, Dict, Iterator, Optional, Sequence, Tuple
+)
+from .pattern_index import PatternIndex
+from .keyword_index import KeywordIndex
+from .pattern import PatternRecord
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- FrozenPrefix --------------------------------------------------------------------------
+
+
+class FrozenPrefix(object):
+    """
+    追記のみ行われるリストitemsの、作成した時点の要素だけを参照する読み込み専用のビュー。
+    作成後にitemsへ追加された要素は見えない。lengthを渡した場合は、先頭からlength個の要素だけを参照する。
+
+    プロパティ:
+    _items -- 参照するリスト
+    _length -- 作成した時点の要素数
+    """
+
+    __slots__ = ('_items', '_length')
+
+    def __init__(self, items: Sequence[Any], length: Optional[int] = None):
+        self._items = items
+        self._length = len(items) if length is None else length
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('frozen prefix index out of range')
+        return self._items[index]
+
+    def __iter__(self) -> Iterator[Any]:
+        items = self._items
+        for index in range(self._length):
+            yield items[index]
+
+# -------------------------------------------------------------------------- FrozenPrefix --
+
+# -- DictionaryView --------------------------------------------------------------------------
+
+
+class DictionaryView(object):
+    """
+    Responderが参照する辞書の読み込み用のビュー。作成後に変更されないので、ロック無しで参照できる。
+    学習はDictionaryの辞書に対して行い、Dictionary.publishで新しいビューに置き換える。
+    マルコフ辞書は追記のみのデータ構造なので、作成した時点の行数と開始単語だけを参照するMarkovViewで共有する。
+    パターンのフレーズは、作成後に追加する前にfreeze_phrasesで作成した時点の数を記録する。
+
+    プロパティ:
+    version -- ビューのバージョン、publishのたびに増える
+    random -- ランダム辞書
+    pattern -- パターン辞書
+    template -- テンプレート辞書
+    special -- 固定返事
+    keyword -- キーワード辞書
+    user_random -- ユーザー定義ランダム辞書
+    markov -- マルコフ辞書のMarkovView
+    _pattern_index -- パターン辞書の検索用インデックス、patternの要素数までの結果だけを使う
+    _keyword_index -- キーワード辞書のキーを登録順に登録したKeywordIndex
+    _phrase_counts -- 作成後にフレーズを追加したパターンの、作成した時点のフレーズの数
+    """
+
+    __slots__ = (
+        'version', 'random', 'pattern', 'template', 'special', 'keyword', 'user_random', 'markov', '_pattern_index',
+        '_keyword_index', '_phrase_counts',
+    )
+
+    def __init__(
+            self,
+            version: int,
+            random: FrozenPrefix,
+            pattern: FrozenPrefix,
+            template: Dict[int, FrozenPrefix],
+            special: Any,
+            keyword: Any,
+            user_random: FrozenPrefix,
+            markov: Any,
+            pattern_index: PatternIndex,
+            keyword_index: KeywordIndex,
+    ):
+        self.version = version
+        self.random = random
+        self.pattern = pattern
+        self.template = template
+        self.special = special
+        self.keyword = keyword
+        self.user_random = user_random
+        self.markov = markov
+        self._pattern_index = pattern_index
+        self._keyword_index = keyword_index
+        self._phrase_counts: Dict[PatternRecord, int] = {}
+
+    def search_pattern(self, message: str) -> Optional[Tuple[PatternRecord, str]]:
+        """
+        messageにマッチする最初のパターンと、マッチした文字列を返す。
+        マッチするパターンが無ければNoneを返す。
+        """
+        found = self._pattern_index.search(message, len(self.pattern))
+        if found is None:
+            return None
+        index, matched = found
+        pattern = self.pattern[index]
+        count = self._phrase_counts.get(pattern)
+        if count is not None:
+            pattern = PatternRecord(pattern.pattern, FrozenPrefix(pattern.phrases, count))
+        return pattern, matched
+
+    def freeze_phrases(self, pattern: PatternRecord) -> None:
+        """パターンpatternにフレーズを追加する前に呼び出し、このビューで参照するフレーズの数を固定する。"""
+        self._phrase_counts.setdefault(pattern, len(pattern.phrases))
+
+    def search_keyword(self, message: str) -> Optional[str]:
+        """messageに含まれるキーワードのうち、最も先に登録したものの返事を返す。無ければNoneを返す。"""
+        key = self._keyword_index.search(message)
+        return None if key is None else self.keyword.get(key, None)
+
+# -------------------------------------------------------------------------- DictionaryView --
@@ -4,6 +4,7 @@ from benchmarker import Benchmarker, BenchmarkerError
 from .compress_test import compress_test
 from .json_test import json_test
 from .benchmark import string_bench
+from .moca_bot_test import bot_study_test, bot_generate_test, bot_save_test, bot_keyword_test
 from .bench_funcs import (
     fibonacci_loop, fibonacci_sym, fibonacci_recursion,
     fibonacci_list_loop, fibonacci_list_sym, fibonacci_list_recursion
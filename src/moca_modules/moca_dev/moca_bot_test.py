@@ -0,0 +1,189 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Dict, List, Tuple, Iterable
+)
+from random import Random
+from tempfile import TemporaryDirectory
+from ..moca_bot.dictionary import Dictionary
+from ..moca_bot.markov import Markov
+from ..moca_bot.keyword_index import KeywordIndex
+from ..moca_utils import check_function_speed, try_print
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- Private --------------------------------------------------------------------------
+
+__NOUN: str = '名詞,一般,*,*,*,*'
+__PARTICLE: str = '助詞,格助詞,一般,*,*,*'
+
+
+def __create_sentences(count: int, vocabulary: int, seed: int) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    """Create pseudo analyzed sentences. [(message, [(surface, part_of_speech)])]"""
+    random = Random(seed)
+    particles = ('は', 'が', 'を', 'に', 'で', 'と', 'の', 'も')
+    sentences = []
+    for index in range(count):
+        parts = []
+        for _ in range(random.randint(2, 6)):
+            parts.append((f'単語{random.randrange(vocabulary)}', __NOUN))
+            parts.append((random.choice(particles), __PARTICLE))
+        parts.append((f'{index}', __NOUN))
+        sentences.append((''.join(word for word, _ in parts), parts))
+    return sentences
+
+
+def __study(dictionary: Dictionary, sentences: List[Tuple[str, List[Tuple[str, str]]]]) -> None:
+    for message, parts in sentences:
+        dictionary.study(message, parts)
+
+
+def __generate(markov: Markov, keywords: List[str]) -> None:
+    for keyword in keywords:
+        markov.generate(keyword)
+
+
+def __search_keywords(index: KeywordIndex, messages: List[str]) -> None:
+    for message in messages:
+        index.search(message)
+
+# -------------------------------------------------------------------------- Private --
+
+# -- Functions --------------------------------------------------------------------------
+
+
+def bot_study_test(
+        total: int = 1000000,
+        step: int = 100000,
+        vocabulary: int = 50000,
+        output: bool = True
+) -> Dict[int, float]:
+    """
+    Measure the study throughput of moca_bot.Dictionary while the dictionary grows.
+    The throughput should stay flat, if the duplicate detection doesn't depend on the dictionary size.
+    :param total: the number of sentences to study.
+    :param step: the number of sentences to study between measurements.
+    :param vocabulary: the number of nouns used in the generated sentences.
+    :param output: if this value is True, print the results to console.
+    :return: {<dictionary size>: <sentences per second>}
+    """
+    res: Dict[int, float] = {}
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    with TemporaryDirectory() as data_dir:
+        dictionary = Dictionary('bench', data_dir)
+        for size in range(0, total, step):
+            sentences = __create_sentences(step, vocabulary, size)
+            speed = max(check_function_speed(__study, dictionary, sentences), 1)
+            res[size + step] = round(step / speed * 1000, 2)
+            try_print(
+                f"dictionary size: {size + step},\t\t "
+                f"study speed: {speed} ms,\t\t "
+                f"throughput: {res[size + step]} sentences/s.",
+                flag=output
+            )
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    return res
+
+
+def bot_generate_test(
+        sizes: Iterable[int] = (10000, 100000, 1000000),
+        count: int = 10000,
+        vocabulary: int = 50000,
+        output: bool = True
+) -> Dict[int, float]:
+    """
+    Measure the speed of moca_bot.Markov.generate against dictionaries of different sizes.
+    The generation time should depend on the chain length, not the size of the dictionary.
+    :param sizes: the numbers of sentences in the dictionary.
+    :param count: the number of sentences to generate for each size.
+    :param vocabulary: the number of nouns used in the generated sentences.
+    :param output: if this value is True, print the results to console.
+    :return: {<dictionary size>: <microseconds per generate>}
+    """
+    res: Dict[int, float] = {}
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    markov = Markov()
+    studied = 0
+    for size in sorted(sizes):
+        for _, parts in __create_sentences(size - studied, vocabulary, studied):
+            markov.add_sentence(parts)
+        studied = size
+        keywords = [f'単語{index % (vocabulary * 2)}' for index in range(count)]
+        speed = check_function_speed(__generate, markov, keywords)
+        res[size] = round(speed * 1000 / count, 2)
+        try_print(
+            f"dictionary size: {size},\t\t "
+            f"generate speed: {speed} ms,\t\t "
+            f"per sentence: {res[size]} us.",
+            flag=output
+        )
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    return res
+
+
+def bot_save_test(
+        total: int = 1000000,
+        step: int = 100000,
+        batch: int = 100,
+        vocabulary: int = 50000,
+        output: bool = True
+) -> Dict[int, float]:
+    """
+    Measure the latency of moca_bot.Dictionary.save while the dictionary grows.
+    The latency should depend on the number of new sentences, not the size of the dictionary.
+    :param total: the number of sentences to study.
+    :param step: the number of sentences to study between measurements.
+    :param batch: the number of sentences to study before each measured save.
+    :param vocabulary: the number of nouns used in the generated sentences.
+    :param output: if this value is True, print the results to console.
+    :return: {<dictionary size>: <milliseconds per save>}
+    """
+    res: Dict[int, float] = {}
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    with TemporaryDirectory() as data_dir:
+        dictionary = Dictionary('bench', data_dir)
+        for size in range(0, total, step):
+            __study(dictionary, __create_sentences(step, vocabulary, size))
+            dictionary.save()
+            dictionary.compact()
+            __study(dictionary, __create_sentences(batch, vocabulary, total + size))
+            res[size + step] = check_function_speed(dictionary.save)
+            try_print(
+                f"dictionary size: {size + step},\t\t "
+                f"save speed: {res[size + step]} ms.",
+                flag=output
+            )
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    return res
+
+
+def bot_keyword_test(
+        sizes: Iterable[int] = (100, 1000, 10000),
+        count: int = 10000,
+        output: bool = True
+) -> Dict[int, float]:
+    """
+    Measure the speed of moca_bot.KeywordIndex.search against different numbers of keywords.
+    The search time should depend on the message length, not the number of keywords.
+    :param sizes: the numbers of keywords.
+    :param count: the number of messages to search for each size.
+    :param output: if this value is True, print the results to console.
+    :return: {<number of keywords>: <microseconds per search>}
+    """
+    res: Dict[int, float] = {}
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    messages = [message for message, _ in __create_sentences(count, 100000, 0)]
+    for size in sorted(sizes):
+        index = KeywordIndex(f'キーワード{number}' for number in range(size))
+        speed = check_function_speed(__search_keywords, index, messages)
+        res[size] = round(speed * 1000 / count, 2)
+        try_print(
+            f"keywords: {size},\t\t "
+            f"search speed: {speed} ms,\t\t "
+            f"per message: {res[size]} us.",
+            flag=output
+        )
+    try_print('+++++++++++++++++++++++++++++++++++++++++++++++++++++', flag=output)
+    return res
+
+# -------------------------------------------------------------------------- Functions --
@@ -13,6 +13,7 @@ from sanic.websocket import WebSocketProtocol
 from sanic.response import HTTPResponse, text
 from logging import INFO
 from copy import copy
+from gc import disable as gc_disable, enable as gc_enable, freeze as gc_freeze
 from ssl import SSLContext, Purpose, create_default_context
 from pprint import pprint
 from os import unlink
@@ -79,6 +80,8 @@ class MocaSanic:
         a number of unaccepted connections that the system will allow before refusing new connections.
     self._origins: List[str]
         the origins in this list, will be allowed.
+    self._preload: bool
+        run before_fork in the main process, the workers share the loaded data with copy-on-write.
     self._blueprint_list: List[Blueprint]
         all blueprint in this list will be added to the app.
     self._middleware_list: List[Tuple[str, Callable]]
@@ -125,6 +128,7 @@ class MocaSanic:
             websocket: bool = False,
             backlog: int = 100,
             origins: List[str] = [],
+            preload: bool = False,
     ):
         """
         :param name: the name of the sanic server.
@@ -149,6 +153,8 @@ class MocaSanic:
         :param backlog: a number of unaccepted connections that the system
                         will allow before refusing new connections
         :param origins: the origins in this list, will be allowed.
+        :param preload: run before_fork in the main process before starting workers.
+                        the garbage collector is frozen after it, so the workers don't copy the shared pages.
         """
         # set name
         self._name: str = name
@@ -207,6 +213,8 @@ class MocaSanic:
         self._backlog: int = backlog
         # set origins
         self._origins: List[str] = origins
+        # set preload flag
+        self._preload: bool = preload
         # set blueprint list
         self._blueprint_list: List[Blueprint] = []
         # set middleware list
@@ -284,6 +292,10 @@ class MocaSanic:
     def auto_reload(self) -> Optional[bool]:
         return self._auto_reload
 
+    @property
+    def preload(self) -> bool:
+        return self._preload
+
     @property
     def blueprint_list(self) -> List[Blueprint]:
         return self._blueprint_list
@@ -590,6 +602,11 @@ class MocaSanic:
     async def _after_server_stop(self, app: Sanic, loop) -> None:
         await self.after_server_stop(app, loop)
 
+    @staticmethod
+    def before_fork(app: Sanic) -> None:
+        """Override this method to load shared data in the main process, it runs only in preload mode."""
+        pass
+
     @staticmethod
     async def before_server_start(app: Sanic, loop):
         """Override this method to add listener."""
@@ -614,6 +631,15 @@ class MocaSanic:
         """Run Sanic server."""
         set_process_name(f'{self._name} --- main process')
         self._init_app()
+        if self._preload:
+            # disable the garbage collector while loading to avoid freed holes in the shared pages,
+            # and freeze the loaded objects so the collections in the workers don't write to them.
+            gc_disable()
+            try:
+                self.before_fork(self._app)
+            finally:
+                gc_enable()
+            gc_freeze()
         try:
             print_info(f'uvloop: {is_uvloop()}, ujson: {is_ujson()}')
             if self._debug:
@@ -2,12 +2,16 @@
 
 from sanic import Sanic, Blueprint
 from threading import Thread
+from asyncio import sleep
 from limits.strategies import FixedWindowElasticExpiryRateLimiter
 from limits.storage import MemoryStorage, RedisStorage
 from copy import copy
 from pymysql import MySQLError, IntegrityError
 from .middlewares import middlewares
 from .routes import blueprints
+from .executor import BoundedExecutor
+from .study_worker import StudyWorker
+from .bot_registry import BotRegistry
 from .. import moca_modules as mzk
 from .. import core
 
@@ -72,13 +76,52 @@ moca_sanic: mzk.MocaSanic = mzk.MocaSanic(
     websocket=True,
     backlog=core.SERVER_CONFIG['backlog'],
     origins=core.SERVER_CONFIG['access_control_allowed_origins'],
+    preload=core.SERVER_CONFIG.get('preload', False),
 )
 
 moca_sanic.load_sanic_server_configs(core.SANIC_CONFIG)
 app: Sanic = moca_sanic.app
 
 
+def setup_bots(app_: Sanic) -> None:
+    """Create the executors, load the tokenizer and create the bot registry."""
+    # the bot pool runs tokenization and generation, the io pool runs saves.
+    app_.bot_executor = BoundedExecutor(
+        'bot',
+        core.system_config.get_config('bot_executor_workers', int, 4),
+        core.system_config.get_config('bot_executor_queue', int, 64),
+    )
+    app_.io_executor = BoundedExecutor(
+        'io',
+        core.system_config.get_config('bot_io_executor_workers', int, 1),
+        core.system_config.get_config('bot_io_executor_queue', int, 64),
+    )
+    mzk.set_analyze_cache_size(core.system_config.get_config('bot_analyze_cache_size', int, 4096))
+    mzk.tokenizer.configure(mmap=core.system_config.get_config('bot_tokenizer_mmap', bool, True))
+    if core.system_config.get_config('bot_tokenizer_warm_up', bool, True):
+        info = mzk.tokenizer.warm_up()
+        mzk.print_info(
+            f"Loaded the tokenizer in {info['load_time']:.3f} seconds. "
+            f"memory: {info['memory'] // 1024} KiB (private: {info['private_memory'] // 1024} KiB) "
+            f"mmap: {info['mmap']} -- {mzk.get_my_pid()}"
+        )
+    # bots are loaded on their first use, and evicted when they exceed the memory budget.
+    app_.bots = BotRegistry(
+        core.STORAGE_DIR,
+        app_.io_executor,
+        core.system_config.get_config('bot_memory_budget', int, 1073741824),
+        core.system_config.get_config('bot_random_index', bool, False),
+    )
+
+
 # set event listener
+def before_fork(app_: Sanic) -> None:
+    """Load the tokenizer and the bots in the master process, the workers share them with copy-on-write."""
+    setup_bots(app_)
+    names = app_.bots.preload()
+    mzk.print_info(f'Preloaded {len(names)} bots. ({", ".join(names)}) -- {mzk.get_my_pid()}')
+
+
 async def before_server_start(app_: Sanic, loop):
     mzk.set_process_name(f'{app_.name} --- listener {mzk.get_my_pid()}')
     mzk.print_info(f'Starting Sanic server. -- {mzk.get_my_pid()}')
@@ -136,13 +179,12 @@ async def before_server_start(app_: Sanic, loop):
     app_._timer_thread = Thread(target=__reload_timer, args=(app_,), daemon=True)
     app_._timer_thread.start()
 
-    app_.bots = {}
+    if not hasattr(app_, 'bots'):
+        setup_bots(app_)
 
+    # the bots are reloaded by their generation, this flag only reloads the bot ids.
     def reload_bot(the_updated_key, old_value, new_value, *args, **kwargs) -> None:
         application = kwargs['app']
-        for bot_dir in core.STORAGE_DIR.iterdir():
-            if bot_dir.is_dir():
-                application.bots[bot_dir.name] = mzk.MocaBot(bot_dir.name, bot_dir)
         con = application.mysql.get_a_new_con()
         cursor = con.cursor()
         cursor.execute(core.GET_BOTS_QUERY)
@@ -181,15 +223,56 @@ async def after_server_start(app_: Sanic, loop):
 
     app_.scheduler.add_event_per_second('Dos-detect', dos_detect, 5)
 
+    def compact_bots():
+        threshold = core.system_config.get_config('bot_journal_compact_size', int, 1048576)
+        for _, bot in app_.bots.loaded():
+            if bot.journal_size > threshold:
+                try:
+                    bot.compact()
+                except Exception as error:
+                    mzk.print_error(f'Failed to compact the dictionary of {bot.name}. <{error}>')
+
+    app_.study_worker = StudyWorker(app_)
+    loop.create_task(app_.study_worker.run())
+
+    async def reload_bots():
+        while True:
+            await sleep(app_.system_config.get_config('bot_reload_interval', float, 1.0))
+            try:
+                for name in await app_.bots.reload_stale():
+                    mzk.print_info(f'Reloaded {name}. -- {mzk.get_my_pid()}')
+            except Exception as error:
+                mzk.print_error(f'Failed to reload bots. <{error}>')
+
+    loop.create_task(reload_bots())
+
+    app_.scheduler.add_event_per_second(
+        'Compact-bots', compact_bots, core.system_config.get_config('bot_compact_interval', int, 60)
+    )
+
+    # measuring walks the whole dictionary of a bot, so it runs on a slow timer instead of after every study.
+    def refresh_bots():
+        try:
+            app_.bots.refresh_all()
+        except Exception as error:
+            mzk.print_error(f'Failed to measure the memory usage of bots. <{error}>')
+
+    app_.scheduler.add_event_per_second(
+        'Refresh-bots', refresh_bots, core.system_config.get_config('bot_memory_refresh_interval', int, 60)
+    )
+
 
 async def before_server_stop(app_: Sanic, loop):
     mzk.print_info(f'Stopping Sanic server. -- {mzk.get_my_pid()}')
 
 
 async def after_server_stop(app_: Sanic, loop):
+    app_.bot_executor.shutdown()
+    app_.io_executor.shutdown()
     mzk.print_info(f'Stopped Sanic server. -- {mzk.get_my_pid()}')
 
 
+moca_sanic.before_fork = before_fork
 moca_sanic.before_server_start = before_server_start
 moca_sanic.after_server_start = after_server_start
 moca_sanic.before_server_stop = before_server_stop
@@ -0,0 +1,300 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Dict, List, Optional, Tuple, Union
+)
+from asyncio import Lock as AsyncLock
+from collections import OrderedDict
+from fcntl import flock, LOCK_EX, LOCK_UN
+from os import replace
+from pathlib import Path
+from threading import Lock
+from time import time
+from .executor import BoundedExecutor
+from .. import moca_modules as mzk
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- BotRegistry --------------------------------------------------------------------------
+
+
+class BotRegistry(object):
+    """
+    Load bots from the storage directory on their first use, and evict the least recently used bots
+    when the total memory usage of the loaded bots exceeds the memory budget.
+
+    Every bot directory has a generation file, the process that changed the files of a bot increases it.
+    The other processes reload only the bots whose generation changed, and swap the new bot in after loading it,
+    so the old bot keeps answering while the new one is loading.
+
+    Attributes
+    ----------
+    self._storage_dir: Path
+        the directory that contains a directory per bot.
+    self._executor: BoundedExecutor
+        the executor used to load bots.
+    self._memory_budget: int
+        the memory budget in bytes, if this value is 0, bots are never evicted.
+    self._random_index: bool
+        keep the random dictionary of the bots as a line index over random.txt instead of a list of strings.
+    self._bots: OrderedDict
+        the loaded bots, ordered from the least recently used.
+    self._memory: Dict[str, int]
+        the memory usage of each loaded bot.
+    self._last_access: Dict[str, float]
+        the last access time of each loaded bot.
+    self._generations: Dict[str, int]
+        the generation of each loaded bot, when it was loaded.
+    self._loading: Dict[str, AsyncLock]
+        the locks to load each bot only once at a time.
+    self._evicted: int
+        the number of evicted bots.
+    self._reloaded: int
+        the number of reloaded bots.
+    self._lock: Lock
+        the lock for the loaded bots, the registry is also used from other threads.
+    """
+
+    def __init__(
+            self,
+            storage_dir: Union[Path, str],
+            executor: BoundedExecutor,
+            memory_budget: int = 0,
+            random_index: bool = False,
+    ):
+        self._storage_dir: Path = Path(storage_dir)
+        self._executor: BoundedExecutor = executor
+        self._memory_budget: int = memory_budget
+        self._random_index: bool = random_index
+        self._bots: 'OrderedDict[str, mzk.MocaBot]' = OrderedDict()
+        self._memory: Dict[str, int] = {}
+        self._last_access: Dict[str, float] = {}
+        self._generations: Dict[str, int] = {}
+        self._loading: Dict[str, AsyncLock] = {}
+        self._evicted: int = 0
+        self._reloaded: int = 0
+        self._lock: Lock = Lock()
+
+    def names(self) -> List[str]:
+        """The names of all bots in the storage directory, loaded or not."""
+        return sorted(path.name for path in self._storage_dir.iterdir() if path.is_dir())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._bots or self._bot_dir(name) is not None
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        """Return True if name is a single plain path component, so it can only name a directory in the storage."""
+        return (
+            isinstance(name, str)
+            and name not in ('', '.', '..')
+            and '/' not in name
+            and '\\' not in name
+            and '\x00' not in name
+        )
+
+    def get(self, name: str) -> Optional[mzk.MocaBot]:
+        """Return the bot if it is loaded, this method never loads a bot."""
+        with self._lock:
+            return self._bots.get(name)
+
+    def loaded(self) -> List[Tuple[str, mzk.MocaBot]]:
+        """The loaded bots."""
+        with self._lock:
+            return list(self._bots.items())
+
+    async def acquire(self, name: str) -> Optional[mzk.MocaBot]:
+        """Return the bot, load it on the executor if it is not loaded yet. Return None for unknown names."""
+        bot = self._touch(name)
+        if bot is not None:
+            return bot
+        if self._bot_dir(name) is None:
+            return None
+        lock = self._loading.setdefault(name, AsyncLock())
+        async with lock:
+            bot = self._touch(name)
+            if bot is None:
+                bot = await self._executor.run(self._load, name)
+                await self._executor.run(self._evict, name)
+        self._loading.pop(name, None)
+        return bot
+
+    def create(self, name: str) -> mzk.MocaBot:
+        """Create a bot from its directory in the storage directory, this method does not register it."""
+        return mzk.MocaBot(name, self._storage_dir.joinpath(name), random_index=self._random_index)
+
+    def add(self, name: str, bot: mzk.MocaBot, generation: Optional[int] = None) -> None:
+        """Register a bot created by other code."""
+        generation = self.generation(name) if generation is None else generation
+        memory = bot.memory_usage()
+        with self._lock:
+            self._bots[name] = bot
+            self._bots.move_to_end(name)
+            self._memory[name] = memory
+            self._last_access[name] = time()
+            self._generations[name] = generation
+
+    def preload(self) -> List[str]:
+        """Load the bots until the memory budget is used, and return the names of the loaded bots."""
+        for name in self.names():
+            if 0 < self._memory_budget <= sum(self._memory.values()):
+                break
+            self._load(name)
+            self._evict(name)
+        return [name for name, _ in self.loaded()]
+
+    def generation(self, name: str) -> int:
+        """The current generation of the bot files."""
+        try:
+            with open(str(self._storage_dir.joinpath(name, 'generation')), mode='r') as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self, name: str) -> int:
+        """
+        Increase the generation of the bot after its files were changed, and return the new generation.
+        Other processes reload the bot, this process keeps its bot if it was up to date before the change.
+        """
+        directory = self._storage_dir.joinpath(name)
+        with open(str(directory.joinpath('generation.lock')), mode='a') as lock:
+            flock(lock.fileno(), LOCK_EX)
+            try:
+                old = self.generation(name)
+                with open(str(directory.joinpath('generation.tmp')), mode='w') as file:
+                    file.write(str(old + 1))
+                replace(str(directory.joinpath('generation.tmp')), str(directory.joinpath('generation')))
+            finally:
+                flock(lock.fileno(), LOCK_UN)
+        with self._lock:
+            if self._generations.get(name) == old:
+                self._generations[name] = old + 1
+        return old + 1
+
+    async def reload_stale(self) -> List[str]:
+        """Reload the loaded bots whose generation was changed by other processes, and return their names."""
+        stale = await self._executor.run(self._stale)
+        for name in stale:
+            await self.reload(name)
+        return stale
+
+    async def reload(self, name: str) -> None:
+        """
+        Load the bot from its files again if it is loaded, and swap the new bot in.
+        Call this after editing the dictionary files, bump only makes the other processes reload it.
+        """
+        lock = self._loading.setdefault(name, AsyncLock())
+        async with lock:
+            await self._executor.run(self._reload, name)
+        self._loading.pop(name, None)
+
+    def refresh(self, name: str) -> None:
+        """
+        Measure the memory usage of the loaded bot again, and evict other bots if it is needed.
+        This walks the whole dictionary of the bot, call it on a slow timer and not after every change.
+        """
+        bot = self.get(name)
+        if bot is not None:
+            memory = bot.memory_usage()
+            with self._lock:
+                if self._bots.get(name) is bot:
+                    self._memory[name] = memory
+            self._evict(name)
+
+    def refresh_all(self) -> None:
+        """Measure the memory usage of all loaded bots again."""
+        for name, _ in self.loaded():
+            self.refresh(name)
+
+    def clear(self) -> None:
+        """Unload all bots, they will be loaded from the storage again on the next use."""
+        with self._lock:
+            self._bots.clear()
+            self._memory.clear()
+            self._last_access.clear()
+            self._generations.clear()
+
+    def metrics(self) -> Dict[str, Union[int, Dict[str, Dict[str, Union[int, float]]]]]:
+        """The memory usage of the loaded bots."""
+        with self._lock:
+            return {
+                'memory_budget': self._memory_budget,
+                'memory_usage': sum(self._memory.values()),
+                'evicted': self._evicted,
+                'reloaded': self._reloaded,
+                'bots': {
+                    name: {
+                        'memory_usage': self._memory[name],
+                        'last_access': self._last_access[name],
+                        'generation': self._generations[name],
+                        'rejected': self._bots[name].rejected,
+                    } for name in self._bots
+                },
+            }
+
+    def _bot_dir(self, name: str) -> Optional[Path]:
+        """The directory of the bot, or None if name is not a valid name of an existing bot directory."""
+        if not self.valid_name(name):
+            return None
+        path = self._storage_dir.joinpath(name)
+        # reject symbolic links that point out of the storage directory.
+        if not path.is_dir() or path.resolve().parent != self._storage_dir.resolve():
+            return None
+        return path
+
+    def _touch(self, name: str) -> Optional[mzk.MocaBot]:
+        with self._lock:
+            bot = self._bots.get(name)
+            if bot is not None:
+                self._bots.move_to_end(name)
+                self._last_access[name] = time()
+            return bot
+
+    def _load(self, name: str) -> mzk.MocaBot:
+        # read the generation first, changes made while loading are picked up by the next reload.
+        generation = self.generation(name)
+        bot = self.create(name)
+        self.add(name, bot, generation)
+        return bot
+
+    def _stale(self) -> List[str]:
+        with self._lock:
+            generations = dict(self._generations)
+        return [name for name, generation in generations.items() if self.generation(name) != generation]
+
+    def _reload(self, name: str) -> None:
+        old = self.get(name)
+        if old is None:
+            return None  # evicted, it will be loaded on the next use.
+        old.save()  # the new bot reads the messages studied by the old bot from the journal.
+        generation = self.generation(name)
+        bot = self.create(name)
+        memory = bot.memory_usage()
+        with self._lock:
+            if self._bots.get(name) is not old:
+                return None
+            self._bots[name] = bot
+            self._memory[name] = memory
+            self._generations[name] = generation
+            self._reloaded += 1
+        self._evict(name)
+
+    def _evict(self, keep: str) -> None:
+        """Evict the least recently used bots until the memory usage fits the budget, except the bot named keep."""
+        if self._memory_budget <= 0:
+            return None
+        evicted = []
+        with self._lock:
+            for name in list(self._bots.keys()):
+                if sum(self._memory.values()) <= self._memory_budget:
+                    break
+                if name != keep:
+                    evicted.append(self._bots.pop(name))
+                    del self._memory[name]
+                    del self._last_access[name]
+                    del self._generations[name]
+                    self._evicted += 1
+        for bot in evicted:
+            bot.save()  # write the studied messages to the journal before dropping the bot.
+
+# -------------------------------------------------------------------------- BotRegistry --
@@ -0,0 +1,108 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Any, Callable, Dict, Union
+)
+from asyncio import get_event_loop
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+from time import perf_counter
+from sanic.exceptions import ServiceUnavailable
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- BoundedExecutor --------------------------------------------------------------------------
+
+
+class BoundedExecutor(object):
+    """
+    A thread pool with a limited queue, used to run blocking bot work off the event loop.
+    When every thread is busy and the queue is full, new jobs are rejected with 503.
+
+    Attributes
+    ----------
+    self._name: str
+        the name of this pool.
+    self._workers: int
+        the number of threads.
+    self._max_queue: int
+        the number of jobs that can wait for a free thread.
+    self._executor: ThreadPoolExecutor
+        the thread pool.
+    self._pending: int
+        the number of submitted jobs that are not finished yet. only changed on the event loop.
+    self._active: int
+        the number of running jobs.
+    self._completed: int
+        the number of finished jobs.
+    self._rejected: int
+        the number of rejected jobs.
+    self._busy_time: float
+        the total running time of finished jobs in seconds.
+    self._started_at: float
+        the time this pool was created.
+    self._lock: Lock
+        the lock for the counters changed on worker threads.
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self._name: str = name
+        self._workers: int = max(workers, 1)
+        self._max_queue: int = max(max_queue, 0)
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix=name
+        )
+        self._pending: int = 0
+        self._active: int = 0
+        self._completed: int = 0
+        self._rejected: int = 0
+        self._busy_time: float = 0.0
+        self._started_at: float = perf_counter()
+        self._lock: Lock = Lock()
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run func on the pool and wait for the result, raise ServiceUnavailable if the pool is full."""
+        if self._pending >= self._workers + self._max_queue:
+            self._rejected += 1
+            raise ServiceUnavailable(f'The {self._name} pool is overloaded, please try again later.')
+        self._pending += 1
+        try:
+            return await get_event_loop().run_in_executor(self._executor, partial(self._call, func, args, kwargs))
+        finally:
+            self._pending -= 1
+
+    def _call(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        with self._lock:
+            self._active += 1
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._busy_time += perf_counter() - start
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the thread pool."""
+        self._executor.shutdown(wait=wait)
+
+    @property
+    def metrics(self) -> Dict[str, Union[str, int, float]]:
+        """The utilisation of this pool."""
+        with self._lock:
+            active, completed, busy_time = self._active, self._completed, self._busy_time
+        elapsed = perf_counter() - self._started_at
+        return {
+            'name': self._name,
+            'workers': self._workers,
+            'max_queue': self._max_queue,
+            'active': active,
+            'queued': max(self._pending - active, 0),
+            'completed': completed,
+            'rejected': self._rejected,
+            'utilisation': round(busy_time / (elapsed * self._workers), 4) if elapsed > 0 else 0.0,
+        }
+
+# -------------------------------------------------------------------------- BoundedExecutor --
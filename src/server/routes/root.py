@@ -5,6 +5,8 @@ from sanic.request import Request
 from sanic.response import HTTPResponse, text, json as original_json, file
 from orjson import dumps as orjson_dumps
 from functools import partial
+from itertools import chain
+from typing import List, Optional, Tuple
 json = partial(original_json, dumps=orjson_dumps)
 from sanic.exceptions import Forbidden
 from pymysql import IntegrityError
@@ -16,6 +18,18 @@ from .utils import check_root_pass
 
 # -- Private --------------------------------------------------------------------------
 
+
+def _dialogue_batch(jobs: List[Tuple[mzk.MocaBot, str]]) -> List[Optional[Tuple[str, str]]]:
+    """Analyze each distinct message once, and run the dialogue of each job. A failed job returns None."""
+    analyzed = {message: mzk.analyze(message) for message in {message for _, message in jobs}}
+    res = []
+    for bot, message in jobs:
+        try:
+            res.append(bot.dialogue(message, parts=analyzed[message]))
+        except Exception:
+            res.append(None)
+    return res
+
 # -------------------------------------------------------------------------- Private --
 
 # -- Blueprint --------------------------------------------------------------------------
@@ -26,18 +40,22 @@ root: Blueprint = Blueprint('root', None)
 @root.route('/reload', {'GET', 'POST', 'OPTIONS'})
 async def reload_moca_bot(request: Request) -> HTTPResponse:
     check_root_pass(request)
+    for name in request.app.bots.names():
+        await request.app.io_executor.run(request.app.bots.bump, name)
+        # bump keeps the bots of this process, read the edited dictionary files here too.
+        await request.app.bots.reload(name)
     request.app.flags.set('moca_bot_reload', not request.app.flags.get('moca_bot_reload'))
     return text('success.')
 
 
 @root.route('/list', {'GET', 'POST', 'OPTIONS'})
 async def get_bot_list(request: Request) -> HTTPResponse:
-    return json(list(request.app.bots.keys()))
+    return json(request.app.bots.names())
 
 
 @root.route('/list-str', {'GET', 'POST', 'OPTIONS'})
 async def get_bot_list(request: Request) -> HTTPResponse:
-    return text(', '.join(list(request.app.bots.keys())))
+    return text(', '.join(request.app.bots.names()))
 
 
 @root.route('/bots', {'GET', 'POST', 'OPTIONS'})
@@ -54,7 +72,7 @@ async def create_bot(request: Request) -> HTTPResponse:
         request,
         ('name|n', str, None, {'max_length': 32}),
     )
-    if name is None:
+    if name is None or not request.app.bots.valid_name(name):
         raise Forbidden('name parameter format error.')
     if core.STORAGE_DIR.joinpath(name).is_dir():
         raise Forbidden('name is already exists.')
@@ -67,7 +85,7 @@ async def create_bot(request: Request) -> HTTPResponse:
     except IntegrityError:
         raise Forbidden('name is already exists.')
     core.STORAGE_DIR.joinpath(name).mkdir(parents=True, exist_ok=True)
-    request.app.bots[name] = mzk.MocaBot(name, core.STORAGE_DIR.joinpath(name))
+    request.app.bots.add(name, request.app.bots.create(name))
     request.app.flags.set('moca_bot_reload', not request.app.flags.get('moca_bot_reload'))
     return text('success.')
 
@@ -85,17 +103,23 @@ async def study(request: Request) -> HTTPResponse:
         raise Forbidden('name parameter format error.')
     if message is None and message_list is None:
         raise Forbidden('message or message_list parameter format error.')
-    bot = request.app.bots.get(name, None)
     bot_id = request.app.dict_cache['name'].get(name, 'unknown')
-    if bot is None:
+    if name not in request.app.bots:
         raise Forbidden('Unknown bot name.')
     if message is not None:
-        _ = bot.dialogue(message, study=True)
+        messages = [message]
     else:
-        for msg in message_list:
-            if isinstance(msg, str) and len(msg) <= 512:
-                _ = bot.dialogue(msg, study=True)
-    bot.save()
+        messages = [msg for msg in message_list if isinstance(msg, str) and len(msg) <= 512]
+    # invalid items of message_list are counted as rejected.
+    invalid = len(message_list) - len(messages) if message is None else 0
+    if request.app.system_config.get_config('bot_study_queue', bool, True):
+        # the study worker applies the messages and inserts them into the database later.
+        await request.app.io_executor.run(mzk.StudyQueue(core.STORAGE_DIR.joinpath(name)).put, messages)
+        return json({'queued': len(messages), 'rejected': invalid})
+    bot = await request.app.bots.acquire(name)
+    accepted, rejected = await request.app.bot_executor.run(bot.study_messages, messages)
+    rejected += invalid
+    await request.app.io_executor.run(bot.save)
     if message is not None:
         await request.app.mysql.execute_aio(
             core.ADD_BOT_DATA_QUERY,
@@ -106,12 +130,61 @@ async def study(request: Request) -> HTTPResponse:
         pool = await request.app.mysql.get_a_aio_pool()
         async with pool.acquire() as con:
             async with con.cursor() as cur:
-                for msg in message_list:
-                    if isinstance(msg, str) and len(msg) <= 512:
-                        await cur.execute(core.ADD_BOT_DATA_QUERY, (bot_id, msg))
+                for msg in messages:
+                    await cur.execute(core.ADD_BOT_DATA_QUERY, (bot_id, msg))
             await con.commit()
-    request.app.flags.set('moca_bot_reload', not request.app.flags.get('moca_bot_reload'))
-    return text('success.')
+    await request.app.io_executor.run(request.app.bots.bump, name)
+    return json({'accepted': accepted, 'rejected': rejected})
+
+
+@root.route('/bot-status', {'GET', 'POST', 'OPTIONS'})
+async def bot_status(request: Request) -> HTTPResponse:
+    check_root_pass(request)
+    return json({
+        name: {
+            'dirty': bot.dirty,
+            'generations': bot.generations,
+            'journal_size': bot.journal_size,
+        } for name, bot in request.app.bots.loaded()
+    })
+
+
+@root.route('/analyze-cache-info', {'GET', 'POST', 'OPTIONS'})
+async def analyze_cache_info(request: Request) -> HTTPResponse:
+    check_root_pass(request)
+    return json(mzk.analyze_cache_info()._asdict())
+
+
+@root.route('/tokenizer-info', {'GET', 'POST', 'OPTIONS'})
+async def tokenizer_info(request: Request) -> HTTPResponse:
+    check_root_pass(request)
+    return json(mzk.tokenizer.info)
+
+
+@root.route('/executor-info', {'GET', 'POST', 'OPTIONS'})
+async def executor_info(request: Request) -> HTTPResponse:
+    check_root_pass(request)
+    return json([request.app.bot_executor.metrics, request.app.io_executor.metrics])
+
+
+@root.route('/study-queue-info', {'GET', 'POST', 'OPTIONS'})
+async def study_queue_info(request: Request) -> HTTPResponse:
+    check_root_pass(request)
+    return json(await request.app.io_executor.run(request.app.study_worker.metrics))
+
+
+@root.route('/bot-memory', {'GET', 'POST', 'OPTIONS'})
+async def bot_memory(request: Request) -> HTTPResponse:
+    check_root_pass(request)
+    return json(request.app.bots.metrics())
+
+
+@root.route('/bot-strings', {'GET', 'POST', 'OPTIONS'})
+async def bot_strings(request: Request) -> HTTPResponse:
+    check_root_pass(request)
+    return json({
+        name: await request.app.bot_executor.run(bot.string_report) for name, bot in request.app.bots.loaded()
+    })
 
 
 @root.route('/show-bot-dict', {'GET', 'POST', 'OPTIONS'})
@@ -142,14 +215,16 @@ async def dialogue(request: Request) -> HTTPResponse:
         raise Forbidden('name parameter format error.')
     if message is None:
         raise Forbidden('message parameter format error.')
-    bot = request.app.bots.get(name, None)
     bot_id = request.app.dict_cache['name'].get(name, 'unknown')
-    if bot is None:
+    if name not in request.app.bots:
         raise Forbidden('Unknown bot name.')
     if message == '[el]#moca_bot_dict_count#':
         res = await request.app.mysql.execute_aio(core.GET_DICT_COUNT_QUERY, (bot_id,))
         return json({'res_type': 'system', 'res_content': f'学習済みデータ数: {res[0][0]}'})
-    res_type, res_content = bot.dialogue(message)
+    bot = await request.app.bots.acquire(name)
+    if bot is None:
+        raise Forbidden('Unknown bot name.')
+    res_type, res_content = await request.app.bot_executor.run(bot.dialogue, message)
     await request.app.mysql.execute_aio(
         core.INSERT_CHAT_LOG_QUERY,
         (mzk.get_remote_address(request), bot_id, message, res_content, res_type, client_id),
@@ -158,6 +233,68 @@ async def dialogue(request: Request) -> HTTPResponse:
     return json({'res_type': res_type, 'res_content': res_content})
 
 
+@root.route('/dialogue-batch', {'GET', 'POST', 'OPTIONS'})
+async def dialogue_batch(request: Request) -> HTTPResponse:
+    items, *_ = mzk.get_args(
+        request,
+        (
+            'items|dialogues',
+            list,
+            None,
+            {'max_length': request.app.system_config.get_config('bot_dialogue_batch_size', int, 256)},
+        ),
+    )
+    if items is None:
+        raise Forbidden('items parameter format error.')
+    # every item gets a result in the same order, invalid items get an error instead of failing the whole batch.
+    results: List[Optional[dict]] = [None] * len(items)
+    bots = {}
+    jobs = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = {'error': 'item format error.'}
+            continue
+        name, message, client_id = item.get('name'), item.get('message'), item.get('client_id')
+        if not isinstance(name, str) or len(name) > 32:
+            results[index] = {'error': 'name parameter format error.'}
+        elif not isinstance(message, str) or len(message) > 512:
+            results[index] = {'error': 'message parameter format error.'}
+        elif client_id is not None and (not isinstance(client_id, str) or len(client_id) > 64):
+            results[index] = {'error': 'client_id parameter format error.'}
+        elif name not in request.app.bots:
+            results[index] = {'error': 'Unknown bot name.'}
+        elif message == '[el]#moca_bot_dict_count#':
+            bot_id = request.app.dict_cache['name'].get(name, 'unknown')
+            res = await request.app.mysql.execute_aio(core.GET_DICT_COUNT_QUERY, (bot_id,))
+            results[index] = {'res_type': 'system', 'res_content': f'学習済みデータ数: {res[0][0]}'}
+        else:
+            if name not in bots:
+                bots[name] = await request.app.bots.acquire(name)
+            if bots[name] is None:
+                results[index] = {'error': 'Unknown bot name.'}
+            else:
+                jobs.append((index, name, message, client_id))
+    responses = await request.app.bot_executor.run(
+        _dialogue_batch, [(bots[name], message) for _, name, message, _ in jobs]
+    ) if jobs else []
+    ip = mzk.get_remote_address(request)
+    rows = []
+    for (index, name, message, client_id), response in zip(jobs, responses):
+        if response is None:
+            results[index] = {'error': 'dialogue error.'}
+            continue
+        res_type, res_content = response
+        results[index] = {'res_type': res_type, 'res_content': res_content}
+        bot_id = request.app.dict_cache['name'].get(name, 'unknown')
+        rows.append((ip, bot_id, message, res_content, res_type, client_id))
+    if rows:
+        # one multi-row insert, executemany can not batch a query that contains now().
+        await request.app.mysql.execute_aio(
+            core.insert_chat_logs_query(len(rows)), tuple(chain.from_iterable(rows)), True
+        )
+    return json(results)
+
+
 @root.route('/get-chat-logs', {'GET', 'POST', 'OPTIONS'})
 async def get_chat_logs(request: Request) -> HTTPResponse:
     check_root_pass(request)
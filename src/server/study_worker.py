@@ -0,0 +1,100 @@
+# -- Imports --------------------------------------------------------------------------
+
+from typing import (
+    Dict, List, Union
+)
+from asyncio import sleep
+from time import perf_counter, time
+from sanic import Sanic
+from .. import moca_modules as mzk
+from .. import core
+
+# -------------------------------------------------------------------------- Imports --
+
+# -- StudyWorker --------------------------------------------------------------------------
+
+
+class StudyWorker(object):
+    """
+    Apply the messages in the study queues of all bots in batches.
+    Every worker process runs one StudyWorker, but each queue is consumed by one process at a time.
+
+    Attributes
+    ----------
+    self._app: Sanic
+        the sanic application, bots and executors are taken from it.
+    self._metrics: Dict[str, Dict[str, Union[int, float]]]
+        the flush metrics of each bot in this process.
+    """
+
+    def __init__(self, app: Sanic):
+        self._app: Sanic = app
+        self._metrics: Dict[str, Dict[str, Union[int, float]]] = {}
+
+    async def run(self) -> None:
+        """Check the study queues forever."""
+        while True:
+            await sleep(self._app.system_config.get_config('bot_study_queue_interval', float, 1.0))
+            for name in await self._app.io_executor.run(self.pending_names):
+                try:
+                    await self.flush(name)
+                except Exception as error:
+                    mzk.print_error(f'Failed to flush the study queue of {name}. <{error}>')
+
+    @staticmethod
+    def pending_names() -> List[str]:
+        """The names of the bots whose study queue is not empty, found with one scan of the storage directory."""
+        res = []
+        for filename in core.STORAGE_DIR.glob('*/study_queue.log'):
+            try:
+                if filename.stat().st_size > 0:
+                    res.append(filename.parent.name)
+            except FileNotFoundError:
+                pass  # the bot was removed during the scan.
+        return sorted(res)
+
+    async def flush(self, name: str) -> int:
+        """Apply one batch of the study queue of the bot, and return the number of applied messages."""
+        queue = mzk.StudyQueue(core.STORAGE_DIR.joinpath(name))
+        if not await self._app.io_executor.run(queue.has_pending):
+            return 0
+        with queue.consumer_lock() as locked:
+            if not locked:
+                return 0
+            bot = await self._app.bots.acquire(name)
+            if bot is None:
+                return 0
+            messages, offset, oldest = await self._app.io_executor.run(
+                queue.take, self._app.system_config.get_config('bot_study_batch_size', int, 8192)
+            )
+            if not messages:
+                return 0
+            start = perf_counter()
+            accepted, rejected = await self._app.bot_executor.run(bot.study_messages, messages)
+            await self._app.io_executor.run(bot.save)
+            bot_id = self._app.dict_cache['name'].get(name, 'unknown')
+            pool = await self._app.mysql.get_a_aio_pool()
+            async with pool.acquire() as con:
+                async with con.cursor() as cur:
+                    await cur.executemany(core.ADD_BOT_DATA_QUERY, [(bot_id, message) for message in messages])
+                await con.commit()
+            await self._app.io_executor.run(queue.commit, offset)
+            await self._app.io_executor.run(self._app.bots.bump, name)
+        metrics = self._metrics.setdefault(name, {'batches': 0, 'accepted': 0, 'rejected': 0})
+        metrics['batches'] += 1
+        metrics['accepted'] += accepted
+        metrics['rejected'] += rejected
+        metrics['last_batch_size'] = len(messages)
+        metrics['last_flush_duration'] = round(perf_counter() - start, 4)
+        metrics['last_lag'] = round(time() - oldest, 4)
+        return len(messages)
+
+    def metrics(self) -> Dict[str, Dict[str, Union[int, float]]]:
+        """The queue depth and lag of all bots, and the flush metrics of this process."""
+        res = {}
+        for name in self._app.bots.names():
+            depth, lag = mzk.StudyQueue(core.STORAGE_DIR.joinpath(name)).stats()
+            res[name] = {'depth': depth, 'lag': round(lag, 4), **self._metrics.get(name, {})}
+        return res
+
+# -------------------------------------------------------------------------- StudyWorker --